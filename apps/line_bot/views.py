@@ -1,5 +1,6 @@
 from linebot.v3.messaging import Configuration, ApiClient, MessagingApi, PushMessageRequest, TextMessage
 from django.conf import settings
+from apps.monitor.metrics import LINE_PUSH
 
 class LineBotApi:
     def __init__(self):
@@ -15,7 +16,9 @@ class LineBotApi:
             )
 
             self.api.push_message(push_message_request=body)
+            LINE_PUSH.labels('success').inc()
             return True
         except Exception as e:
             print(f"[ERROR] LINE 推播錯誤: {e}")
+            LINE_PUSH.labels('failure').inc()
             return False
@@ -14,6 +14,7 @@ import json
 import traceback
 import uuid
 from apps.system.models import User
+from apps.monitor.metrics import count_cache
 from .line_services import LineLoginService
 
 
@@ -58,7 +59,7 @@ class LineAuthParams:
     def from_state(cls, state):
         """Retrieve params from cache using state"""
         cache_key = f"line_state_{state}"
-        cached_data_json = cache.get(cache_key)
+        cached_data_json = count_cache('line_state', cache.get(cache_key))
         
         if not cached_data_json:
             return None
@@ -388,7 +389,7 @@ def exchange_temp_token(request):
     
     # 從緩存獲取存儲的令牌和用戶數據
     cache_key = f"temp_auth_{temp_token}"
-    auth_data = cache.get(cache_key)
+    auth_data = count_cache('temp_auth', cache.get(cache_key))
 
     if not auth_data:
         return Response({
@@ -0,0 +1,267 @@
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+from .models import EndpointStat
+from .slowqueries import slow_query_buffer
+
+logger = logging.getLogger('log')
+
+RESERVOIR_SIZE = 256
+DUPLICATE_THRESHOLD = 3  # 单次请求中同一SQL模板执行次数达到该值视为N+1
+MAX_DUPLICATES = 10
+_in_params = re.compile(r'\((?:%s, )+%s\)')
+
+
+def get_sql_signature(sql):
+    """
+    SQL模板, IN列表长度不同视为同一模板
+    """
+    return _in_params.sub('(...)', sql)[:300]
+
+
+def merge_samples(samples, count, new_samples, new_count, size=RESERVOIR_SIZE):
+    """
+    合并两组蓄水池样本, count/new_count为各自代表的请求数;
+    按剩余请求数比例逐个抽取, 合并结果仍近似为全部请求的均匀抽样
+    """
+    samples, new_samples = list(samples), list(new_samples)
+    if len(samples) + len(new_samples) <= size:
+        return samples + new_samples
+    random.shuffle(samples)
+    random.shuffle(new_samples)
+    count, new_count = max(count, len(samples)), max(new_count, len(new_samples))
+    result = []
+    while len(result) < size and (samples or new_samples):
+        if samples and (not new_samples or random.random() * (count + new_count) < count):
+            result.append(samples.pop())
+            count -= 1
+        else:
+            result.append(new_samples.pop())
+            new_count -= 1
+    return result
+
+
+def merge_duplicates(duplicates, new_duplicates):
+    duplicates = dict(duplicates)
+    for sql, count in new_duplicates.items():
+        duplicates[sql] = max(duplicates.get(sql, 0), count)
+    return dict(sorted(duplicates.items(), key=lambda i: -i[1])[:MAX_DUPLICATES])
+
+
+def get_percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+class Reservoir:
+    """
+    定长蓄水池抽样
+    """
+
+    def __init__(self, size=RESERVOIR_SIZE):
+        self.size = size
+        self.seen = 0
+        self.samples = []
+
+    def add(self, value):
+        self.seen += 1
+        if len(self.samples) < self.size:
+            self.samples.append(value)
+        else:
+            i = random.randrange(self.seen)
+            if i < self.size:
+                self.samples[i] = value
+
+
+class QueryRecorder:
+    """
+    connection.execute_wrappers中使用, 记录单次请求的查询数、耗时及SQL模板,
+    耗时超过SLOW_QUERY_MS的语句记入slow
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.db_ms = 0
+        self.signatures = Counter()
+        self.slow = []
+        self.slow_ms = settings.SLOW_QUERY_MS
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            ms = (time.perf_counter() - started) * 1000
+            self.db_ms += ms
+            self.queries += 1
+            self.signatures[sql] += 1
+            if ms >= self.slow_ms and not many:
+                self.slow.append((context['connection'].alias, sql, params, ms))
+
+    def get_duplicates(self):
+        duplicates = Counter()
+        for sql, count in self.signatures.items():
+            duplicates[get_sql_signature(sql)] += count
+        return {sql: count for sql, count in duplicates.items() if count >= DUPLICATE_THRESHOLD}
+
+
+class EndpointBuffer:
+    """
+    进程内按接口汇总, 定期合并写入EndpointStat
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats = {}
+        self.last_prune = 0
+
+    def record(self, key, wall_ms, recorder, size, status_code):
+        duplicates = recorder.get_duplicates()
+        with self.lock:
+            stat = self.stats.get(key)
+            if stat is None:
+                stat = self.stats[key] = {
+                    'count': 0, 'errors': 0, 'wall_ms': 0, 'db_ms': 0, 'queries': 0, 'bytes': 0,
+                    'duplicate_requests': 0, 'wall': Reservoir(), 'query': Reservoir(), 'duplicates': {}}
+            stat['count'] += 1
+            stat['errors'] += status_code >= 500
+            stat['wall_ms'] += wall_ms
+            stat['db_ms'] += recorder.db_ms
+            stat['queries'] += recorder.queries
+            stat['bytes'] += size
+            stat['wall'].add(round(wall_ms, 1))
+            stat['query'].add(recorder.queries)
+            if duplicates:
+                stat['duplicate_requests'] += 1
+                stat['duplicates'] = merge_duplicates(stat['duplicates'], duplicates)
+
+    def flush(self):
+        with self.lock:
+            stats, self.stats = self.stats, {}
+        if not stats:
+            return
+        now = timezone.now()
+        bucket = now.replace(minute=0, second=0, microsecond=0)
+        try:
+            for (method, route, action), stat in stats.items():
+                with transaction.atomic():
+                    obj, _ = EndpointStat.objects.select_for_update().get_or_create(
+                        bucket=bucket, method=method, route=route, action=action)
+                    count = obj.count
+                    for field in ('count', 'errors', 'wall_ms', 'db_ms', 'queries', 'bytes', 'duplicate_requests'):
+                        setattr(obj, field, getattr(obj, field) + stat[field])
+                    obj.wall_samples = merge_samples(obj.wall_samples, count, stat['wall'].samples, stat['wall'].seen)
+                    obj.query_samples = merge_samples(obj.query_samples, count, stat['query'].samples, stat['query'].seen)
+                    obj.duplicates = merge_duplicates(obj.duplicates, stat['duplicates'])
+                    obj.save()
+            if time.monotonic() - self.last_prune >= 3600:
+                self.last_prune = time.monotonic()
+                EndpointStat.objects.filter(
+                    bucket__lt=now - timedelta(days=settings.ENDPOINT_METRICS_RETENTION_DAYS)).delete()
+        except Exception:
+            logger.exception('接口统计写入失败')
+
+
+endpoint_buffer = EndpointBuffer()
+
+
+class MetricsFlusher:
+    """
+    后台线程每ENDPOINT_METRICS_FLUSH_SECONDS秒写入接口统计及慢查询, 写入(含加锁合并、EXPLAIN)不在请求中执行;
+    首次使用时启动, fork后的子进程重新启动
+    """
+
+    def __init__(self, *buffers):
+        self.buffers = buffers
+        self.lock = threading.Lock()
+        self.pid = None
+
+    def ensure_started(self):
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            thread = threading.Thread(target=self.run, name='metrics-flusher', daemon=True)
+            thread.start()
+
+    def run(self):
+        pid = self.pid
+        while pid == self.pid:
+            time.sleep(settings.ENDPOINT_METRICS_FLUSH_SECONDS)
+            try:
+                self.flush()
+            finally:
+                connections.close_all()  # 本线程的连接, 两次写入之间不占用
+
+    def flush(self):
+        for buffer in self.buffers:
+            buffer.flush()
+
+
+metrics_flusher = MetricsFlusher(endpoint_buffer, slow_query_buffer)
+
+
+ORDERINGS = {
+    'queries': 'avg_queries',
+    'wall': 'p95_wall_ms',
+    'db': 'db_ms',
+    'count': 'count',
+    'duplicates': 'duplicate_requests',
+    'bytes': 'avg_bytes',
+}
+
+
+def get_endpoint_ranking(hours=24, order='queries', limit=50):
+    """
+    汇总最近若干小时的接口统计并排序
+    """
+    since = timezone.now() - timedelta(hours=hours)
+    groups = {}
+    for obj in EndpointStat.objects.filter(bucket__gte=since.replace(minute=0, second=0, microsecond=0)):
+        key = (obj.method, obj.route, obj.action)
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = {'method': obj.method, 'route': obj.route, 'action': obj.action,
+                                   'count': 0, 'errors': 0, 'wall_ms': 0, 'db_ms': 0, 'queries': 0, 'bytes': 0,
+                                   'duplicate_requests': 0, 'wall_samples': [], 'query_samples': [],
+                                   'duplicates': {}}
+        count = group['count']
+        for field in ('count', 'errors', 'wall_ms', 'db_ms', 'queries', 'bytes', 'duplicate_requests'):
+            group[field] += getattr(obj, field)
+        group['wall_samples'] = merge_samples(group['wall_samples'], count, obj.wall_samples, obj.count)
+        group['query_samples'] = merge_samples(group['query_samples'], count, obj.query_samples, obj.count)
+        group['duplicates'] = merge_duplicates(group['duplicates'], obj.duplicates)
+    results = []
+    for group in groups.values():
+        count = group['count'] or 1
+        results.append({
+            'method': group['method'],
+            'route': group['route'],
+            'action': group['action'],
+            'count': group['count'],
+            'errors': group['errors'],
+            'avg_wall_ms': round(group['wall_ms'] / count, 1),
+            'p50_wall_ms': get_percentile(group['wall_samples'], 50),
+            'p95_wall_ms': get_percentile(group['wall_samples'], 95),
+            'db_ms': round(group['db_ms'], 1),
+            'avg_db_ms': round(group['db_ms'] / count, 1),
+            'avg_queries': round(group['queries'] / count, 1),
+            'p95_queries': get_percentile(group['query_samples'], 95),
+            'avg_bytes': int(group['bytes'] / count),
+            'duplicate_requests': group['duplicate_requests'],
+            'duplicates': [{'sql': k, 'max_count': v} for k, v in group['duplicates'].items()],
+        })
+    results.sort(key=lambda i: i[ORDERINGS[order]] or 0, reverse=True)
+    return results[:limit]
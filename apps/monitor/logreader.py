@@ -0,0 +1,183 @@
+import gzip
+import os
+import re
+import threading
+from collections import OrderedDict, deque
+from django.conf import settings
+
+LOG_NAME = re.compile(r'^[\w.-]+$')
+BLOCK_SIZE = 64 * 1024
+INDEX_STEP = 1000  # 稀疏行索引: 每INDEX_STEP行记录一次字节偏移
+INDEX_MAX_FILES = 32
+GREP_MAX_BYTES = 64 * 1024 * 1024  # 单次搜索最多扫描的字节数, 超出时返回next继续
+READ_ALL_MAX_BYTES = 1024 * 1024  # 不指定方式时最多读取的字节数
+
+
+def get_log_file(name):
+    """
+    日志文件路径, 名称不合法(如含路径)或不存在时返回None
+    """
+    if not LOG_NAME.match(name):
+        return None
+    filepath = os.path.join(settings.LOG_PATH, name)
+    return filepath if os.path.isfile(filepath) else None
+
+
+def open_log(filepath):
+    """
+    以二进制方式打开, .gz文件透明解压(偏移为解压后的偏移)
+    """
+    if filepath.endswith('.gz'):
+        return gzip.open(filepath, 'rb')
+    return open(filepath, 'rb')
+
+
+def decode(data):
+    return data.decode('utf-8', errors='replace')
+
+
+def read_range(filepath, offset=0, size=BLOCK_SIZE):
+    """
+    读取[offset, offset+size)的完整行: 丢弃开头不完整的行, 末尾不完整的行留给下一次
+    """
+    with open_log(filepath) as f:
+        if offset:
+            f.seek(offset - 1)
+            if f.read(1) != b'\n':  # offset不在行首, 跳到下一行
+                offset += len(f.readline())
+        f.seek(offset)
+        data = f.read(size)
+        rest = f.read(1)
+        eof = not rest
+        if not eof:
+            end = data.rfind(b'\n')
+            if end >= 0:
+                data = data[:end + 1]
+            else:  # 单行超过size时补齐该行
+                data += rest + f.readline()
+        return {'content': decode(data), 'offset': offset, 'next': offset + len(data), 'eof': eof}
+
+
+def read_all(filepath, max_size=READ_ALL_MAX_BYTES):
+    """
+    读取文件开头至多max_size字节的完整行(.gz文件只解压到该位置), 超出时truncated为True, 其余部分按next以range读取
+    """
+    data = read_range(filepath, 0, max_size)
+    data['truncated'] = not data['eof']
+    return data
+
+
+def read_tail(filepath, lines=200):
+    """
+    读取最后若干行, 普通文件从末尾按块向前读取, .gz文件只能顺序解压
+    """
+    if filepath.endswith('.gz'):
+        with open_log(filepath) as f:
+            tail = deque(f, maxlen=lines)
+            end = f.tell()
+        data = b''.join(tail)
+        return {'content': decode(data), 'offset': end - len(data), 'next': end, 'eof': True}
+    with open(filepath, 'rb') as f:
+        end = f.seek(0, os.SEEK_END)
+        position, data = end, b''
+        # 末尾换行不计入行数
+        while position > 0 and data.count(b'\n') <= lines:
+            size = min(BLOCK_SIZE, position)
+            position -= size
+            f.seek(position)
+            data = f.read(size) + data
+        parts = data.split(b'\n')
+        if parts and parts[-1] == b'':
+            parts.pop()
+            suffix = b'\n'
+        else:
+            suffix = b''
+        data = b'\n'.join(parts[-lines:]) + suffix if lines else b''
+        return {'content': decode(data), 'offset': end - len(data), 'next': end, 'eof': True}
+
+
+def grep(filepath, pattern, offset=0, limit=200, ignore_case=False, regex=False):
+    """
+    从offset开始逐行搜索, 返回最多limit条匹配行及其字节偏移; 未扫描完时next为下次搜索的起点
+    """
+    flags = re.IGNORECASE if ignore_case else 0
+    matcher = re.compile(pattern if regex else re.escape(pattern), flags)
+    matches = []
+    with open_log(filepath) as f:
+        position = offset
+        if offset:
+            f.seek(offset - 1)
+            if f.read(1) != b'\n':
+                position += len(f.readline())
+        f.seek(position)
+        scanned = 0
+        for line in f:
+            text = decode(line)
+            if matcher.search(text):
+                matches.append({'offset': position, 'line': text.rstrip('\r\n')})
+            position += len(line)
+            scanned += len(line)
+            if len(matches) >= limit or scanned >= GREP_MAX_BYTES:
+                break
+        eof = not f.read(1)
+    return {'matches': matches, 'offset': offset, 'next': None if eof else position, 'eof': eof}
+
+
+class LineIndex:
+    """
+    进程内缓存的稀疏行索引, 日志只追加, 文件变大时从已索引的位置继续
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.indexes = OrderedDict()
+
+    def get(self, filepath):
+        stat = os.stat(filepath)
+        with self.lock:
+            index = self.indexes.pop(filepath, None)
+            if index is None or index['inode'] != stat.st_ino or index['size'] > stat.st_size:
+                index = {'inode': stat.st_ino, 'size': 0, 'lines': 0, 'offsets': [0], 'end': 0}
+            if index['size'] != stat.st_size:
+                self.extend(filepath, index, stat.st_size)
+            self.indexes[filepath] = index
+            while len(self.indexes) > INDEX_MAX_FILES:
+                self.indexes.popitem(last=False)
+            return index
+
+    def extend(self, filepath, index, size):
+        with open_log(filepath) as f:
+            f.seek(index['end'])
+            lines, position = index['lines'], index['end']
+            for line in f:
+                if not line.endswith(b'\n'):  # 未写完的行下次再索引
+                    break
+                position += len(line)
+                lines += 1
+                if lines % INDEX_STEP == 0:
+                    index['offsets'].append(position)
+        index.update(size=size, lines=lines, end=position)
+
+
+line_index = LineIndex()
+
+
+def read_lines(filepath, start=0, lines=200):
+    """
+    按行号分页读取, 通过稀疏索引定位到最近的索引行后顺序跳过剩余行
+    """
+    index = line_index.get(filepath)
+    start = min(start, index['lines'])
+    block = min(start // INDEX_STEP, len(index['offsets']) - 1)
+    result = []
+    with open_log(filepath) as f:
+        f.seek(index['offsets'][block])
+        current = block * INDEX_STEP
+        for line in f:
+            if current >= start:
+                if len(result) >= lines or current >= index['lines']:  # 不含未写完的行
+                    break
+                result.append(line)
+            current += 1
+    return {'content': decode(b''.join(result)), 'start': start, 'next': start + len(result),
+            'total': index['lines'], 'eof': start + len(result) >= index['lines']}
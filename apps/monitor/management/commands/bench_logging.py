@@ -0,0 +1,115 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from logging.handlers import RotatingFileHandler
+from django.core.management.base import BaseCommand
+from utils.log import DailyFileHandler, JsonFormatter, LoggerNameFilter, QueueListenerHandler, RequestIdFilter, \
+    request_id
+from apps.monitor.endpoints import get_percentile
+
+STANDARD_FORMAT = '[%(asctime)s] [%(filename)s:%(lineno)d] [%(module)s:%(funcName)s] [%(levelname)s]- %(message)s'
+
+
+def get_sync_handlers(path):
+    """
+    原配置: 请求线程内同步写入三个RotatingFileHandler
+    """
+    handlers = []
+    for name, level in (('all', logging.INFO), ('error', logging.ERROR), ('info', logging.INFO)):
+        handler = RotatingFileHandler(os.path.join(path, name + '.log'), maxBytes=1024 * 1024 * 5, backupCount=5,
+                                      encoding='utf-8')
+        handler.setLevel(level)
+        handler.setFormatter(logging.Formatter(STANDARD_FORMAT))
+        handlers.append(handler)
+    return handlers
+
+
+def get_queue_handlers(path, maxsize):
+    """
+    现配置: 入队后由后台线程写入按日期命名的JSON行文件
+    """
+    handlers = []
+    for name, level in (('all', logging.INFO), ('error', logging.ERROR), ('info', logging.INFO)):
+        handler = DailyFileHandler(os.path.join(path, name))
+        handler.setLevel(level)
+        handler.setFormatter(JsonFormatter())
+        if name != 'all':
+            handler.addFilter(LoggerNameFilter(['bench']))
+        handlers.append(handler)
+    handler = QueueListenerHandler(handlers, maxsize=maxsize)
+    handler.addFilter(RequestIdFilter())
+    return [handler]
+
+
+class Command(BaseCommand):
+    help = '多线程并发下对比同步文件日志与队列日志的吞吐及调用耗时'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--records', type=int, default=5000, help='每个线程写入的日志条数')
+        parser.add_argument('--queue-size', type=int, default=100000)
+
+    def bench(self, handlers, threads, records):
+        logger = logging.getLogger('bench')
+        logger.handlers, logger.propagate = handlers, False
+        logger.setLevel(logging.INFO)
+        latencies = []
+        lock = threading.Lock()
+        start = threading.Barrier(threads + 1)
+
+        def work(n):
+            local = []
+            request_id.set('bench-{}'.format(n))
+            start.wait()
+            for i in range(records):
+                began = time.perf_counter()
+                if i % 100 == 0:
+                    logger.error('线程%s 第%s条 失败', n, i)
+                else:
+                    logger.info('线程%s 第%s条 %s', n, i, {'user': n, 'ticket': i})
+                local.append((time.perf_counter() - began) * 1e6)
+            with lock:
+                latencies.extend(local)
+
+        workers = [threading.Thread(target=work, args=(n,)) for n in range(threads)]
+        for worker in workers:
+            worker.start()
+        start.wait()
+        began = time.perf_counter()
+        for worker in workers:
+            worker.join()
+        emitted = time.perf_counter() - began
+        for handler in handlers:
+            if isinstance(handler, QueueListenerHandler):
+                handler.stop()  # 等待队列写完
+        written = time.perf_counter() - began
+        dropped = sum(getattr(i, 'dropped', 0) for i in handlers)
+        for handler in handlers:
+            for i in getattr(handler, 'handlers', []):
+                i.close()
+            handler.close()
+        logger.handlers = []
+        total = threads * records
+        return {
+            'records': total,
+            'dropped': dropped,
+            'emit_seconds': round(emitted, 3),
+            'written_seconds': round(written, 3),
+            'emit_per_second': int(total / emitted),
+            'written_per_second': int((total - dropped) / written),
+            'p50_call_us': round(get_percentile(latencies, 50), 1),
+            'p99_call_us': round(get_percentile(latencies, 99), 1),
+            'max_call_us': round(max(latencies), 1),
+        }
+
+    def handle(self, *args, **options):
+        threads, records = options['threads'], options['records']
+        result = {'threads': threads, 'records_per_thread': records}
+        with tempfile.TemporaryDirectory() as path:
+            result['sync'] = self.bench(get_sync_handlers(path), threads, records)
+        with tempfile.TemporaryDirectory() as path:
+            result['queue'] = self.bench(get_queue_handlers(path, options['queue_size']), threads, records)
+        self.stdout.write(json.dumps(result, indent=2, ensure_ascii=False))
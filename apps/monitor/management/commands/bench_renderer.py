@@ -0,0 +1,91 @@
+import json
+import time
+from datetime import datetime
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+
+class LegacyRenderer(JSONRenderer):
+    """
+    原FitJSONRenderer(标准库json), 代码与替换前相同, 用于对比
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        from utils.response import BaseResponse
+        response_body = BaseResponse()
+        response = renderer_context.get("response")
+        response_body.code = response.status_code
+        if response_body.code >= 400:  # 响应异常
+            response_body.data = data  # data里是详细异常信息
+            prefix = ""
+            if isinstance(data, dict):
+                prefix = list(data.keys())[0]
+                data = data[prefix]
+            if isinstance(data, list):
+                data = data[0]
+            response_body.msg = prefix + ":" + str(data) # 取一部分放入msg,方便前端alert
+        else:
+            response_body.data = data
+        renderer_context.get("response").status_code = 200  # 统一成200响应,用code区分
+        return super(LegacyRenderer, self).render(response_body.dict, accepted_media_type, renderer_context)
+
+
+def get_payload(rows):
+    """
+    模拟工单列表分页数据
+    """
+    now = timezone.now()
+    return {
+        'count': rows,
+        'next': None,
+        'previous': None,
+        'results': [{
+            'id': i,
+            'title': '請假申請 {}'.format(i),
+            'sn': 'hb_20240101{:04d}'.format(i),
+            'workflow': 1,
+            'workflow_': {'id': 1, 'name': '請假流程'},
+            'state': 3,
+            'state_': {'id': 3, 'name': '主管審批', 'type': 0, 'distribute_type': 1, 'enable_retreat': False},
+            'act_state': 1,
+            'create_time': now.strftime('%Y-%m-%d %H:%M:%S'),
+            'update_time': now,
+            'participant': [1, 2, 3],
+            'amount': Decimal('12.50'),
+            'ticket_data': {'days': i % 10, 'reason': '出差\u2028', 1: 'non-str key'},
+        } for i in range(rows)],
+    }
+
+
+class Command(BaseCommand):
+    help = '对比FitJSONRenderer(orjson)与原渲染器(标准库json)的渲染耗时及输出; 含NaN/Infinity的数据原渲染器报错, orjson输出null'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=500, help='每次渲染的列表行数')
+        parser.add_argument('--repeat', type=int, default=200)
+
+    def bench(self, renderer, payload, repeat):
+        output = None
+        started = time.perf_counter()
+        for _ in range(repeat):
+            output = renderer.render(payload, renderer_context={'response': Response(status=200)})
+        return (time.perf_counter() - started) / repeat * 1000, output
+
+    def handle(self, *args, **options):
+        # utils.response依赖rest_framework.views, 而后者加载时又导入渲染器, 故延迟导入
+        from utils.response import FitJSONRenderer, orjson
+        payload = get_payload(options['rows'])
+        legacy_ms, legacy_out = self.bench(LegacyRenderer(), payload, options['repeat'])
+        fit_ms, fit_out = self.bench(FitJSONRenderer(), payload, options['repeat'])
+        self.stdout.write(json.dumps({
+            'orjson': orjson.__version__ if orjson else None,
+            'rows': options['rows'],
+            'legacy_ms': round(legacy_ms, 3),
+            'fit_ms': round(fit_ms, 3),
+            'speedup': round(legacy_ms / fit_ms, 2) if fit_ms else None,
+            'bytes': len(fit_out),
+            'same_bytes': legacy_out == fit_out,
+        }, indent=2, sort_keys=True))
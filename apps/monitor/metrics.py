@@ -0,0 +1,82 @@
+"""
+Prometheus指标
+多进程部署时需在进程启动前设置环境变量PROMETHEUS_MULTIPROC_DIR(各worker及celery共享的目录),
+各进程将指标写入该目录下的文件, 采集时合并
+"""
+import os
+from django.db import connections
+from django.db.backends.signals import connection_created
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client import multiprocess
+from utils.db.pool import get_pool_stats
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+REQUEST_LATENCY = Histogram('http_request_duration_seconds', '接口耗时', ['method', 'route', 'status'],
+                            buckets=LATENCY_BUCKETS)
+CACHE_REQUESTS = Counter('cache_requests_total', '缓存读取次数', ['family', 'result'])
+DB_CONNECTIONS_OPEN = Gauge('db_connections_open', '当前打开的数据库连接数', ['alias'], multiprocess_mode='livesum')
+DB_CONNECTIONS_CREATED = Counter('db_connections_created_total', '新建数据库连接次数', ['alias'])
+DB_POOL_CONNECTIONS = Gauge('db_pool_connections', '连接池连接数', ['alias', 'state'], multiprocess_mode='livesum')
+DB_POOL_EVENTS = Counter('db_pool_events_total', '连接池事件次数(新建、关闭、等待、等待超时、ping失败)',
+                         ['alias', 'event'])
+DB_POOL_WAIT = Counter('db_pool_wait_seconds_total', '等待连接池的总秒数', ['alias'])
+CELERY_TASKS = Counter('celery_tasks_total', 'Celery任务执行次数', ['task', 'state'])
+CELERY_TASK_LATENCY = Histogram('celery_task_duration_seconds', 'Celery任务耗时', ['task'],
+                                buckets=LATENCY_BUCKETS + (60, 300, 1800))
+LINE_PUSH = Counter('line_push_total', 'LINE推播次数', ['result'])
+
+
+def count_cache(family, value):
+    """
+    记录一次缓存读取, 原样返回读取结果
+    """
+    CACHE_REQUESTS.labels(family, 'miss' if value is None else 'hit').inc()
+    return value
+
+
+def update_db_connections():
+    """
+    记录本进程各数据库别名的连接是否打开, 多进程下为各进程之和
+    """
+    for conn in connections.all(initialized_only=True):
+        DB_CONNECTIONS_OPEN.labels(conn.alias).set(int(conn.connection is not None))
+    update_db_pools()
+
+
+_last_pool_stats = {}
+
+
+def update_db_pools():
+    """
+    记录本进程连接池的占用、空闲数, 累计值按上次记录的差值增加
+    """
+    for alias, stats in get_pool_stats().items():
+        DB_POOL_CONNECTIONS.labels(alias, 'in_use').set(stats['in_use'])
+        DB_POOL_CONNECTIONS.labels(alias, 'idle').set(stats['idle'])
+        last = _last_pool_stats.get(alias, {})
+        for event in ('created', 'closed', 'waits', 'timeouts', 'ping_failures'):
+            if stats[event] > last.get(event, 0):
+                DB_POOL_EVENTS.labels(alias, event).inc(stats[event] - last.get(event, 0))
+        if stats['wait_seconds'] > last.get('wait_seconds', 0):
+            DB_POOL_WAIT.labels(alias).inc(stats['wait_seconds'] - last.get('wait_seconds', 0))
+        _last_pool_stats[alias] = stats
+
+
+def on_connection_created(sender, connection, **kwargs):
+    DB_CONNECTIONS_CREATED.labels(connection.alias).inc()
+
+
+connection_created.connect(on_connection_created, dispatch_uid='monitor_connection_created')
+
+
+def get_metrics():
+    """
+    返回(内容, Content-Type)
+    """
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
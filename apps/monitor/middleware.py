@@ -1 +1,118 @@
+import asyncio
+import re
+import time
+import uuid
+from django.conf import settings
+from django.db import connections
 from django.utils.deprecation import MiddlewareMixin
+from apps.system.permission import has_perm
+from utils.log import request_id
+from .endpoints import QueryRecorder, endpoint_buffer, metrics_flusher
+from .metrics import REQUEST_LATENCY, update_db_connections
+from .slowqueries import slow_query_buffer
+from .profiling import run_profiled
+
+
+REQUEST_ID = re.compile(r'^[\w.-]{1,64}$')
+
+
+class RequestIdMiddleware(MiddlewareMixin):
+    """
+    读取请求头X-Request-ID(无或不合法时生成), 写入日志上下文并通过响应头返回
+    """
+
+    def process_request(self, request):
+        value = request.META.get('HTTP_X_REQUEST_ID', '')
+        if not REQUEST_ID.match(value):
+            value = uuid.uuid4().hex
+        request.request_id = value
+        request._request_id_token = request_id.set(value)
+
+    def process_response(self, request, response):
+        token = getattr(request, '_request_id_token', None)
+        if token is not None:
+            response['X-Request-ID'] = request.request_id
+            request_id.reset(token)
+        return response
+
+
+class EndpointMetricsMiddleware(MiddlewareMixin):
+    """
+    按路由及action统计耗时、数据库耗时、查询数、重复查询及响应大小, 同时记录Prometheus指标及慢查询
+    """
+
+    def process_request(self, request):
+        if not settings.ENDPOINT_METRICS:
+            return
+        metrics_flusher.ensure_started()
+        recorder = QueryRecorder()
+        for conn in connections.all():
+            conn.execute_wrappers.append(recorder)
+        request._endpoint_metrics = (time.perf_counter(), recorder)
+
+    def process_response(self, request, response):
+        metrics = getattr(request, '_endpoint_metrics', None)
+        if metrics is None:
+            return response
+        started, recorder = metrics
+        for conn in connections.all():
+            if recorder in conn.execute_wrappers:
+                conn.execute_wrappers.remove(recorder)
+        match = getattr(request, 'resolver_match', None)
+        if match is not None:  # 未匹配路由的请求(如404)不统计
+            route = (match.route or match.view_name or '').replace('^', '').replace('$', '')[:200]
+            actions = getattr(match.func, 'actions', None) or {}
+            key = (request.method, route, actions.get(request.method.lower(), ''))
+            if response.streaming:
+                size = int(response.get('Content-Length', 0) or 0)
+            else:
+                size = len(response.content)
+            wall = time.perf_counter() - started
+            endpoint_buffer.record(key, wall * 1000, recorder, size, response.status_code)
+            REQUEST_LATENCY.labels(request.method, route, '{}xx'.format(response.status_code // 100)).observe(wall)
+            for alias, sql, params, ms in recorder.slow:
+                slow_query_buffer.record(alias, sql, params, ms, route)
+        update_db_connections()  # 统计由metrics_flusher在后台写入
+        return response
+
+
+def get_monitor_user(request):
+    """
+    会话或JWT认证且拥有监控权限(monitor_view, 超级管理员拥有全部权限)的用户, 否则返回None
+    """
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        from rest_framework_simplejwt.authentication import JWTAuthentication
+        try:
+            result = JWTAuthentication().authenticate(request)
+        except Exception:
+            return None
+        user = result[0] if result is not None else None
+    return user if has_perm(user, 'monitor_view') else None
+
+
+class ProfilerMiddleware(MiddlewareMixin):
+    """
+    有监控权限的用户请求携带请求头X-Profile或参数_profile(cprofile|sample)时, 在分析器下执行视图并保存报告,
+    报告名通过响应头X-Profile-Report返回; 未携带时不做任何处理
+    """
+    modes = ('1', 'cprofile', 'sample')
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        mode = request.META.get('HTTP_X_PROFILE') or request.GET.get('_profile')
+        if not mode:
+            return None
+        if mode not in self.modes or asyncio.iscoroutinefunction(view_func):
+            return None
+        user = get_monitor_user(request)
+        if user is None:  # 无监控权限忽略
+            return None
+
+        def call():
+            response = view_func(request, *view_args, **view_kwargs)
+            if hasattr(response, 'render') and callable(response.render):
+                response = response.render()  # 渲染计入分析
+            return response
+        response, name = run_profiled('sample' if mode == 'sample' else 'cprofile', request, user, call)
+        response['X-Profile-Report'] = name
+        return response
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.11 on 2026-10-19 19:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EndpointStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField(db_index=True, verbose_name='统计时段')),
+                ('method', models.CharField(max_length=10, verbose_name='请求方法')),
+                ('route', models.CharField(max_length=200, verbose_name='路由')),
+                ('action', models.CharField(blank=True, default='', max_length=50, verbose_name='动作')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='请求数')),
+                ('errors', models.PositiveIntegerField(default=0, verbose_name='5xx数')),
+                ('wall_ms', models.FloatField(default=0, verbose_name='总耗时(ms)')),
+                ('db_ms', models.FloatField(default=0, verbose_name='数据库总耗时(ms)')),
+                ('queries', models.PositiveBigIntegerField(default=0, verbose_name='总查询数')),
+                ('bytes', models.PositiveBigIntegerField(default=0, verbose_name='响应总字节')),
+                ('duplicate_requests', models.PositiveIntegerField(default=0, verbose_name='存在重复查询的请求数')),
+                ('wall_samples', models.JSONField(blank=True, default=list, verbose_name='耗时样本')),
+                ('query_samples', models.JSONField(blank=True, default=list, verbose_name='查询数样本')),
+                ('duplicates', models.JSONField(blank=True, default=dict, help_text='SQL模板 -> 最大单次重复次数', verbose_name='重复查询')),
+            ],
+            options={
+                'verbose_name': '接口统计',
+                'verbose_name_plural': '接口统计',
+                'unique_together': {('bucket', 'method', 'route', 'action')},
+            },
+        ),
+    ]
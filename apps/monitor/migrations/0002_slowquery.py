@@ -0,0 +1,35 @@
+# Generated by Django 4.2.11 on 2026-10-19 19:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monitor', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlowQuery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fingerprint', models.CharField(max_length=32, unique=True, verbose_name='指纹')),
+                ('sql', models.TextField(verbose_name='SQL模板')),
+                ('sample', models.TextField(blank=True, default='', verbose_name='示例参数')),
+                ('alias', models.CharField(default='default', max_length=50, verbose_name='数据库')),
+                ('route', models.CharField(blank=True, default='', max_length=200, verbose_name='最近路由')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='次数')),
+                ('total_ms', models.FloatField(default=0, verbose_name='总耗时(ms)')),
+                ('max_ms', models.FloatField(default=0, verbose_name='最大耗时(ms)')),
+                ('plan', models.TextField(blank=True, default='', verbose_name='执行计划')),
+                ('first_seen', models.DateTimeField(auto_now_add=True, verbose_name='首次出现')),
+                ('last_seen', models.DateTimeField(auto_now=True, verbose_name='最近出现')),
+            ],
+            options={
+                'verbose_name': '慢查询',
+                'verbose_name_plural': '慢查询',
+                'indexes': [models.Index(fields=['total_ms'], name='monitor_slo_total_m_fd3ce0_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.11 on 2026-10-19 20:11
+
+import re
+from django.db import migrations, models
+
+_string_literals = re.compile(r"'(?:[^'\\]|\\.|'')*'")
+
+
+def redact_slow_queries(apps, schema_editor):
+    """
+    已保存的参数值清空, 执行计划中的字符串常量替换为?
+    """
+    SlowQuery = apps.get_model('monitor', 'SlowQuery')
+    SlowQuery.objects.update(sample='')
+    for pk, plan in SlowQuery.objects.values_list('pk', 'plan'):
+        redacted = _string_literals.sub("'?'", plan)
+        if redacted != plan:
+            SlowQuery.objects.filter(pk=pk).update(plan=redacted)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monitor', '0002_slowquery'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='slowquery',
+            name='sample',
+            field=models.TextField(blank=True, default='', verbose_name='参数类型'),
+        ),
+        migrations.RunPython(redact_slow_queries, migrations.RunPython.noop),
+    ]
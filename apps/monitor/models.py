@@ -1,3 +1,56 @@
 from django.db import models
 
 # Create your models here.
+
+
+class EndpointStat(models.Model):
+    """
+    接口请求统计, 按小时汇总, 由各进程定期合并写入
+    """
+    bucket = models.DateTimeField('统计时段', db_index=True)
+    method = models.CharField('请求方法', max_length=10)
+    route = models.CharField('路由', max_length=200)
+    action = models.CharField('动作', max_length=50, default='', blank=True)
+    count = models.PositiveIntegerField('请求数', default=0)
+    errors = models.PositiveIntegerField('5xx数', default=0)
+    wall_ms = models.FloatField('总耗时(ms)', default=0)
+    db_ms = models.FloatField('数据库总耗时(ms)', default=0)
+    queries = models.PositiveBigIntegerField('总查询数', default=0)
+    bytes = models.PositiveBigIntegerField('响应总字节', default=0)
+    duplicate_requests = models.PositiveIntegerField('存在重复查询的请求数', default=0)
+    wall_samples = models.JSONField('耗时样本', default=list, blank=True)
+    query_samples = models.JSONField('查询数样本', default=list, blank=True)
+    duplicates = models.JSONField('重复查询', default=dict, blank=True, help_text='SQL模板 -> 最大单次重复次数')
+
+    class Meta:
+        verbose_name = '接口统计'
+        verbose_name_plural = verbose_name
+        unique_together = ('bucket', 'method', 'route', 'action')
+
+    def __str__(self):
+        return '{} {} {}'.format(self.method, self.route, self.action)
+
+
+class SlowQuery(models.Model):
+    """
+    慢查询, 按SQL指纹汇总, 新指纹执行一次EXPLAIN
+    """
+    fingerprint = models.CharField('指纹', max_length=32, unique=True)
+    sql = models.TextField('SQL模板')
+    sample = models.TextField('参数类型', default='', blank=True)
+    alias = models.CharField('数据库', max_length=50, default='default')
+    route = models.CharField('最近路由', max_length=200, default='', blank=True)
+    count = models.PositiveIntegerField('次数', default=0)
+    total_ms = models.FloatField('总耗时(ms)', default=0)
+    max_ms = models.FloatField('最大耗时(ms)', default=0)
+    plan = models.TextField('执行计划', default='', blank=True)
+    first_seen = models.DateTimeField('首次出现', auto_now_add=True)
+    last_seen = models.DateTimeField('最近出现', auto_now=True)
+
+    class Meta:
+        verbose_name = '慢查询'
+        verbose_name_plural = verbose_name
+        indexes = [models.Index(fields=['total_ms'])]
+
+    def __str__(self):
+        return self.fingerprint
@@ -0,0 +1,147 @@
+import cProfile
+import io
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from django.conf import settings
+from django.utils import timezone
+
+PROFILE_NAME = re.compile(r'^[\w.-]+$')
+TREE_MIN_PERCENT = 1
+
+
+class SamplingProfiler:
+    """
+    采样分析: 后台线程按固定间隔抓取目标线程的调用栈
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = Counter()
+
+    def start(self):
+        self.thread_id = threading.get_ident()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('{}:{}({})'.format(code.co_filename, code.co_firstlineno, code.co_name))
+                frame = frame.f_back
+            if stack:
+                self.samples[tuple(reversed(stack))] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def get_folded(self):
+        """
+        折叠栈格式, 可直接用于火焰图工具
+        """
+        return ''.join('{} {}\n'.format(';'.join(stack), count) for stack, count in self.samples.most_common())
+
+    def get_summary(self, limit=30):
+        total = sum(self.samples.values()) or 1
+        own, inclusive, tree = Counter(), Counter(), {}
+        for stack, count in self.samples.items():
+            own[stack[-1]] += count
+            for func in set(stack):
+                inclusive[func] += count
+            node = tree
+            for func in stack:
+                child = node.setdefault(func, [0, {}])
+                child[0] += count
+                node = child[1]
+        lines = ['samples: {} interval: {}ms'.format(total, self.interval * 1000), '', '== 自身耗时 top ==']
+        lines += ['{:6.1f}% {}'.format(count * 100 / total, func) for func, count in own.most_common(limit)]
+        lines += ['', '== 累计耗时 top ==']
+        lines += ['{:6.1f}% {}'.format(count * 100 / total, func) for func, count in inclusive.most_common(limit)]
+        lines += ['', '== 调用树(>={}%) =='.format(TREE_MIN_PERCENT)]
+
+        def walk(node, depth):
+            for func, (count, children) in sorted(node.items(), key=lambda i: -i[1][0]):
+                if count * 100 / total < TREE_MIN_PERCENT:
+                    continue
+                lines.append('{:6.1f}% {}{}'.format(count * 100 / total, '  ' * depth, func))
+                walk(children, depth + 1)
+        walk(tree, 0)
+        return '\n'.join(lines) + '\n'
+
+
+def get_cprofile_summary(profiler, limit=30):
+    stream = io.StringIO()
+    stats = pstats.Stats(profiler, stream=stream)
+    stream.write('== 累计耗时 top ==\n')
+    stats.sort_stats('cumulative').print_stats(limit)
+    stream.write('== 自身耗时 top ==\n')
+    stats.sort_stats('tottime').print_stats(limit)
+    stream.write('== 调用树(累计耗时top函数的被调用函数) ==\n')
+    stats.sort_stats('cumulative').print_callees(limit // 2)
+    return stream.getvalue()
+
+
+def get_profile_path():
+    path = settings.PROFILE_PATH
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def run_profiled(mode, request, user, func):
+    """
+    在分析器下执行func, 保存报告, 返回(func结果, 报告文件名前缀)
+    mode: cprofile(确定性) 或 sample(采样)
+    """
+    started = time.perf_counter()
+    if mode == 'sample':
+        profiler = SamplingProfiler()
+        profiler.start()
+        try:
+            result = func()
+        finally:
+            profiler.stop()
+    else:
+        profiler = cProfile.Profile()
+        result = profiler.runcall(func)
+    elapsed = (time.perf_counter() - started) * 1000
+    path = get_profile_path()
+    base = '{}_{}_{}_{}'.format(timezone.localtime().strftime('%Y%m%d%H%M%S%f'), mode, request.method,
+                                re.sub(r'\W+', '_', request.path).strip('_')[:60])
+    header = '{} {}\nuser: {}\nelapsed: {:.1f}ms\n\n'.format(request.method, request.get_full_path(),
+                                                           user, elapsed)
+    if mode == 'sample':
+        with open(os.path.join(path, base + '.folded'), 'w', encoding='utf-8') as f:
+            f.write(profiler.get_folded())
+        summary = profiler.get_summary()
+    else:
+        profiler.dump_stats(os.path.join(path, base + '.prof'))
+        summary = get_cprofile_summary(profiler)
+    with open(os.path.join(path, base + '.txt'), 'w', encoding='utf-8') as f:
+        f.write(header + summary)
+    prune_profiles(path)
+    return result, base
+
+
+def prune_profiles(path):
+    files = sorted((os.path.join(path, i) for i in os.listdir(path)), key=os.path.getmtime, reverse=True)
+    for i in files[settings.PROFILE_MAX_FILES:]:
+        os.remove(i)
+
+
+def get_profile_file(name):
+    """
+    报告文件路径, 名称不合法或不存在时返回None
+    """
+    if not PROFILE_NAME.match(name):
+        return None
+    filepath = os.path.join(get_profile_path(), name)
+    return filepath if os.path.isfile(filepath) else None
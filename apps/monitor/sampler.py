@@ -0,0 +1,131 @@
+import os
+import threading
+import time
+from collections import deque
+import psutil
+from django.conf import settings
+from utils.db.pool import get_pool_stats
+
+GB = 1024 * 1024 * 1024
+MB = 1024 * 1024
+
+
+class ServerSampler:
+    """
+    后台线程定期采集CPU、内存、磁盘、负载、网络及本进程内存, 保存在定长环形缓冲中;
+    首次使用时启动, fork后的子进程重新启动
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pid = None
+        self.samples = deque()
+
+    def ensure_started(self):
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.samples = deque(maxlen=settings.SERVER_SAMPLER_SIZE)
+            self.process = psutil.Process()
+            self.last_net = None
+            psutil.cpu_percent(interval=None)  # cpu_percent以两次调用之间的间隔计算
+            thread = threading.Thread(target=self.run, name='server-sampler', daemon=True)
+            thread.start()
+
+    def run(self):
+        pid = self.pid
+        while pid == self.pid:
+            # 先等待一个间隔, 首次采样的CPU使用率才覆盖完整间隔
+            time.sleep(settings.SERVER_SAMPLER_INTERVAL)
+            try:
+                self.sample()
+            except Exception:  # 采集失败不影响下次采集
+                pass
+
+    def sample(self):
+        now = time.time()
+        memory = psutil.virtual_memory()
+        disk = psutil.disk_usage('/')
+        net = psutil.net_io_counters()
+        sent = recv = None
+        with self.lock:
+            if self.last_net is not None:
+                elapsed = now - self.last_net[0] or 1
+                sent = max(net.bytes_sent - self.last_net[1], 0) / elapsed
+                recv = max(net.bytes_recv - self.last_net[2], 0) / elapsed
+            self.last_net = (now, net.bytes_sent, net.bytes_recv)
+        item = {
+            'time': now,
+            'cpu': psutil.cpu_percent(interval=None),
+            'memory_total': memory.total,
+            'memory_used': memory.used,
+            'memory_percent': memory.percent,
+            'disk_total': disk.total,
+            'disk_used': disk.used,
+            'disk_percent': disk.percent,
+            'load': os.getloadavg() if hasattr(os, 'getloadavg') else None,
+            'net_sent': sent,
+            'net_recv': recv,
+            'rss': self.process.memory_info().rss,
+            'threads': self.process.num_threads(),
+        }
+        with self.lock:
+            self.samples.append(item)
+        return item
+
+    def get_latest(self):
+        """
+        后台线程最近一次采样, 尚未产生采样时(启动后一个间隔内)返回None, 不在请求中采样
+        """
+        self.ensure_started()
+        with self.lock:
+            return self.samples[-1] if self.samples else None
+
+    def get_history(self, seconds):
+        self.ensure_started()
+        since = time.time() - seconds
+        with self.lock:
+            return [i for i in self.samples if i['time'] >= since]
+
+
+server_sampler = ServerSampler()
+
+
+def get_server_info(window=None):
+    """
+    最近一次采样, window(秒)不为空时附带该时间段内的采样序列; 尚无采样时warming_up为True
+    """
+    sample = server_sampler.get_latest()
+    if sample is None:
+        ret = {'warming_up': True, 'process': {'pid': os.getpid()}, 'db_pool': get_pool_stats()}
+        if window:
+            ret['history'] = []
+        return ret
+    ret = {
+        'warming_up': False,
+        'time': sample['time'],
+        'cpu': {'count': psutil.cpu_count(), 'lcount': psutil.cpu_count(logical=False), 'percent': sample['cpu']},
+        'memory': {'total': round(sample['memory_total'] / GB, 2), 'used': round(sample['memory_used'] / GB, 2),
+                   'percent': sample['memory_percent']},
+        'disk': {'total': round(sample['disk_total'] / GB, 2), 'used': round(sample['disk_used'] / GB, 2),
+                 'percent': sample['disk_percent']},
+        'load': sample['load'],
+        'network': {'sent': sample['net_sent'], 'recv': sample['net_recv']},  # 字节/秒
+        'process': {'pid': os.getpid(), 'rss': round(sample['rss'] / MB, 1), 'threads': sample['threads']},
+        'db_pool': get_pool_stats(),  # 本进程的数据库连接池
+    }
+    if window:
+        ret['history'] = [{
+            'time': i['time'],
+            'cpu': i['cpu'],
+            'memory': i['memory_percent'],
+            'disk': i['disk_percent'],
+            'load': i['load'][0] if i['load'] else None,
+            'net_sent': i['net_sent'],
+            'net_recv': i['net_recv'],
+            'rss': round(i['rss'] / MB, 1),
+        } for i in server_sampler.get_history(window)]
+    return ret
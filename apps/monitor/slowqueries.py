@@ -0,0 +1,134 @@
+import hashlib
+import logging
+import re
+import threading
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from .models import SlowQuery
+
+logger = logging.getLogger('log')
+
+_string_literals = re.compile(r"'(?:[^'\\]|\\.|'')*'")
+_number_literals = re.compile(r'\b\d+(?:\.\d+)?\b')
+_in_lists = re.compile(r'\(\s*(?:%s|\?)(?:\s*,\s*(?:%s|\?))*\s*\)')
+_whitespace = re.compile(r'\s+')
+
+
+def normalize_sql(sql):
+    """
+    去除字面量、合并IN列表及空白, 用于计算指纹
+    """
+    sql = _string_literals.sub('?', sql)
+    sql = _number_literals.sub('?', sql)
+    sql = _in_lists.sub('(...)', sql.replace('%s', '?'))
+    return _whitespace.sub(' ', sql).strip()
+
+
+def get_fingerprint(sql):
+    return hashlib.md5(normalize_sql(sql).encode()).hexdigest()
+
+
+def redact_params(params):
+    """
+    参数只保留类型, 不保存实际值(可能含个人信息、令牌等)
+    """
+    if isinstance(params, dict):
+        return repr({k: type(v).__name__ for k, v in params.items()})
+    return repr(tuple(type(i).__name__ for i in params or ()))
+
+
+def redact_plan(plan):
+    """
+    执行计划中的字符串常量(如MySQL的attached_condition)替换为?
+    """
+    return _string_literals.sub("'?'", plan)
+
+
+def explain(alias, sql, params):
+    """
+    获取执行计划, 仅SELECT语句
+    """
+    if not sql.lstrip().upper().startswith('SELECT'):
+        return ''
+    connection = connections[alias]
+    prefix = {'mysql': 'EXPLAIN FORMAT=JSON ', 'postgresql': 'EXPLAIN (FORMAT JSON) ',
+              'sqlite': 'EXPLAIN QUERY PLAN '}.get(connection.vendor, 'EXPLAIN ')
+    with connection.cursor() as cursor:
+        cursor.execute(prefix + sql, params)
+        return '\n'.join(' '.join(str(i) for i in row) for row in cursor.fetchall())
+
+
+class SlowQueryBuffer:
+    """
+    进程内汇总慢查询, 随接口统计由后台线程定期写入(见metrics_flusher), EXPLAIN不在请求中执行
+    参数值只在内存中用于EXPLAIN, 入库时只保留类型
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queries = {}
+
+    def record(self, alias, sql, params, ms, route):
+        fingerprint = get_fingerprint(sql)
+        with self.lock:
+            item = self.queries.get(fingerprint)
+            if item is None:
+                item = self.queries[fingerprint] = {'alias': alias, 'sql': sql, 'params': params, 'count': 0,
+                                                    'total_ms': 0, 'max_ms': 0, 'route': route}
+            item['count'] += 1
+            item['total_ms'] += ms
+            if ms >= item['max_ms']:
+                item.update(max_ms=ms, params=params, route=route)
+
+    def flush(self):
+        with self.lock:
+            queries, self.queries = self.queries, {}
+        if not queries:
+            return
+        try:
+            for fingerprint, item in queries.items():
+                updated = SlowQuery.objects.filter(fingerprint=fingerprint).update(
+                    count=F('count') + item['count'], total_ms=F('total_ms') + item['total_ms'],
+                    max_ms=Greatest('max_ms', item['max_ms']), route=item['route'], last_seen=timezone.now())
+                if not updated:
+                    self.create(fingerprint, item)
+        except Exception:
+            logger.exception('慢查询写入失败')
+
+    def make_room(self, total_ms):
+        """
+        限制表大小: 表已满时淘汰总耗时最少的记录以容纳新指纹, 新指纹总耗时不超过保留记录的最小值时返回False
+        """
+        limit = settings.SLOW_QUERY_MAX_ROWS
+        ranked = SlowQuery.objects.order_by('-total_ms')
+        lowest = ranked.values_list('total_ms', flat=True)[limit - 1:limit]
+        if not lowest:
+            return True
+        if total_ms <= lowest[0]:
+            return False
+        SlowQuery.objects.filter(pk__in=list(ranked.values_list('pk', flat=True)[limit - 1:])).delete()
+        return True
+
+    def create(self, fingerprint, item):
+        # 先淘汰再写入, 不会保留的新指纹不写入也不执行EXPLAIN
+        if not self.make_room(item['total_ms']):
+            return
+        try:
+            plan = redact_plan(explain(item['alias'], item['sql'], item['params']))
+        except Exception as e:
+            plan = 'EXPLAIN失败: {}'.format(type(e).__name__)  # 错误信息可能包含参数值
+        with transaction.atomic():
+            obj, created = SlowQuery.objects.get_or_create(fingerprint=fingerprint, defaults={
+                'sql': item['sql'], 'sample': redact_params(item['params'])[:2000], 'alias': item['alias'],
+                'route': item['route'], 'count': item['count'], 'total_ms': item['total_ms'],
+                'max_ms': item['max_ms'], 'plan': plan})
+            if not created:  # 其他进程已写入
+                SlowQuery.objects.filter(pk=obj.pk).update(
+                    count=F('count') + item['count'], total_ms=F('total_ms') + item['total_ms'],
+                    max_ms=Greatest('max_ms', item['max_ms']), last_seen=timezone.now())
+
+
+slow_query_buffer = SlowQueryBuffer()
@@ -1,3 +1,697 @@
-from django.test import TestCase
+import gzip
+import json
+import logging
+import os
+import tempfile
+import threading
+from collections import deque
+from unittest import mock
+from datetime import date, timedelta
+from django.core.cache import cache
+from django.db import OperationalError, connection
+from django.db.backends.sqlite3.base import DatabaseWrapper as SqliteDatabaseWrapper
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase
+from django.utils import timezone
+from prometheus_client import REGISTRY
+from rest_framework.response import Response
+from rest_framework_simplejwt.tokens import AccessToken
+from apps.system.models import Permission, Role, User
+from rest_framework.views import APIView  # noqa: F401 utils.response依赖rest_framework.views, 须先于其导入
+from utils.db import pool as db_pool
+from utils.log import DailyFileHandler, JsonFormatter, QueueListenerHandler, RequestIdFilter
+from utils.response import FitJSONRenderer
+from .endpoints import RESERVOIR_SIZE, endpoint_buffer, merge_samples, metrics_flusher
+from . import logreader
+from .logreader import get_log_file, grep, read_lines, read_range, read_tail
+from .metrics import count_cache
+from .middleware import RequestIdMiddleware
+from .management.commands.bench_renderer import LegacyRenderer, get_payload
+from .models import EndpointStat, SlowQuery
+from .profiling import SamplingProfiler
+from .sampler import ServerSampler, get_server_info, server_sampler
+from .slowqueries import redact_plan, slow_query_buffer
+from .views import LogDetailView
 
-# Create your tests here.
+
+class RendererTest(SimpleTestCase):
+    """
+    FitJSONRenderer(orjson)与原渲染器输出一致, 差异仅在NaN/Infinity
+    """
+
+    def render(self, renderer, data, status=200):
+        response = Response(status=status)
+        return renderer.render(data, renderer_context={'response': response}), response.status_code
+
+    def test_same_bytes(self):
+        payload = get_payload(3)
+        payload['results'][0]['title'] = 'a b c'
+        self.assertEqual(self.render(FitJSONRenderer(), payload), self.render(LegacyRenderer(), payload))
+        self.assertIn(b'a\\u2028b\\u2029c', self.render(FitJSONRenderer(), payload)[0])
+
+    def test_error(self):
+        data = {'title': ['该字段是必填项。']}
+        ret, status = self.render(FitJSONRenderer(), data, 400)
+        self.assertEqual((ret, status), self.render(LegacyRenderer(), data, 400))
+        self.assertEqual(json.loads(ret)['msg'], 'title:该字段是必填项。')
+
+    def test_big_int(self):
+        data = {'id': 2 ** 70}
+        self.assertEqual(self.render(FitJSONRenderer(), data), self.render(LegacyRenderer(), data))
+
+    def test_nan(self):
+        ret, _ = self.render(FitJSONRenderer(), {'value': float('nan')})
+        self.assertIsNone(json.loads(ret)['data']['value'])
+        with self.assertRaises(ValueError):
+            self.render(LegacyRenderer(), {'value': float('nan')})
+
+
+def create_role_user(username, method='monitor_view'):
+    """
+    通过角色拥有指定权限的普通用户
+    """
+    role = Role.objects.create(name=username)
+    role.perms.add(Permission.objects.create(name=method, method=method))
+    user = User.objects.create(username=username)
+    user.roles.add(role)
+    return user
+
+
+@mock.patch.object(metrics_flusher, 'ensure_started')
+class EndpointMetricsTest(TestCase):
+    """
+    接口统计: 请求中只记入进程内缓冲, 由后台线程写入数据库
+    """
+
+    def setUp(self):
+        endpoint_buffer.flush()
+
+    def test_request_does_not_write(self, ensure_started):
+        with self.settings(ENDPOINT_METRICS_FLUSH_SECONDS=0):
+            self.client.get('/api/system/role/')
+        ensure_started.assert_called()
+        self.assertFalse(EndpointStat.objects.exists())
+        self.assertIn(('GET', 'api/system/role/', 'list'), endpoint_buffer.stats)
+        metrics_flusher.flush()
+        stat = EndpointStat.objects.get(route='api/system/role/')
+        self.assertEqual((stat.method, stat.action, stat.count), ('GET', 'list', 1))
+
+    def test_view_does_not_flush(self, _):
+        admin = User.objects.create(username='admin', is_superuser=True)
+        self.client.get('/api/monitor/endpoints/', HTTP_AUTHORIZATION='Bearer {}'.format(AccessToken.for_user(admin)))
+        self.assertTrue(endpoint_buffer.stats)  # 由后台线程写入
+        self.assertFalse(EndpointStat.objects.exists())
+
+    def test_merge_samples_weighted(self, _):
+        # 旧样本代表的请求数远多于新样本时, 合并结果中新样本占比相应较小
+        merged = merge_samples([0] * RESERVOIR_SIZE, 100000, [1] * RESERVOIR_SIZE, RESERVOIR_SIZE)
+        self.assertEqual(len(merged), RESERVOIR_SIZE)
+        self.assertLess(sum(merged), 20)
+        self.assertEqual(merge_samples([0], 1, [1, 2], 2), [0, 1, 2])
+
+    def test_started_once_per_process(self, _):
+        flusher = type(metrics_flusher)()
+        with mock.patch('threading.Thread') as thread:
+            flusher.ensure_started()
+            flusher.ensure_started()
+        thread.assert_called_once()
+        with mock.patch('os.getpid', return_value=-1), mock.patch('threading.Thread') as thread:
+            flusher.ensure_started()  # fork后的子进程
+        thread.assert_called_once()
+
+
+@mock.patch.object(metrics_flusher, 'ensure_started')
+class PrometheusMetricsTest(TestCase):
+    """
+    Prometheus指标: METRICS_TOKEN或有monitor_view权限的JWT访问, 请求耗时及缓存命中计数
+    """
+
+    def setUp(self):
+        cache.clear()  # 用户权限列表缓存
+
+    def get_sample(self, name, labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_access(self, _):
+        with self.settings(METRICS_TOKEN='secret'):
+            self.assertEqual(self.client.get('/api/monitor/metrics').status_code, 403)
+            self.assertEqual(self.client.get('/api/monitor/metrics', {'token': 'wrong'}).status_code, 403)
+            self.assertEqual(self.client.get('/api/monitor/metrics', {'token': 'secret'}).status_code, 200)
+            response = self.client.get('/api/monitor/metrics', HTTP_AUTHORIZATION='Bearer secret')
+            self.assertEqual(response.status_code, 200)
+        with self.settings(METRICS_TOKEN=''):
+            self.assertEqual(self.client.get('/api/monitor/metrics', {'token': ''}).status_code, 403)
+            user = User.objects.create(username='user')
+            staff = User.objects.create(username='staff', is_staff=True)  # 不按is_staff判断
+            for u, status in ((user, 403), (staff, 403), (create_role_user('monitor'), 200)):
+                response = self.client.get('/api/monitor/metrics',
+                                           HTTP_AUTHORIZATION='Bearer {}'.format(AccessToken.for_user(u)))
+                self.assertEqual(response.status_code, status)
+        self.assertIn(b'http_request_duration_seconds', response.content)
+
+    def test_request_latency(self, _):
+        labels = {'method': 'GET', 'route': 'api/system/role/', 'status': '2xx'}
+        before = self.get_sample('http_request_duration_seconds_count', labels)
+        self.client.get('/api/system/role/')  # 未认证, 统一为200响应
+        self.assertEqual(self.get_sample('http_request_duration_seconds_count', labels), before + 1)
+
+    def test_count_cache(self, _):
+        hit = {'family': 'test', 'result': 'hit'}
+        miss = {'family': 'test', 'result': 'miss'}
+        before = self.get_sample('cache_requests_total', hit), self.get_sample('cache_requests_total', miss)
+        self.assertEqual(count_cache('test', [1]), [1])
+        self.assertIsNone(count_cache('test', None))
+        self.assertEqual((self.get_sample('cache_requests_total', hit), self.get_sample('cache_requests_total', miss)),
+                         (before[0] + 1, before[1] + 1))
+
+
+@mock.patch.object(metrics_flusher, 'ensure_started')
+class SlowQueryTest(TestCase):
+    """
+    慢查询: EXPLAIN在后台写入时执行, 不保存参数值
+    """
+
+    def setUp(self):
+        slow_query_buffer.flush()
+
+    @mock.patch('apps.monitor.slowqueries.explain', return_value='')
+    def test_explain_not_in_request(self, explain, _):
+        user = User.objects.create(username='admin', is_superuser=True)
+        with self.settings(SLOW_QUERY_MS=0):
+            self.client.get('/api/system/role/', HTTP_AUTHORIZATION='Bearer {}'.format(AccessToken.for_user(user)))
+        explain.assert_not_called()
+        self.assertTrue(slow_query_buffer.queries)
+        metrics_flusher.flush()
+        explain.assert_called()
+        self.assertTrue(SlowQuery.objects.exists())
+
+    def test_redact(self, _):
+        User.objects.create(username='secret@example.com')
+        sql = 'SELECT "system_user"."id" FROM "system_user" WHERE "system_user"."username" = %s'
+        slow_query_buffer.record('default', sql, ('secret@example.com',), 500, 'api/system/user/')
+        slow_query_buffer.flush()
+        obj = SlowQuery.objects.get()
+        self.assertEqual(obj.sample, "('str',)")
+        self.assertNotIn('secret', obj.plan)
+        plan = '{"attached_condition": "(`system_user`.`username` = \'secret@example.com\')", "rows": 12}'
+        self.assertEqual(redact_plan(plan), '{"attached_condition": "(`system_user`.`username` = \'?\')", "rows": 12}')
+
+    def test_last_seen(self, _):
+        sql = 'SELECT 1'
+        slow_query_buffer.record('default', sql, (), 500, 'a/')
+        slow_query_buffer.flush()
+        SlowQuery.objects.update(last_seen=timezone.now() - timedelta(days=1))
+        slow_query_buffer.record('default', sql, (), 500, 'b/')
+        slow_query_buffer.flush()
+        obj = SlowQuery.objects.get()
+        self.assertEqual((obj.count, obj.route), (2, 'b/'))
+        self.assertGreater(obj.last_seen, timezone.now() - timedelta(minutes=1))
+
+    @mock.patch('apps.monitor.slowqueries.explain', return_value='')
+    def test_evict_before_insert(self, explain, _):
+        with self.settings(SLOW_QUERY_MAX_ROWS=2):
+            for i, ms in enumerate([300, 500]):
+                slow_query_buffer.record('default', 'SELECT {} FROM t'.format('a' * (i + 1)), (), ms, '')
+                slow_query_buffer.flush()
+            # 新指纹总耗时不足以保留: 不写入, 不执行EXPLAIN
+            slow_query_buffer.record('default', 'SELECT c FROM t', (), 200, '')
+            slow_query_buffer.flush()
+            self.assertEqual(explain.call_count, 2)
+            self.assertEqual(sorted(SlowQuery.objects.values_list('total_ms', flat=True)), [300, 500])
+            # 总耗时更多时淘汰最少的记录
+            slow_query_buffer.record('default', 'SELECT d FROM t', (), 400, '')
+            slow_query_buffer.flush()
+            self.assertEqual(explain.call_count, 3)
+            self.assertEqual(sorted(SlowQuery.objects.values_list('total_ms', flat=True)), [400, 500])
+
+
+@mock.patch.object(metrics_flusher, 'ensure_started')
+class ProfilerTest(TestCase):
+    """
+    按需性能分析: 有monitor_view权限(超级管理员拥有全部权限)的请求生成报告, 报告可列出及下载
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create(username='admin', is_superuser=True)
+        cls.user = User.objects.create(username='user')
+        cls.monitor = create_role_user('monitor')
+
+    def setUp(self):
+        cache.clear()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = tmp.name
+        override = self.settings(PROFILE_PATH=self.path, PROFILE_MAX_FILES=4)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def get(self, url, user, **kwargs):
+        return self.client.get(url, HTTP_AUTHORIZATION='Bearer {}'.format(AccessToken.for_user(user)), **kwargs)
+
+    def test_cprofile(self, _):
+        response = self.get('/api/system/role/', self.admin, HTTP_X_PROFILE='cprofile')
+        self.assertEqual(json.loads(response.content)['code'], 200)
+        name = response['X-Profile-Report']
+        self.assertEqual(sorted(os.listdir(self.path)), [name + '.prof', name + '.txt'])
+        with open(os.path.join(self.path, name + '.txt'), encoding='utf-8') as f:
+            self.assertTrue(f.read().startswith('GET /api/system/role/\nuser: admin\n'))
+
+    def test_sample(self, _):
+        response = self.get('/api/system/role/', self.admin, data={'_profile': 'sample'})
+        name = response['X-Profile-Report']
+        self.assertEqual(sorted(os.listdir(self.path)), [name + '.folded', name + '.txt'])
+
+    def test_monitor_perm(self, _):
+        response = self.get('/api/system/role/', self.monitor, HTTP_X_PROFILE='cprofile')
+        self.assertIn('X-Profile-Report', response)
+        self.assertEqual(json.loads(self.get('/api/monitor/profile/', self.monitor).content)['code'], 200)
+
+    def test_no_perm_or_no_flag(self, _):
+        response = self.get('/api/system/role/', self.user, HTTP_X_PROFILE='cprofile')
+        self.assertNotIn('X-Profile-Report', response)
+        response = self.get('/api/system/role/', self.admin, HTTP_X_PROFILE='unknown')
+        self.assertNotIn('X-Profile-Report', response)
+        self.assertNotIn('X-Profile-Report', self.get('/api/system/role/', self.admin))
+        self.assertEqual(os.listdir(self.path), [])
+
+    def test_list_download_and_prune(self, _):
+        for i in range(3):
+            self.get('/api/system/role/', self.admin, HTTP_X_PROFILE='cprofile')
+        self.assertEqual(len(os.listdir(self.path)), 4)
+        ret = json.loads(self.get('/api/monitor/profile/', self.admin).content)
+        self.assertEqual(len(ret['data']), 4)
+        name = ret['data'][0]['name']
+        response = self.get('/api/monitor/profile/{}/'.format(name), self.admin)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(b''.join(response.streaming_content))
+        self.assertEqual(json.loads(self.get('/api/monitor/profile/missing.txt/', self.admin).content)['code'], 404)
+        self.assertEqual(json.loads(self.get('/api/monitor/profile/', self.user).content)['code'], 403)
+
+    def test_sampling_profiler(self, _):
+        profiler = SamplingProfiler(interval=0.001)
+        profiler.samples[('a', 'b')] = 3
+        profiler.samples[('a', 'c')] = 1
+        self.assertEqual(profiler.get_folded(), 'a;b 3\na;c 1\n')
+        summary = profiler.get_summary()
+        self.assertIn(' 75.0% b', summary)
+        self.assertIn('100.0% a\n  75.0%   b', summary)
+
+
+class ListHandler(logging.Handler):
+
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class LoggingTest(SimpleTestCase):
+    """
+    日志: 请求id贯穿请求内日志, 队列异步写入, JSON格式, 按日期分文件
+    """
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = tmp.name
+
+    def get_logger(self, handler):
+        logger = logging.getLogger('monitor.tests.{}'.format(id(handler)))
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+        return logger
+
+    def test_request_id(self):
+        handler = ListHandler()
+        handler.addFilter(RequestIdFilter())
+        logger = self.get_logger(handler)
+
+        def view(request):
+            logger.info('in request')
+            return HttpResponse()
+        middleware = RequestIdMiddleware(view)
+        response = middleware(RequestFactory().get('/', HTTP_X_REQUEST_ID='abc-123'))
+        self.assertEqual(response['X-Request-ID'], 'abc-123')
+        response = middleware(RequestFactory().get('/', HTTP_X_REQUEST_ID='bad id'))
+        self.assertRegex(response['X-Request-ID'], r'^[0-9a-f]{32}$')
+        self.assertEqual([i.request_id for i in handler.records], ['abc-123', response['X-Request-ID']])
+        logger.info('outside request')
+        self.assertEqual(handler.records[-1].request_id, '-')
+
+    def test_queue(self):
+        target = ListHandler()
+        handler = QueueListenerHandler([target])
+        handler.addFilter(RequestIdFilter())
+        logger = self.get_logger(handler)
+        try:
+            raise ValueError('错误')
+        except ValueError:
+            logger.exception('失败 %s', 1)
+        handler.stop()
+        record = target.records[0]
+        self.assertEqual((record.msg, record.args, record.exc_info), ('失败 1', None, None))
+        data = json.loads(JsonFormatter().format(record))
+        self.assertEqual((data['message'], data['level'], data['request_id']), ('失败 1', 'ERROR', '-'))
+        self.assertIn('ValueError: 错误', data['exc_info'])
+
+    def test_queue_full(self):
+        handler = QueueListenerHandler([ListHandler()], maxsize=1)
+        handler.stop()
+        logger = self.get_logger(handler)
+        logger.warning('1')
+        logger.warning('2')
+        self.assertEqual(handler.dropped, 1)
+
+    def test_daily_file(self):
+        prefix = os.path.join(self.path, 'server')
+        today = date.today()
+        expired = os.path.join(self.path, 'server-{}.log'.format((today - timedelta(days=31)).strftime('%Y-%m-%d')))
+        kept = os.path.join(self.path, 'server-{}.log'.format((today - timedelta(days=29)).strftime('%Y-%m-%d')))
+        other = os.path.join(self.path, 'error-2000-01-01.log')
+        for file in (expired, kept, other):
+            open(file, 'w').close()
+        handler = DailyFileHandler(prefix, backup_days=30)
+        handler.current_date = today - timedelta(days=1)  # 模拟跨天
+        self.get_logger(handler).warning('新的一天')
+        handler.close()
+        with open(handler.get_filename(today), encoding='utf-8') as f:
+            self.assertEqual(f.read(), '新的一天\n')
+        self.assertFalse(os.path.exists(expired))
+        self.assertTrue(os.path.exists(kept))
+        self.assertTrue(os.path.exists(other))
+
+
+@mock.patch.object(metrics_flusher, 'ensure_started')
+class LogReaderTest(TestCase):
+    """
+    日志读取: 按范围、末尾、行号分页及搜索读取, 无monitor_view权限时不能使用正则
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create(username='admin', is_superuser=True)
+        cls.user = create_role_user('user', 'ticket_view')
+        cls.monitor = create_role_user('monitor')
+
+    def setUp(self):
+        cache.clear()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        override = self.settings(LOG_PATH=tmp.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.lines = ['line {} {}\n'.format(i, 'error' if i % 10 == 0 else 'info') for i in range(2500)]
+        self.content = ''.join(self.lines)
+        with open(os.path.join(tmp.name, 'server.log'), 'w') as f:
+            f.write(self.content)
+        with gzip.open(os.path.join(tmp.name, 'server.log.1.gz'), 'wt') as f:
+            f.write(self.content)
+        self.filepath = get_log_file('server.log')
+
+    def get(self, name, user, **params):
+        response = self.client.get('/api/monitor/log/{}/'.format(name), params,
+                                   HTTP_AUTHORIZATION='Bearer {}'.format(AccessToken.for_user(user)))
+        return json.loads(response.content)
+
+    def test_get_log_file(self, _):
+        self.assertIsNone(get_log_file('../settings.py'))
+        self.assertIsNone(get_log_file('missing.log'))
+        self.assertTrue(get_log_file('server.log.1.gz'))
+
+    def test_range(self, _):
+        data = read_range(self.filepath, offset=3, size=30)
+        self.assertEqual(data['offset'], len(self.lines[0]))  # 从下一行开始
+        self.assertEqual(data['content'], ''.join(self.lines[1:3]))
+        self.assertFalse(data['eof'])
+        data = read_range(self.filepath, offset=data['next'], size=len(self.content))
+        self.assertEqual(data['content'], ''.join(self.lines[3:]))
+        self.assertTrue(data['eof'])
+
+    def test_tail(self, _):
+        self.assertEqual(read_tail(self.filepath, 3)['content'], ''.join(self.lines[-3:]))
+        with mock.patch.object(logreader, 'BLOCK_SIZE', 16):
+            self.assertEqual(read_tail(self.filepath, 5)['content'], ''.join(self.lines[-5:]))
+        gz = read_tail(get_log_file('server.log.1.gz'), 3)
+        self.assertEqual((gz['content'], gz['next']), (''.join(self.lines[-3:]), len(self.content)))
+
+    def test_lines(self, _):
+        data = read_lines(self.filepath, start=1998, lines=4)
+        self.assertEqual(data['content'], ''.join(self.lines[1998:2002]))
+        self.assertEqual((data['next'], data['total']), (2002, 2500))
+        with open(self.filepath, 'a') as f:
+            f.write('appended\npartial')
+        data = read_lines(self.filepath, start=2499, lines=10)
+        self.assertEqual(data['content'], self.lines[-1] + 'appended\n')  # 不含未写完的行
+        self.assertTrue(data['eof'])
+
+    def test_grep(self, _):
+        data = grep(self.filepath, 'ERROR', limit=3, ignore_case=True)
+        self.assertEqual([i['line'] for i in data['matches']], ['line 0 error', 'line 10 error', 'line 20 error'])
+        self.assertEqual(data['matches'][1]['offset'], len(''.join(self.lines[:10])))
+        data = grep(self.filepath, 'error', offset=data['next'], limit=1)
+        self.assertEqual(data['matches'][0]['line'], 'line 30 error')
+        self.assertEqual(grep(self.filepath, 'line 1.0 ')['matches'], [])  # 默认按字面匹配
+        self.assertEqual(len(grep(self.filepath, r'line 1.0 ', regex=True)['matches']), 10)
+
+    def test_view(self, _):
+        ret = self.get('server.log', self.user)['data']  # 无参数返回开头部分
+        self.assertEqual(ret['content'], self.content)
+        self.assertFalse(ret['truncated'])
+        with mock.patch.object(LogDetailView, 'max_size', 100):
+            ret = self.get('server.log.1.gz', self.user)['data']
+        self.assertTrue(ret['truncated'])
+        self.assertEqual(ret['content'], self.content[:ret['next']])
+        self.assertLessEqual(ret['next'], 100)
+        ret = self.get('server.log.1.gz', self.user, mode='range', offset=ret['next'], size=len(self.content))
+        self.assertEqual(ret['data']['content'], self.content[ret['data']['offset']:])  # 其余部分按range读取
+        ret = self.get('server.log.1.gz', self.user, mode='tail', lines=2)
+        self.assertEqual(ret['data']['content'], ''.join(self.lines[-2:]))
+        self.assertEqual(self.get('server%20log', self.user)['code'], 404)
+        self.assertEqual(self.get('server.log', self.user, mode='unknown')['code'], 400)
+
+    def test_view_grep(self, _):
+        ret = self.get('server.log', self.user, mode='grep', q='line 1.0 ')
+        self.assertEqual(ret['data']['matches'], [])
+        self.assertEqual(self.get('server.log', self.user, mode='grep', q='(a+)+$', regex=1)['code'], 403)
+        ret = self.get('server.log', self.admin, mode='grep', q='line 1.0 ', regex=1)
+        self.assertEqual(len(ret['data']['matches']), 10)
+        ret = self.get('server.log', self.monitor, mode='grep', q='line 1.0 ', regex=1)
+        self.assertEqual(len(ret['data']['matches']), 10)
+        self.assertEqual(self.get('server.log', self.admin, mode='grep', q='(', regex=1)['code'], 400)
+
+
+class ServerSamplerTest(TestCase):
+    """
+    服务器状态: 后台线程采样, 每个进程只启动一次, 接口读取最近采样及历史
+    """
+
+    def setUp(self):
+        self.sampler = ServerSampler()
+        self.now = 1000.0
+        patcher = mock.patch('apps.monitor.sampler.time.time', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def start(self):
+        with mock.patch('apps.monitor.sampler.threading.Thread') as thread:
+            self.sampler.ensure_started()
+            self.sampler.ensure_started()
+        return thread
+
+    def test_started_once_per_process(self):
+        thread = self.start()
+        thread.assert_called_once()
+        thread.return_value.start.assert_called_once()
+        self.sampler.pid = -1  # fork后的子进程继承了父进程的pid
+        self.assertEqual(self.start().call_count, 1)
+        self.assertEqual(self.sampler.pid, os.getpid())
+
+    def test_network_rate(self):
+        self.start()
+        net = mock.Mock(bytes_sent=1000, bytes_recv=5000)
+        with mock.patch('apps.monitor.sampler.psutil.net_io_counters', return_value=net):
+            first = self.sampler.sample()
+            self.now += 2
+            net.bytes_sent, net.bytes_recv = 3000, 6000
+            second = self.sampler.sample()
+        self.assertIsNone(first['net_sent'])
+        self.assertEqual((second['net_sent'], second['net_recv']), (1000, 500))
+
+    def test_history(self):
+        self.start()
+        for i in range(3):
+            self.sampler.sample()
+            self.now += 10
+        self.assertEqual(len(self.sampler.get_history(15)), 1)
+        self.assertEqual(len(self.sampler.get_history(60)), 3)
+        self.assertEqual(self.sampler.get_latest()['time'], 1020)
+
+    def test_ring_buffer(self):
+        with self.settings(SERVER_SAMPLER_SIZE=2):
+            self.start()
+        for i in range(3):
+            self.sampler.sample()
+        self.assertEqual(len(self.sampler.samples), 2)
+
+    def test_warming_up(self):
+        self.start()
+        with mock.patch.object(self.sampler, 'sample') as sample:
+            self.assertIsNone(self.sampler.get_latest())  # 不在请求中采样
+            with mock.patch('apps.monitor.sampler.server_sampler', self.sampler):
+                info = get_server_info(60)
+        sample.assert_not_called()
+        self.assertTrue(info['warming_up'])
+        self.assertEqual(info['history'], [])
+
+    def test_server_info(self):
+        with mock.patch('apps.monitor.sampler.server_sampler', self.sampler):
+            self.start()
+            self.sampler.sample()
+            info = get_server_info(60)
+        self.assertFalse(info['warming_up'])
+        self.assertEqual(info['process']['pid'], os.getpid())
+        self.assertEqual(len(info['history']), 1)
+        self.assertIn('db_pool', info)
+        self.assertNotIn('history', get_server_info())
+
+    @mock.patch.object(metrics_flusher, 'ensure_started')
+    @mock.patch.object(server_sampler, 'ensure_started')
+    def test_view(self, *_):
+        user = User.objects.create(username='user', is_superuser=True)
+        process = mock.Mock(**{'memory_info.return_value.rss': 0, 'num_threads.return_value': 1})
+        with mock.patch.multiple(server_sampler, samples=deque(), process=process, last_net=None, create=True):
+            auth = 'Bearer {}'.format(AccessToken.for_user(user))
+            ret = json.loads(self.client.get('/api/monitor/server/', {'window': 60}, HTTP_AUTHORIZATION=auth).content)
+            self.assertTrue(ret['data']['warming_up'])
+            server_sampler.sample()
+            ret = json.loads(self.client.get('/api/monitor/server/', {'window': 60}, HTTP_AUTHORIZATION=auth).content)
+            self.assertEqual(len(ret['data']['history']), 1)
+            ret = json.loads(self.client.get('/api/monitor/server/', {'window': 'a'}, HTTP_AUTHORIZATION=auth).content)
+            self.assertEqual(ret['code'], 400)
+
+
+class FakeConnection:
+
+    def __init__(self, alive=True):
+        self.alive = alive
+        self.closed = False
+
+    def ping(self):
+        if not self.alive:
+            raise OperationalError('gone away')
+
+    def close(self):
+        self.closed = True
+
+
+class PooledSqliteWrapper(db_pool.PooledDatabaseWrapperMixin, SqliteDatabaseWrapper):
+    pass
+
+
+class ConnectionPoolTest(SimpleTestCase):
+    """
+    数据库连接池: 复用、容量限制与等待、过期及失效连接重建、fork后重建
+    """
+
+    def get_pool(self, size=2, max_lifetime=1800, timeout=1, pre_ping=True):
+        return db_pool.ConnectionPool(size, max_lifetime, timeout, pre_ping)
+
+    def test_reuse(self):
+        pool = self.get_pool()
+        a, b = pool.acquire(FakeConnection), pool.acquire(FakeConnection)
+        pool.release(a)
+        pool.release(b)
+        self.assertIs(pool.acquire(FakeConnection), b)  # 后进先出
+        stats = pool.get_stats()
+        self.assertEqual((stats['created'], stats['in_use'], stats['idle']), (2, 1, 1))
+
+    def test_timeout(self):
+        pool = self.get_pool(size=1, timeout=0.01)
+        pool.acquire(FakeConnection)
+        with self.assertRaises(OperationalError):
+            pool.acquire(FakeConnection)
+        stats = pool.get_stats()
+        self.assertEqual((stats['waits'], stats['timeouts']), (1, 1))
+
+    def test_wait_for_release(self):
+        pool = self.get_pool(size=1)
+        conn = pool.acquire(FakeConnection)
+        timer = threading.Timer(0.05, pool.release, [conn])
+        timer.start()
+        self.assertIs(pool.acquire(FakeConnection), conn)
+        timer.join()
+        self.assertEqual(pool.get_stats()['timeouts'], 0)
+
+    def test_expired_and_dead(self):
+        pool = self.get_pool(max_lifetime=0)
+        conn = pool.acquire(FakeConnection)
+        pool.release(conn)  # 超过最长使用时间, 归还时关闭
+        self.assertTrue(conn.closed)
+        pool = self.get_pool()
+        conn = pool.acquire(lambda: FakeConnection(alive=False))
+        pool.release(conn)
+        self.assertIsNot(pool.acquire(FakeConnection), conn)
+        self.assertTrue(conn.closed)
+        stats = pool.get_stats()
+        self.assertEqual((stats['ping_failures'], stats['created'], stats['in_use']), (1, 2, 1))
+
+    def test_discard_and_factory_error(self):
+        pool = self.get_pool(size=1)
+        conn = pool.acquire(FakeConnection)
+        pool.release(conn, discard=True)
+        self.assertTrue(conn.closed)
+
+        def fail():
+            raise OperationalError('refused')
+        with self.assertRaises(OperationalError):
+            pool.acquire(fail)
+        self.assertEqual(pool.get_stats()['in_use'], 0)
+        self.assertTrue(pool.acquire(FakeConnection))  # 失败的连接名额已归还
+
+    def test_foreign_connection(self):
+        pool = self.get_pool()
+        conn = FakeConnection()
+        with mock.patch.object(db_pool, '_inherited', []) as inherited:
+            pool.release(conn)
+            self.assertEqual(inherited, [conn])
+        self.assertFalse(conn.closed)
+        self.assertEqual(pool.get_stats()['idle'], 0)
+
+    def test_get_pool_after_fork(self):
+        with mock.patch.object(db_pool, '_pools', {}), mock.patch.object(db_pool, '_inherited', []) as inherited:
+            pool = db_pool.get_pool('default', {'POOL': {'SIZE': 3}})
+            self.assertIs(db_pool.get_pool('default', {}), pool)
+            self.assertEqual(pool.size, 3)
+            conn = pool.acquire(FakeConnection)
+            pool.release(conn)
+            pool.pid = -1  # 模拟fork后的子进程
+            self.assertEqual(db_pool.get_pool_stats(), {})
+            child = db_pool.get_pool('default', {'POOL': {'SIZE': 3}})
+            self.assertIsNot(child, pool)
+            self.assertEqual(inherited, [conn])
+            self.assertFalse(conn.closed)
+            self.assertEqual(list(db_pool.get_pool_stats()), ['default'])
+
+    def test_database_wrapper(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        settings_dict = dict(connection.settings_dict, NAME=os.path.join(tmp.name, 'pool.sqlite3'),
+                             POOL={'PRE_PING': False})
+        wrapper = PooledSqliteWrapper(settings_dict, alias='pool')
+        with mock.patch.object(db_pool, '_pools', {}):
+            with wrapper.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            raw = wrapper.connection
+            wrapper.close()
+            self.assertEqual(wrapper.get_pool().get_stats()['idle'], 1)
+            wrapper.ensure_connection()
+            self.assertIs(wrapper.connection, raw)  # 复用物理连接
+            wrapper.set_autocommit(False)
+            wrapper.close()  # 自动提交被修改的连接不再复用
+            stats = wrapper.get_pool().get_stats()
+            self.assertEqual((stats['created'], stats['closed'], stats['idle']), (1, 1, 0))
@@ -1,10 +1,16 @@
 from django.urls import path, include
 from rest_framework import routers
-from .views import ServerInfoView, LogView, LogDetailView
+from .views import ServerInfoView, LogView, LogDetailView, EndpointStatView, SlowQueryView, ProfileView, ProfileDetailView, metrics_view
 
 
 urlpatterns = [
     path('log/', LogView.as_view()),
     path('log/<str:name>/', LogDetailView.as_view()),
+    path('slow_query/', SlowQueryView.as_view()),
+    path('profile/', ProfileView.as_view()),
+    path('profile/<str:name>/', ProfileDetailView.as_view()),
     path('server/', ServerInfoView.as_view()),
+    path('endpoints/', EndpointStatView.as_view()),
+    path('metrics', metrics_view),
+    path('metrics/', metrics_view),
 ]
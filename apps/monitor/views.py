@@ -1,35 +1,78 @@
 from django.shortcuts import render
-import psutil
+import hmac
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseForbidden
+from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.exceptions import ParseError, PermissionDenied
 from rest_framework.viewsets import ViewSet
 from django.conf import settings
 import os
+import re
+from datetime import datetime
+from django.utils import timezone
 from rest_framework import serializers, status
 from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
+from apps.system.permission import has_perm
+from .logreader import get_log_file, grep, read_all, read_lines, read_range, read_tail
+from .endpoints import ORDERINGS, get_endpoint_ranking
+from .metrics import get_metrics
+from .models import SlowQuery
+from .profiling import get_profile_file, get_profile_path
+from .sampler import get_server_info
 # Create your views here.
 
 class ServerInfoView(APIView):
     """
-    获取服务器状态信息
+    获取服务器状态信息, 取后台采样的最近一次结果
+    ?window=秒数 附带该时间段内的采样序列(用于图表)
     """
     permission_classes = [IsAuthenticated]
     def get(self, request, *args, **kwargs):
-        ret={'cpu':{}, 'memory':{}, 'disk':{}}
-        ret['cpu']['count'] = psutil.cpu_count()
-        ret['cpu']['lcount'] = psutil.cpu_count(logical=False)
-        ret['cpu']['percent'] = psutil.cpu_percent(interval=1)
-        memory = psutil.virtual_memory()
-        ret['memory']['total'] = round(memory.total/1024/1024/1024,2)
-        ret['memory']['used'] = round(memory.used/1024/1024/1024,2)
-        ret['memory']['percent'] = memory.percent
-        disk = psutil.disk_usage('/')
-        ret['disk']['total'] = round(disk.total/1024/1024/1024,2)
-        ret['disk']['used'] = round(disk.used/1024/1024/1024,2)
-        ret['disk']['percent'] = disk.percent
-        return Response(ret)
+        try:
+            window = int(request.query_params.get('window', 0))
+        except ValueError:
+            raise ParseError('参数格式错误')
+        window = min(max(window, 0), settings.SERVER_SAMPLER_INTERVAL * settings.SERVER_SAMPLER_SIZE)
+        return Response(get_server_info(window))
+
+class EndpointStatView(APIView):
+    """
+    接口统计排行(需monitor_view权限)
+    ?hours=统计最近小时数(默认24) &order=queries|wall|db|count|duplicates|bytes &limit=条数
+    """
+    perms_map = {'get': 'monitor_view'}
+
+    def get(self, request, *args, **kwargs):
+        try:
+            hours = min(max(int(request.query_params.get('hours', 24)), 1), 24 * settings.ENDPOINT_METRICS_RETENTION_DAYS)
+            limit = min(max(int(request.query_params.get('limit', 50)), 1), 500)
+        except ValueError:
+            raise ParseError('参数格式错误')
+        order = request.query_params.get('order', 'queries')
+        if order not in ORDERINGS:
+            raise ParseError('不支持的排序方式')
+        return Response(get_endpoint_ranking(hours, order, limit))
+
+def metrics_view(request):
+    """
+    Prometheus指标, 使用METRICS_TOKEN(?token=或Authorization: Bearer)或有monitor_view权限的JWT访问
+    """
+    token = settings.METRICS_TOKEN
+    supplied = request.GET.get('token', '') or request.META.get('HTTP_AUTHORIZATION', '')[len('Bearer '):]
+    allowed = bool(token) and hmac.compare_digest(supplied.encode(), token.encode())
+    if not allowed:
+        try:
+            result = JWTAuthentication().authenticate(request)
+        except Exception:
+            result = None
+        allowed = result is not None and has_perm(result[0], 'monitor_view')
+    if not allowed:
+        return HttpResponseForbidden()
+    content, content_type = get_metrics()
+    return HttpResponse(content, content_type=content_type)
 
 def get_file_list(file_path):
     dir_list = os.listdir(file_path)
@@ -57,9 +100,11 @@ class LogView(APIView):
         name = request.GET.get('name', None)
         # for root, dirs, files in os.walk(settings.LOG_PATH):
         #     files.reverse()
-        for file in get_file_list(settings.LOG_PATH):
+        for file in get_file_list(settings.LOG_PATH) or []:
             if len(logs)>50:break
             filepath = os.path.join(settings.LOG_PATH, file)
+            if os.path.isdir(filepath):  # 如性能分析报告目录profiles
+                continue
             if name:
                 if name in filepath:
                     fsize = os.path.getsize(filepath)
@@ -79,15 +124,115 @@ class LogView(APIView):
                         })
         return Response(logs)
     
+class ProfileView(APIView):
+    """
+    性能分析报告列表(需monitor_view权限)
+    有该权限的用户请求任意接口时携带请求头X-Profile或参数_profile(cprofile|sample)即生成报告
+    """
+    perms_map = {'get': 'monitor_view'}
+
+    def get(self, request, *args, **kwargs):
+        path = get_profile_path()
+        profiles = []
+        for file in get_file_list(path) or []:
+            filepath = os.path.join(path, file)
+            profiles.append({
+                "name": file,
+                "size": round(os.path.getsize(filepath)/1000, 1),
+                "time": datetime.fromtimestamp(os.path.getmtime(filepath), tz=timezone.get_current_timezone())
+            })
+        return Response(profiles)
+
+class ProfileDetailView(APIView):
+    """
+    下载性能分析报告(.txt摘要, .prof可用pstats/snakeviz查看, .folded可生成火焰图)
+    """
+    perms_map = {'get': 'monitor_view'}
+
+    def get(self, request, name):
+        filepath = get_profile_file(name)
+        if filepath is None:
+            raise Http404
+        return FileResponse(open(filepath, 'rb'), as_attachment=True, filename=name)
+
+class SlowQueryView(APIView):
+    """
+    慢查询, 按总耗时倒序(需monitor_view权限); 由后台线程每ENDPOINT_METRICS_FLUSH_SECONDS秒写入
+    ?limit=条数 &route=路由包含
+    """
+    perms_map = {'get': 'monitor_view'}
+
+    def get(self, request, *args, **kwargs):
+        try:
+            limit = min(max(int(request.query_params.get('limit', 50)), 1), settings.SLOW_QUERY_MAX_ROWS)
+        except ValueError:
+            raise ParseError('参数格式错误')
+        queryset = SlowQuery.objects.order_by('-total_ms')
+        if request.query_params.get('route', None):
+            queryset = queryset.filter(route__contains=request.query_params['route'])
+        data = []
+        for i in queryset[:limit]:
+            data.append({
+                'id': i.id, 'fingerprint': i.fingerprint, 'sql': i.sql, 'sample': i.sample, 'alias': i.alias,
+                'route': i.route, 'count': i.count, 'total_ms': round(i.total_ms, 1), 'max_ms': round(i.max_ms, 1),
+                'avg_ms': round(i.total_ms / i.count, 1) if i.count else 0, 'plan': i.plan,
+                'first_seen': i.first_seen, 'last_seen': i.last_seen})
+        return Response(data)
+
 class LogDetailView(APIView):
+    """
+    查看日志详情, 支持.gz压缩文件
+    无参数: 文件开头至多1MB, 超出时truncated为true, 其余部分请使用以下方式
+    ?mode=tail &lines=行数
+    ?mode=range &offset=字节偏移 &size=字节数
+    ?mode=lines &start=起始行号 &lines=行数
+    ?mode=grep &q=关键字 &regex=1(需monitor_view权限) &ignore_case=1 &offset=起始字节 &limit=匹配行数
+    """
+    max_size = 1024 * 1024
+    max_lines = 5000
+
+    def get_int(self, name, default, minimum=0, maximum=None):
+        try:
+            value = max(int(self.request.query_params.get(name, default)), minimum)
+        except ValueError:
+            raise ParseError('参数格式错误')
+        return min(value, maximum) if maximum is not None else value
 
+    @swagger_auto_schema(manual_parameters=[
+        openapi.Parameter('mode', openapi.IN_QUERY, description='tail|range|lines|grep', type=openapi.TYPE_STRING),
+        openapi.Parameter('q', openapi.IN_QUERY, description='搜索关键字(grep)', type=openapi.TYPE_STRING),
+    ])
     def get(self, request, name):
         """
         查看日志详情
         """
-        try:
-            with open(os.path.join(settings.LOG_PATH, name)) as f:
-                data = f.read()
-            return Response(data)
-        except:
-            return Response('未找到', status=status.HTTP_404_NOT_FOUND)
\ No newline at end of file
+        filepath = get_log_file(name)
+        if filepath is None:
+            return Response('未找到', status=status.HTTP_404_NOT_FOUND)
+        mode = request.query_params.get('mode', None)
+        if mode is None:
+            return Response(read_all(filepath, self.max_size))
+        if mode == 'tail':
+            data = read_tail(filepath, self.get_int('lines', 200, maximum=self.max_lines))
+        elif mode == 'range':
+            data = read_range(filepath, self.get_int('offset', 0),
+                              self.get_int('size', 64 * 1024, minimum=1, maximum=self.max_size))
+        elif mode == 'lines':
+            data = read_lines(filepath, self.get_int('start', 0), self.get_int('lines', 200, maximum=self.max_lines))
+        elif mode == 'grep':
+            pattern = request.query_params.get('q', '')
+            if not pattern:
+                raise ParseError('请输入搜索关键字')
+            regex = request.query_params.get('regex') in ('1', 'true')
+            if regex and not has_perm(request.user, 'monitor_view'):  # 正则可能回溯过慢, 无监控权限时只能按关键字搜索
+                raise PermissionDenied('无监控权限, 不能使用正则搜索')
+            try:
+                data = grep(filepath, pattern, offset=self.get_int('offset', 0),
+                            limit=self.get_int('limit', 200, minimum=1, maximum=2000),
+                            ignore_case=request.query_params.get('ignore_case') in ('1', 'true'), regex=regex)
+            except re.error:
+                raise ParseError('正则表达式错误')
+        else:
+            raise ParseError('不支持的mode')
+        data['size'] = None if filepath.endswith('.gz') else os.path.getsize(filepath)
+        return Response(data)
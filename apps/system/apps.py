@@ -6,4 +6,4 @@ class SystemConfig(AppConfig):
     verbose_name = '系统管理'
 
     def ready(self):
-        import apps.system.signals
\ No newline at end of file
+        import apps.system.signals
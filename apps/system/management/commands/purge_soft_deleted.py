@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from apps.system.purge import PURGE_MODES, get_purge_preview, purge_soft_deleted
+
+
+class Command(BaseCommand):
+    help = '清理删除超过保留期的软删除数据(归档或直接删除), 被引用的数据跳过'
+
+    def add_arguments(self, parser):
+        parser.add_argument('models', nargs='*', help='模型(如wf.Ticket), 默认SOFT_DELETE_PURGE_MODELS')
+        parser.add_argument('--days', type=int, default=None, help='默认SOFT_DELETE_RETENTION_DAYS')
+        parser.add_argument('--mode', choices=PURGE_MODES, default=None, help='默认SOFT_DELETE_PURGE_MODE')
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--sleep', type=float, default=None, help='每批间隔秒数')
+        parser.add_argument('--dry-run', action='store_true', help='只统计不清理')
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            for i in get_purge_preview(options['models'], options['days']):
+                self.stdout.write('{model}: 已删除{deleted}条, 可清理{eligible}条, 被引用跳过{skipped}条'.format(**i))
+            return
+
+        def progress(result):
+            self.stdout.write('{model}: {purged}/{eligible}'.format(**result))
+        results = purge_soft_deleted(options['models'], options['days'], options['mode'], options['batch_size'],
+                                     options['sleep'], progress)
+        for i in results:
+            self.stdout.write(self.style.SUCCESS(
+                '{model}: 清理{purged}条(含级联{rows}行), 跳过{skipped}条'.format(**i)))
@@ -0,0 +1,164 @@
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from apps.monitor.metrics import count_cache
+from .models import Organization, User
+from .versions import bump_model_version, get_versions
+
+# 成员关系的版本号存于数据库(ModelVersion), 缓存键包含版本号:
+# 任一进程写入并提交后, 所有进程(含celery)读到新版本即重新构建, 进程内缓存无需跨进程清除;
+# 版本号在进程内缓存MEMBERSHIP_VERSION_SECONDS秒, 本进程的写入立即生效, 其他进程的写入最迟在该时间后生效
+ROLE_USERS_VERSION = 'membership.role_users'
+DEPT_USERS_VERSION = 'membership.dept_users'
+DEPT_PARENTS_VERSION = 'membership.dept_parents'
+MEMBERSHIP_VERSIONS = [ROLE_USERS_VERSION, DEPT_USERS_VERSION, DEPT_PARENTS_VERSION]
+MEMBERSHIP_KEY = 'membership__{}__{}'
+MEMBERSHIP_TIMEOUT = 60*60
+
+_versions = (0, {})  # (过期时间, 版本号), 整体替换保证线程安全
+
+
+def _as_id_list(ids):
+    if ids is None:
+        return []
+    if not isinstance(ids, (list, tuple, set)):
+        ids = [ids]
+    return [int(i) for i in ids]
+
+
+def get_membership_version(label):
+    """
+    进程内缓存的版本号, 过期时一次查询刷新全部成员关系的版本号
+    """
+    global _versions
+    expires, versions = _versions
+    now = time.monotonic()
+    if now >= expires:
+        versions = dict(zip(MEMBERSHIP_VERSIONS, get_versions(MEMBERSHIP_VERSIONS)))
+        _versions = (now + settings.MEMBERSHIP_VERSION_SECONDS, versions)
+    return versions[label]
+
+
+def expire_membership_versions():
+    global _versions
+    _versions = (0, {})
+
+
+def get_cached_map(label, build):
+    """
+    按数据库中的版本号读取进程内缓存, 版本变化或过期时重新构建
+    """
+    key = MEMBERSHIP_KEY.format(label, get_membership_version(label))
+    data = count_cache('membership', cache.get(key))
+    if data is None:
+        data = build()
+        cache.set(key, data, MEMBERSHIP_TIMEOUT)
+    return data
+
+
+def build_role_user_map():
+    data = {}
+    for user_id, role_id in User.roles.through.objects.values_list('user_id', 'role_id'):
+        data.setdefault(role_id, []).append(user_id)
+    return data
+
+
+def build_dept_user_map():
+    data = {}
+    for user_id, dept_id in User.objects.filter(dept__isnull=False).values_list('id', 'dept_id'):
+        data.setdefault(dept_id, []).append(user_id)
+    return data
+
+
+def build_dept_parent_map():
+    data = {}
+    for dept_id, parent_id, is_deleted in Organization.all_objects.values_list('id', 'parent_id', 'is_deleted'):
+        data[dept_id] = (parent_id, is_deleted)
+    return data
+
+
+def get_role_user_map():
+    """
+    角色id -> 用户id列表, 一次查询构建并缓存
+    """
+    return get_cached_map(ROLE_USERS_VERSION, build_role_user_map)
+
+
+def get_dept_user_map():
+    """
+    部门id -> 用户id列表, 一次查询构建并缓存
+    """
+    return get_cached_map(DEPT_USERS_VERSION, build_dept_user_map)
+
+
+def get_dept_parent_map():
+    """
+    部门id -> (父部门id, 是否已删除), 包含软删除的部门以保证上级链完整
+    """
+    return get_cached_map(DEPT_PARENTS_VERSION, build_dept_parent_map)
+
+
+def get_role_user_ids(role_ids):
+    """
+    拥有任一角色的用户id集合
+    """
+    role_map = get_role_user_map()
+    user_ids = set()
+    for role_id in _as_id_list(role_ids):
+        user_ids.update(role_map.get(role_id, []))
+    return user_ids
+
+
+def get_dept_user_ids(dept_ids):
+    """
+    属于任一部门的用户id集合
+    """
+    dept_map = get_dept_user_map()
+    user_ids = set()
+    for dept_id in _as_id_list(dept_ids):
+        user_ids.update(dept_map.get(dept_id, []))
+    return user_ids
+
+
+def get_parent_dept_ids(dept_id, hasSelf=True):
+    """
+    本部门及所有上级部门id集合, 与get_parent_queryset结果一致(排除已删除部门)
+    """
+    ids = set()
+    if dept_id is None:
+        return ids
+    parent_map = get_dept_parent_map()
+    current, seen = dept_id, set()
+    if not hasSelf:
+        current = parent_map.get(dept_id, (None, False))[0]
+    while current is not None and current not in seen:
+        seen.add(current)
+        parent_id, is_deleted = parent_map.get(current, (None, True))
+        if not is_deleted:
+            ids.add(current)
+        current = parent_id
+    return ids
+
+
+# 以下在写入的事务中递增版本号, 事务提交后各进程才读到新版本;
+# 本进程的版本号缓存立即及提交后各清除一次, 避免事务期间其他线程读入旧版本;
+# 直接写入User.roles中间表(through.objects.create/bulk_create/delete)不触发任何信号, 须在写入后自行调用invalidate_role_users
+
+
+def invalidate_membership(label):
+    bump_model_version(label)
+    expire_membership_versions()
+    transaction.on_commit(expire_membership_versions)
+
+
+def invalidate_role_users():
+    invalidate_membership(ROLE_USERS_VERSION)
+
+
+def invalidate_dept_users():
+    invalidate_membership(DEPT_USERS_VERSION)
+
+
+def invalidate_dept_parents():
+    invalidate_membership(DEPT_PARENTS_VERSION)
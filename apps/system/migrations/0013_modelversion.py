@@ -0,0 +1,25 @@
+# Generated by Django 4.2.11 on 2026-10-19 19:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('system', '0012_alter_user_avatar'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ModelVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('label', models.CharField(max_length=100, unique=True, verbose_name='模型')),
+                ('version', models.PositiveBigIntegerField(default=0, verbose_name='版本号')),
+            ],
+            options={
+                'verbose_name': '模型版本',
+                'verbose_name_plural': '模型版本',
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.11 on 2026-10-19 19:40
+
+import django.core.serializers.json
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('system', '0013_modelversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SoftDeleteArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=100, verbose_name='模型')),
+                ('object_id', models.CharField(max_length=64, verbose_name='主键')),
+                ('data', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder, verbose_name='数据')),
+                ('deleted_time', models.DateTimeField(blank=True, null=True, verbose_name='删除时间')),
+                ('archive_time', models.DateTimeField(default=django.utils.timezone.now, verbose_name='归档时间')),
+            ],
+            options={
+                'verbose_name': '软删除归档',
+                'verbose_name_plural': '软删除归档',
+                'indexes': [models.Index(fields=['model', 'object_id'], name='system_soft_model_206990_idx'), models.Index(fields=['archive_time'], name='system_soft_archive_7b8ec1_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 4.2.11 on 2026-10-19 19:51
+
+import apps.system.models
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('system', '0014_softdeletearchive'),
+    ]
+
+    operations = [
+        migrations.AlterModelManagers(
+            name='user',
+            managers=[
+                ('objects', apps.system.models.UserManager()),
+            ],
+        ),
+    ]
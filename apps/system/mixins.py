@@ -1,4 +1,17 @@
+import hashlib
 from django.db.models.query import QuerySet
+from django.db import connections
+from django.http import HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import parse_etags
+from django.utils import timezone
+from rest_framework.decorators import action
+from rest_framework.exceptions import ParseError
+from utils.export import EXPORT_TYPES, format_value, iter_gzip
+from .membership import DEPT_USERS_VERSION, ROLE_USERS_VERSION
+from .versions import get_versions
+
+# 响应可能随用户的角色、权限及数据范围不同, ETag计入用户及这些数据的版本号
+USER_SCOPE_VERSIONS = ['system.Role', 'system.Permission', ROLE_USERS_VERSION, DEPT_USERS_VERSION]
 
 class CreateUpdateModelAMixin:
     """
@@ -45,4 +58,109 @@ class OptimizationMixin:
             queryset = self.get_serializer_class().setup_eager_loading(queryset)  # 性能优化
         return queryset
 
-    
\ No newline at end of file
+    
+
+class ExportMixin:
+    """
+    流式导出, 与列表接口使用相同的查询集、过滤及数据权限
+    export_fields: [(字段, 表头)], 字段可跨表如'dept__name'
+    MySQL下按主键顺序分批导出, 其他数据库保持列表排序
+    ?type=csv|jsonl|xlsx &gzip=1
+    """
+    export_fields = []
+    export_chunk_size = 2000
+
+    def get_export_rows(self, queryset, keys):
+        choices = {}
+        for key in keys:
+            if '__' not in key:
+                field = queryset.model._meta.get_field(key)
+                if field.choices:
+                    choices[key] = dict(field.flatchoices)
+        queryset = queryset.select_related(None).prefetch_related(None).values_list('pk', *keys)
+        for row in self.iter_export_queryset(queryset):
+            yield [format_value(choices[k].get(v, v) if k in choices else v) for k, v in zip(keys, row[1:])]
+
+    def iter_export_queryset(self, queryset):
+        if connections[queryset.db].vendor != 'mysql':
+            yield from queryset.iterator(chunk_size=self.export_chunk_size)
+            return
+        # MySQL驱动不支持流式读取, iterator仍会一次性载入全部结果, 改为按主键分批读取
+        ordering = queryset.query.order_by or queryset.model._meta.ordering
+        desc = bool(ordering) and str(ordering[0]).startswith('-')
+        queryset = queryset.order_by('-pk' if desc else 'pk')
+        batch = list(queryset[:self.export_chunk_size])
+        while batch:
+            yield from batch
+            last = batch[-1][0]
+            batch = list(queryset.filter(**{'pk__lt' if desc else 'pk__gt': last})[:self.export_chunk_size])
+
+    @action(methods=['get'], detail=False)
+    def export(self, request, *args, **kwargs):
+        """
+        导出
+        """
+        export_type = request.query_params.get('type', 'csv')
+        if export_type not in EXPORT_TYPES:
+            raise ParseError('不支持的导出格式')
+        if not self.export_fields:
+            raise ParseError('该接口未配置导出字段')
+        queryset = self.filter_queryset(self.get_queryset())
+        keys = [i[0] for i in self.export_fields]
+        headers = [i[1] for i in self.export_fields]
+        writer, content_type = EXPORT_TYPES[export_type]
+        content = writer(headers, self.get_export_rows(queryset, keys))
+        filename = '{}_{}.{}'.format(queryset.model._meta.model_name,
+                                     timezone.localtime().strftime('%Y%m%d%H%M%S'), export_type)
+        if request.query_params.get('gzip', None) and export_type != 'xlsx':  # xlsx本身已压缩
+            content = iter_gzip(content)
+            content_type = 'application/gzip'
+            filename += '.gz'
+        response = StreamingHttpResponse(content, content_type=content_type)
+        response['Content-Disposition'] = 'attachment; filename="{}"'.format(filename)
+        return response
+
+
+class NotModified(Exception):
+    pass
+
+
+class ConditionalGetMixin:
+    """
+    基于模型版本号的ETag, If-None-Match匹配时在序列化前直接返回304
+    ETag按用户区分, 并在用户的角色、权限或部门变化时失效
+    etag_models: 影响响应内容的模型, 默认为queryset的模型, 需已通过track_model_versions登记
+    etag_actions: 启用ETag的action
+    """
+    etag_models = None
+    etag_actions = ['list', 'retrieve']
+
+    def get_etag(self, request):
+        models = self.etag_models or [self.queryset.model]
+        versions = get_versions([i._meta.label for i in models] + USER_SCOPE_VERSIONS)
+        key = '{}|{}|{}|{}|{}'.format(self.action, request.user.id, request.get_full_path(),
+                                      request.accepted_renderer.format, versions)
+        return 'W/"{}"'.format(hashlib.md5(key.encode()).hexdigest())
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)  # 认证及权限校验之后
+        self.etag = None
+        if request.method in ('GET', 'HEAD') and self.action in self.etag_actions:
+            self.etag = self.get_etag(request)
+            etags = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+            if self.etag in etags or '*' in etags:
+                raise NotModified()
+
+    def handle_exception(self, exc):
+        if isinstance(exc, NotModified):
+            response = HttpResponseNotModified()
+            response['ETag'] = self.etag
+            return response
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if getattr(self, 'etag', None) and response.status_code == 200:
+            response['ETag'] = self.etag
+            response['Cache-Control'] = 'private, no-cache'  # 每次使用前向服务端验证
+        return response
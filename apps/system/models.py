@@ -1,5 +1,6 @@
 from django.db import models
-from django.contrib.auth.models import AbstractUser
+from django.contrib.auth.models import AbstractUser, UserManager as BaseUserManager
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db.models.base import Model
 import django.utils.timezone as timezone
 from django.db.models.query import QuerySet
@@ -101,10 +102,36 @@ class Role(SoftModel):
         return self.name
 
 
+class UserQuerySet(QuerySet):
+    """
+    queryset.update/bulk_update/bulk_create不触发信号, 涉及部门时在此使成员关系缓存失效
+    """
+
+    def update(self, **kwargs):
+        rows = super().update(**kwargs)
+        if 'dept' in kwargs or 'dept_id' in kwargs:  # bulk_update也经由此处
+            from .membership import invalidate_dept_users
+            invalidate_dept_users()
+        return rows
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super().bulk_create(objs, *args, **kwargs)
+        if any(i.dept_id for i in objs):
+            from .membership import invalidate_dept_users
+            invalidate_dept_users()
+        return objs
+
+
+class UserManager(BaseUserManager.from_queryset(UserQuerySet)):
+    pass
+
+
 class User(AbstractUser):
     """
     使用者
     """
+    objects = UserManager()
+
     # 基本資料
     avatar = models.CharField(
         '大頭貼', default='/media/default/avatar.png', max_length=255, null=True, blank=True)
@@ -306,4 +333,40 @@ class VerificationCode(BaseModel):
         """
         檢查驗證碼是否有效
         """
-        return not self.is_used and not self.is_expired_now() and self.attempt_count < self.MAX_ATTEMPTS
\ No newline at end of file
+        return not self.is_used and not self.is_expired_now() and self.attempt_count < self.MAX_ATTEMPTS
+
+class ModelVersion(models.Model):
+    """
+    模型变更计数, 模型数据写入时递增, 用于生成ETag
+    """
+    label = models.CharField('模型', max_length=100, unique=True)
+    version = models.PositiveBigIntegerField('版本号', default=0)
+
+    class Meta:
+        verbose_name = '模型版本'
+        verbose_name_plural = verbose_name
+
+    def __str__(self):
+        return '{}:{}'.format(self.label, self.version)
+
+
+class SoftDeleteArchive(models.Model):
+    """
+    软删除数据清理时的归档, 含随之级联删除的关联数据
+    """
+    model = models.CharField('模型', max_length=100)
+    object_id = models.CharField('主键', max_length=64)
+    data = models.JSONField('数据', encoder=DjangoJSONEncoder)
+    deleted_time = models.DateTimeField('删除时间', null=True, blank=True)
+    archive_time = models.DateTimeField('归档时间', default=timezone.now)
+
+    class Meta:
+        verbose_name = '软删除归档'
+        verbose_name_plural = verbose_name
+        indexes = [
+            models.Index(fields=['model', 'object_id']),
+            models.Index(fields=['archive_time']),
+        ]
+
+    def __str__(self):
+        return '{}:{}'.format(self.model, self.object_id)
@@ -2,6 +2,7 @@ from django.core.cache import cache
 from rest_framework.permissions import BasePermission
 from utils.queryset import get_child_queryset2
 from .models import Organization, Permission
+from apps.monitor.metrics import count_cache
 from django.db.models import Q
 
 def get_permission_list(user):
@@ -22,6 +23,16 @@ def get_permission_list(user):
     return perms_list
 
 
+def has_perm(user, code):
+    """
+    非视图中校验权限(如中间件), 与RbacPermission一致: 超级管理员为admin, 拥有全部权限
+    """
+    if user is None or not user.is_authenticated:
+        return False
+    perms = count_cache('permissions', cache.get(user.username + '__perms')) or get_permission_list(user)
+    return 'admin' in perms or code in perms
+
+
 class RbacPermission(BasePermission):
     """
     基于角色的权限校验类
@@ -37,7 +48,7 @@ class RbacPermission(BasePermission):
         if not request.user:
             perms = ['visitor'] # 如果没有经过认证,视为游客
         else:
-            perms = cache.get(request.user.username + '__perms')
+            perms = count_cache('permissions', cache.get(request.user.username + '__perms'))
         if not perms:
             perms = get_permission_list(request.user)
         if perms:
@@ -0,0 +1,228 @@
+import logging
+import time
+from datetime import timedelta
+from django.apps import apps
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, models, transaction
+from django.db.migrations.recorder import MigrationRecorder
+from django.db.models.deletion import Collector
+from django.utils import timezone
+from utils.model import SoftModel
+from .models import SoftDeleteArchive
+from .versions import bump_model_versions
+
+logger = logging.getLogger('log')
+
+PURGE_MODES = ('archive', 'delete')
+
+# 从属数据(模型, 外键字段): 随主数据一并清理
+OWNED_RELATIONS = {
+    ('wf.TicketFlow', 'ticket'),
+    ('wf.TicketVoteRound', 'ticket'),
+    ('wf.TicketVote', 'ticket'),
+    ('wf.TicketSearchIndex', 'ticket'),
+    ('wf.TicketFieldValue', 'ticket'),
+    ('wf.StateDwellRollup', 'workflow'),
+    ('wf.ApproverRollup', 'workflow'),
+    ('wf.CycleTimeRollup', 'workflow'),
+    ('line_bot.LineMessageAttachment', 'message'),
+}
+OWNED_MODELS = {i[0] for i in OWNED_RELATIONS}
+# 随软删除清理上线的迁移, 之后的软删除均更新update_time
+TRACKED_SINCE = ('system', '0014_softdeletearchive')
+
+
+def is_history_model(model):
+    # simple_history的历史表本就允许引用已删除的数据
+    return any(f.name == 'history_id' for f in model._meta.concrete_fields)
+
+
+def get_blocking_querysets(model):
+    """
+    阻止清理的引用: 从属关系(OWNED_RELATIONS及多对多中间表)随之级联删除, 不阻止;
+    其余CASCADE/PROTECT引用中, 软删除模型只有未删除的数据阻止, 其他模型(如流转日志引用的状态)有数据即阻止;
+    DO_NOTHING引用(如归档工单、工单事件)有数据即阻止, 避免悬空引用; SET_NULL等由删除时置空, 不阻止
+    返回[(本表字段, 引用值queryset)]
+    """
+    blocking = []
+    for rel in model._meta.get_fields(include_hidden=True):
+        if not rel.auto_created or rel.concrete or not (rel.one_to_many or rel.one_to_one):
+            continue
+        related = rel.related_model
+        if is_history_model(related) or related._meta.auto_created or \
+                (related._meta.label, rel.field.name) in OWNED_RELATIONS:
+            continue
+        on_delete = rel.on_delete
+        if on_delete not in (models.CASCADE, models.PROTECT, models.RESTRICT, models.DO_NOTHING):
+            continue
+        queryset = related._base_manager.filter(**{rel.field.name + '__isnull': False})
+        if issubclass(related, SoftModel) and on_delete is not models.DO_NOTHING:
+            queryset = queryset.filter(is_deleted=False)
+        blocking.append((rel.field.target_field.attname, queryset.values(rel.field.attname)))
+    return blocking
+
+
+def get_tracked_since():
+    """
+    开始记录删除时间的时间(TRACKED_SINCE迁移的执行时间), 未执行时返回None;
+    此前queryset软删除不更新update_time, 这些数据的删除时间未知
+    """
+    app, name = TRACKED_SINCE
+    return MigrationRecorder.Migration.objects.filter(app=app, name=name).values_list('applied', flat=True).first()
+
+
+def get_candidates(model, before):
+    """
+    可清理的数据: 删除(以update_time为准)早于before且未被阻止;
+    before早于开始记录删除时间时, 无法确认已删除满保留期, 全部跳过
+    """
+    queryset = model._base_manager.filter(is_deleted=True, update_time__lt=before)
+    tracked_since = get_tracked_since()
+    if tracked_since is None or before <= tracked_since:
+        return queryset, queryset.none()
+    eligible = queryset
+    for attname, values in get_blocking_querysets(model):
+        eligible = eligible.exclude(**{attname + '__in': values})
+    return queryset, eligible
+
+
+def get_row_data(obj):
+    return {f.attname: f.value_from_object(obj) for f in obj._meta.concrete_fields}
+
+
+def get_deleted_time(obj, tracked_since):
+    update_time = getattr(obj, 'update_time', None)
+    if not getattr(obj, 'is_deleted', False) or update_time is None or \
+            (tracked_since is not None and update_time < tracked_since):
+        return None  # 未删除或删除时间未知
+    return update_time
+
+
+def archive_collected(collector, archive_time, tracked_since=None):
+    """
+    归档将被删除的全部数据, 包括级联对象及快速删除的关联数据
+    """
+    rows = []
+    for model, instances in collector.data.items():
+        for obj in instances:
+            rows.append(obj)
+    for queryset in collector.fast_deletes:
+        rows.extend(queryset.iterator())
+    SoftDeleteArchive.objects.bulk_create([SoftDeleteArchive(
+        model=obj._meta.label, object_id=str(obj.pk), data=get_row_data(obj),
+        deleted_time=get_deleted_time(obj, tracked_since),
+        archive_time=archive_time) for obj in rows], batch_size=500)
+    bump_model_versions(SoftDeleteArchive)
+    return len(rows)
+
+
+def delete_collected(collector):
+    """
+    删除收集的数据, 返回删除行数; 中间表等不发送删除信号的数据在删除后递增其数据表版本号
+    """
+    rows = sum(collector.delete()[1].values())
+    bump_model_versions(*collector.data, *(qs.model for qs in collector.fast_deletes))
+    return rows
+
+
+def has_live_rows(collector):
+    """
+    级联范围内是否包含未删除的软删除模型数据(从属数据除外), 用于拦截多级级联
+    """
+    for model, instances in collector.data.items():
+        if issubclass(model, SoftModel) and model._meta.label not in OWNED_MODELS and \
+                any(not i.is_deleted for i in instances):
+            return True
+    return any(issubclass(qs.model, SoftModel) and qs.model._meta.label not in OWNED_MODELS and
+               qs.filter(is_deleted=False).exists() for qs in collector.fast_deletes)
+
+
+def collect(objs):
+    """
+    收集本批数据的级联范围, 级联到未删除数据时逐条收集并跳过这些数据
+    返回[(数据, collector)]
+    """
+    collector = Collector(using=DEFAULT_DB_ALIAS)
+    collector.collect(objs)
+    if not has_live_rows(collector):
+        return [(objs, collector)]
+    collected = []
+    for obj in objs:
+        collector = Collector(using=DEFAULT_DB_ALIAS)
+        collector.collect([obj])
+        if not has_live_rows(collector):
+            collected.append(([obj], collector))
+    return collected
+
+
+def purge_model(model, before, mode='archive', batch_size=200, sleep=0, progress=None):
+    """
+    分批清理单个模型的软删除数据, 返回统计
+    """
+    label = model._meta.label
+    queryset, eligible = get_candidates(model, before)
+    tracked_since = get_tracked_since()
+    result = {'model': label, 'deleted': queryset.count(), 'eligible': eligible.count(), 'purged': 0, 'rows': 0}
+    last_pk = None
+    while True:
+        batch = eligible.order_by('pk')
+        if last_pk is not None:
+            batch = batch.filter(pk__gt=last_pk)
+        ids = list(batch.values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            break
+        last_pk = ids[-1]
+        with transaction.atomic():
+            # 锁定后重新检查, 期间被恢复或重新引用的数据跳过
+            objs = list(eligible.select_for_update().filter(pk__in=ids))
+            for group, collector in collect(objs) if objs else []:
+                if mode == 'archive':
+                    result['rows'] += archive_collected(collector, timezone.now(), tracked_since)
+                    delete_collected(collector)
+                else:
+                    result['rows'] += delete_collected(collector)
+                result['purged'] += len(group)
+        if progress is not None:
+            progress(result)
+        if sleep:
+            time.sleep(sleep)  # 降低对线上数据库的压力
+    result['skipped'] = result['deleted'] - result['purged']
+    logger.info('软删除清理 %s: 清理%s条(含级联%s行), 跳过%s条', label, result['purged'], result['rows'],
+                result['skipped'])
+    return result
+
+
+def purge_soft_deleted(labels=None, days=None, mode=None, batch_size=200, sleep=None, progress=None):
+    """
+    清理删除超过days天的软删除数据; mode为archive时归档到SoftDeleteArchive后删除, delete时直接删除
+    按labels顺序处理, 被引用的数据跳过(见get_blocking_querysets), 从属数据随之清理
+    """
+    labels = labels or settings.SOFT_DELETE_PURGE_MODELS
+    days = settings.SOFT_DELETE_RETENTION_DAYS if days is None else days
+    mode = mode or settings.SOFT_DELETE_PURGE_MODE
+    sleep = settings.SOFT_DELETE_PURGE_SLEEP if sleep is None else sleep
+    if mode not in PURGE_MODES:
+        raise ValueError('不支持的清理方式: {}'.format(mode))
+    before = timezone.now() - timedelta(days=days)
+    results = []
+    for label in labels:
+        model = apps.get_model(label)
+        if not issubclass(model, SoftModel):
+            raise ValueError('{}不是软删除模型'.format(label))
+        results.append(purge_model(model, before, mode, batch_size, sleep, progress))
+    return results
+
+
+def get_purge_preview(labels=None, days=None):
+    """
+    预览各模型可清理及被阻止的数量, 不做修改
+    """
+    labels = labels or settings.SOFT_DELETE_PURGE_MODELS
+    days = settings.SOFT_DELETE_RETENTION_DAYS if days is None else days
+    before = timezone.now() - timedelta(days=days)
+    results = []
+    for label in labels:
+        queryset, eligible = get_candidates(apps.get_model(label), before)
+        deleted, count = queryset.count(), eligible.count()
+        results.append({'model': label, 'deleted': deleted, 'eligible': count, 'skipped': deleted - count})
+    return results
@@ -1,12 +1,60 @@
-from django.db.models.signals import m2m_changed
-from .models import Role, Permission, User
+from django.db.models.signals import m2m_changed, post_init, post_save, post_delete
+from .models import Dict, DictType, Role, Permission, Position, SoftDeleteArchive, User, Organization
 from django.dispatch import receiver
 from django.core.cache import cache
 from .permission import get_permission_list
+from .membership import invalidate_role_users, invalidate_dept_users, invalidate_dept_parents
+from .versions import track_model_versions
+from utils.model import post_soft_delete
+
+UNKNOWN_DEPT = object()
+
+# 基础数据变更时递增版本号, 用于ETag
+track_model_versions(Dict, DictType, Permission, Role, Position, Organization)
+# 列表总数缓存按版本号失效(见utils.pagination.get_count), 写入频繁, 提交后递增
+track_model_versions(User, SoftDeleteArchive, on_commit=True)
 
 # 变更用户角色时动态更新权限或者前端刷新
 @receiver(m2m_changed, sender=User.roles.through)
 def update_perms_cache_user(sender, instance, action, **kwargs):
     if action in ['post_remove', 'post_add']:
         if cache.get(instance.username+'__perms', None):
-            get_permission_list(instance)
\ No newline at end of file
+            get_permission_list(instance)
+
+# 变更用户角色时刷新角色成员缓存
+@receiver(m2m_changed, sender=User.roles.through)
+def update_role_users_cache(sender, instance, action, **kwargs):
+    if action in ['post_remove', 'post_add', 'post_clear']:
+        invalidate_role_users()
+
+# 记录加载时的部门, 保存时部门变化才刷新成员缓存(延迟加载dept时视为未知)
+@receiver(post_init, sender=User)
+def remember_user_dept(sender, instance, **kwargs):
+    instance._loaded_dept_id = instance.__dict__.get('dept_id', UNKNOWN_DEPT)
+
+# 用户部门变更或用户删除时刷新成员缓存
+@receiver(post_save, sender=User)
+def update_dept_users_cache(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is not None and not {'dept', 'dept_id'} & set(update_fields):
+        return  # 如登录时只更新last_login
+    loaded = getattr(instance, '_loaded_dept_id', UNKNOWN_DEPT)
+    instance._loaded_dept_id = instance.dept_id
+    if instance.dept_id == (None if created else loaded):
+        return  # 如只修改个人资料
+    invalidate_dept_users()
+
+@receiver(post_delete, sender=User)
+def update_membership_cache_user_delete(sender, instance, **kwargs):
+    invalidate_dept_users()
+    invalidate_role_users()
+
+@receiver(post_delete, sender=Role)
+def update_role_users_cache_role_delete(sender, instance, **kwargs):
+    invalidate_role_users()
+
+# 部门层级变更时刷新上级部门缓存
+@receiver(post_save, sender=Organization)
+@receiver(post_delete, sender=Organization)
+@receiver(post_soft_delete, sender=Organization)
+def update_dept_parents_cache(sender, **kwargs):
+    invalidate_dept_parents()
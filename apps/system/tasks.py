@@ -2,8 +2,17 @@
 from __future__ import absolute_import, unicode_literals
 
 from celery import shared_task
+from apps.system.purge import purge_soft_deleted
 
 
 @shared_task
 def show():
-    print('ok')
\ No newline at end of file
+    print('ok')
+
+
+@shared_task
+def purge_soft_deleted_data(days=None, mode=None, batch_size=200):
+    """
+    清理删除超过保留期的软删除数据, 可在django_celery_beat中配置为定时任务
+    """
+    return purge_soft_deleted(days=days, mode=mode, batch_size=batch_size)
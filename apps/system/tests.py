@@ -1,3 +1,392 @@
-from django.test import TestCase
+import csv
+import gzip
+import io
+import json
+import time
+import zipfile
+from datetime import timedelta
+from urllib.parse import parse_qs, urlparse
+from django.core.cache import cache
+from django.db.models import F
+from django.db.migrations.recorder import MigrationRecorder
+from django.db.models.query import QuerySet
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase
+from django.utils import timezone
+from unittest import mock
+from rest_framework.test import APIRequestFactory, force_authenticate
+from utils.db.router import PIN_COOKIE, ReplicaMiddleware, ReplicaRouter, routing_state
+from utils.pagination import get_count
+from .membership import DEPT_USERS_VERSION, expire_membership_versions, get_dept_user_ids, get_parent_dept_ids, \
+    get_role_user_ids, invalidate_role_users
+from .models import ModelVersion, Organization, Permission, Role, SoftDeleteArchive, User
+from .purge import TRACKED_SINCE, get_purge_preview, purge_soft_deleted
+from .versions import get_versions
+from .views import RoleViewSet, UserViewSet
 
-# Create your tests here.
+
+class MembershipCacheTest(TestCase):
+    """
+    角色/部门成员关系缓存: 版本号存于数据库, 各种写入方式均使缓存失效
+    """
+
+    def setUp(self):
+        cache.clear()
+        expire_membership_versions()
+        self.root = Organization.objects.create(name='root', type='root')
+        self.dept = Organization.objects.create(name='dept', parent=self.root)
+        self.other = Organization.objects.create(name='other', parent=self.root)
+        self.role = Role.objects.create(name='role')
+        self.user = User.objects.create(username='u1', dept=self.dept)
+
+    def test_role_users(self):
+        self.assertEqual(get_role_user_ids(self.role.id), set())
+        self.user.roles.add(self.role)
+        self.assertEqual(get_role_user_ids(self.role.id), {self.user.id})
+        self.user.roles.remove(self.role)
+        self.assertEqual(get_role_user_ids([self.role.id]), set())
+
+    def test_role_users_set_and_through_writes(self):
+        get_role_user_ids(self.role.id)
+        self.user.roles.set([self.role])
+        self.assertEqual(get_role_user_ids(self.role.id), {self.user.id})
+        self.user.roles.clear()
+        self.assertEqual(get_role_user_ids(self.role.id), set())
+        # 直接写入中间表不触发信号, 写入后自行使缓存失效
+        through = User.roles.through
+        through.objects.bulk_create([through(user=self.user, role=self.role)])
+        invalidate_role_users()
+        self.assertEqual(get_role_user_ids(self.role.id), {self.user.id})
+
+    def test_dept_users_queryset_update(self):
+        self.assertEqual(get_dept_user_ids(self.dept.id), {self.user.id})
+        User.objects.filter(pk=self.user.pk).update(dept=self.other)
+        self.assertEqual(get_dept_user_ids(self.dept.id), set())
+        self.assertEqual(get_dept_user_ids(self.other.id), {self.user.id})
+
+    def test_dept_users_bulk_writes(self):
+        get_dept_user_ids(self.other.id)
+        self.user.dept = self.other
+        User.objects.bulk_update([self.user], ['dept'])
+        self.assertEqual(get_dept_user_ids(self.other.id), {self.user.id})
+        user = User.objects.bulk_create([User(username='u2', dept=self.dept)])[0]
+        self.assertEqual(get_dept_user_ids(self.dept.id), {user.id})
+
+    def test_stale_process_cache_not_used(self):
+        """
+        其他进程的缓存无法清除: 数据库版本号变化后, 最迟MEMBERSHIP_VERSION_SECONDS秒旧缓存即不再被读取
+        """
+        self.assertEqual(get_dept_user_ids(self.dept.id), {self.user.id})
+        # 模拟其他进程写入: 不经本进程缓存, 只修改数据并递增数据库中的版本号
+        QuerySet(User).filter(pk=self.user.pk).update(dept=None)
+        ModelVersion.objects.filter(label=DEPT_USERS_VERSION).update(version=F('version') + 1)
+        self.assertEqual(get_dept_user_ids(self.dept.id), {self.user.id})
+        with mock.patch('apps.system.membership.time.monotonic', return_value=time.monotonic() + 60):
+            self.assertEqual(get_dept_user_ids(self.dept.id), set())
+
+    def test_no_queries_when_cached(self):
+        get_role_user_ids(self.role.id)
+        get_dept_user_ids(self.dept.id)
+        get_parent_dept_ids(self.dept.id)
+        with self.assertNumQueries(0):
+            get_role_user_ids(self.role.id)
+            get_dept_user_ids(self.dept.id)
+            get_parent_dept_ids(self.dept.id)
+
+    def test_profile_edit_keeps_dept_users(self):
+        get_dept_user_ids(self.dept.id)
+        version = get_versions([DEPT_USERS_VERSION])[0]
+        user = User.objects.get(pk=self.user.pk)
+        user.name = 'new name'
+        user.save()
+        self.assertEqual(get_versions([DEPT_USERS_VERSION])[0], version)
+        user.dept = self.other
+        user.save()
+        self.assertEqual(get_versions([DEPT_USERS_VERSION])[0], version + 1)
+        self.assertEqual(get_dept_user_ids(self.other.id), {self.user.id})
+        User.objects.only('username').get(pk=self.user.pk).save()  # 只保存已加载的字段
+        self.assertEqual(get_versions([DEPT_USERS_VERSION])[0], version + 1)
+        user = User.objects.only('username').get(pk=self.user.pk)
+        user.dept = self.dept  # 部门未加载时无法比较
+        user.save()
+        self.assertEqual(get_versions([DEPT_USERS_VERSION])[0], version + 2)
+        self.assertEqual(get_dept_user_ids(self.dept.id), {self.user.id})
+
+    def test_parent_depts(self):
+        self.assertEqual(get_parent_dept_ids(self.dept.id), {self.dept.id, self.root.id})
+        self.assertEqual(get_parent_dept_ids(self.dept.id, hasSelf=False), {self.root.id})
+        Organization.objects.filter(pk=self.root.pk).delete()  # queryset软删除
+        self.assertEqual(get_parent_dept_ids(self.dept.id), {self.dept.id})
+
+
+class ApiTestMixin:
+
+    def get(self, viewset, user, params=None, action='list', **kwargs):
+        request = APIRequestFactory().get('/', params or {})
+        force_authenticate(request, user=user)
+        response = viewset.as_view({'get': action})(request, **kwargs)
+        response.render()
+        return json.loads(response.content)
+
+
+class OrderedUserViewSet(UserViewSet):
+    ordering_fields = ['pk', 'username', 'dept__name']
+
+
+class CursorPaginationTest(ApiTestMixin, TestCase):
+    """
+    游标分页: 携带cursor参数时按排序字段定位, 不返回总数
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create(username='admin', is_superuser=True)
+        User.objects.bulk_create([User(username='user{}'.format(i)) for i in range(24)])
+
+    def test_pages(self):
+        ret = self.get(OrderedUserViewSet, self.admin, {'cursor': '', 'page_size': 10, 'ordering': '-pk'})
+        self.assertEqual(ret['code'], 200, ret['msg'])
+        self.assertNotIn('count', ret['data'])
+        ids = [i['id'] for i in ret['data']['results']]
+        while ret['data']['next']:
+            cursor = parse_qs(urlparse(ret['data']['next']).query)['cursor'][0]
+            ret = self.get(OrderedUserViewSet, self.admin, {'cursor': cursor, 'page_size': 10, 'ordering': '-pk'})
+            ids.extend(i['id'] for i in ret['data']['results'])
+        self.assertEqual(ids, list(User.objects.order_by('-pk').values_list('pk', flat=True)))
+
+    def test_page_number(self):
+        ret = self.get(UserViewSet, self.admin, {'page_size': 10})
+        self.assertEqual(ret['data']['count'], 25)
+        self.assertFalse(ret['data']['approximate'])
+        self.assertEqual(len(ret['data']['results']), 10)
+
+    def test_unsupported_ordering(self):
+        ret = self.get(OrderedUserViewSet, self.admin, {'cursor': '', 'ordering': 'dept__name'})
+        self.assertEqual(ret['code'], 400)
+
+
+class PurgeCountCacheTest(TestCase):
+    """
+    清理时批量写入的归档数据使分页总数缓存失效
+    """
+
+    def test_archive(self):
+        cache.clear()
+        Organization.objects.create(name='dept').delete()
+        self.assertEqual(get_count(SoftDeleteArchive.objects.all()), (0, False))
+        with self.assertNumQueries(1):  # 仅查询版本号
+            self.assertEqual(get_count(SoftDeleteArchive.objects.all()), (0, False))
+        with self.captureOnCommitCallbacks(execute=True):
+            purge_soft_deleted(['system.Organization'], days=-1, mode='archive')
+        self.assertEqual(get_count(SoftDeleteArchive.objects.all()), (1, False))
+
+
+@mock.patch('utils.db.router.get_replica', return_value='replica')
+class ReplicaRouterTest(TestCase):
+    """
+    读写分离: 安全方法请求读从库, 事务内及写入后读主库, 写入后的客户端短时间内固定读主库
+    """
+
+    def request(self, method, cookies=None, write=False):
+        states = []
+
+        def view(request):
+            states.append(ReplicaRouter().db_for_read(User))
+            if write:
+                ReplicaRouter().db_for_write(User)
+                states.append(ReplicaRouter().db_for_read(User))
+            return HttpResponse()
+        request = getattr(RequestFactory(), method)('/')
+        request.COOKIES.update(cookies or {})
+        response = ReplicaMiddleware(view)(request)
+        return states, response
+
+    def test_safe_method(self, _):
+        states, response = self.request('get')
+        # 测试用例在事务内执行, 事务内一律读主库
+        self.assertEqual(states, [None])
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+        self.assertIsNone(routing_state.get())
+
+    @mock.patch('utils.db.router.connections')
+    def test_route(self, connections, _):
+        connections.__getitem__.return_value.in_atomic_block = False
+        states, response = self.request('get', write=True)
+        self.assertEqual(states, ['replica', None])
+        self.assertIn(PIN_COOKIE, response.cookies)
+        states, response = self.request('get', cookies={PIN_COOKIE: response.cookies[PIN_COOKIE].value})
+        self.assertEqual(states, [None])
+        states, response = self.request('get', cookies={PIN_COOKIE: 'invalid'})
+        self.assertEqual(states, ['replica'])
+        states, response = self.request('post')
+        self.assertEqual(states, [None])
+        self.assertIn(PIN_COOKIE, response.cookies)
+
+    def test_no_routing_state(self, _):
+        self.assertIsNone(ReplicaRouter().db_for_read(User))
+        self.assertEqual(ReplicaRouter().db_for_write(User), 'default')
+        self.assertFalse(ReplicaRouter().allow_migrate('replica', 'system'))
+        self.assertIsNone(ReplicaRouter().allow_migrate('default', 'system'))
+
+    @mock.patch.object(QuerySet, 'count', autospec=True, return_value=5)
+    def test_count_cache_primary_only(self, count, *_):
+        cache.clear()
+        self.assertEqual(get_count(User.objects.all()), (5, False))
+        self.assertEqual(get_count(User.objects.all()), (5, False))
+        self.assertEqual(count.call_count, 1)
+        # 从库可能落后于已递增的版本号, 其总数不缓存
+        with mock.patch.object(QuerySet, 'db', new_callable=mock.PropertyMock, return_value='replica'), \
+                self.settings(COUNT_ESTIMATE_THRESHOLD=0):
+            get_count(User.objects.filter(is_active=True))
+            get_count(User.objects.filter(is_active=True))
+        self.assertEqual(count.call_count, 3)
+
+
+class PurgeTest(TestCase):
+    """
+    软删除清理: 删除满保留期的数据归档后删除; 上线前删除的数据删除时间未知, 上线满保留期后才清理
+    """
+
+    def setUp(self):
+        self.now = timezone.now()
+        self.legacy = self.create('legacy', days=200)  # 上线前删除, update_time早于实际删除时间
+        self.old = self.create('old', days=100)
+        self.recent = self.create('recent', days=10)
+        self.live = Organization.objects.create(name='live')
+
+    def create(self, name, days):
+        obj = Organization.objects.create(name=name)
+        obj.delete()
+        Organization.all_objects.filter(pk=obj.pk).update(update_time=self.now - timedelta(days=days))
+        return obj
+
+    def deploy(self, days):
+        app, name = TRACKED_SINCE
+        MigrationRecorder.Migration.objects.filter(app=app, name=name).update(applied=self.now - timedelta(days=days))
+
+    def remaining(self):
+        return set(Organization.all_objects.values_list('name', flat=True))
+
+    def test_recently_deployed(self):
+        self.deploy(days=30)
+        result = purge_soft_deleted(['system.Organization'], days=90)[0]
+        self.assertEqual((result['deleted'], result['purged'], result['skipped']), (2, 0, 2))
+        self.assertEqual(self.remaining(), {'legacy', 'old', 'recent', 'live'})
+        self.assertEqual(get_purge_preview(['system.Organization'], days=90)[0]['eligible'], 0)
+
+    def test_archive(self):
+        self.deploy(days=150)
+        self.assertEqual(get_purge_preview(['system.Organization'], days=90)[0]['eligible'], 2)
+        result = purge_soft_deleted(['system.Organization'], days=90, mode='archive')[0]
+        self.assertEqual((result['purged'], result['skipped']), (2, 0))
+        self.assertEqual(self.remaining(), {'recent', 'live'})
+        archives = {i.object_id: i for i in SoftDeleteArchive.objects.filter(model='system.Organization')}
+        self.assertEqual(set(archives), {str(self.legacy.pk), str(self.old.pk)})
+        self.assertIsNone(archives[str(self.legacy.pk)].deleted_time)  # 删除时间未知
+        self.assertEqual(archives[str(self.old.pk)].deleted_time, self.now - timedelta(days=100))
+        self.assertEqual(archives[str(self.old.pk)].data['name'], 'old')
+
+    def test_delete(self):
+        self.deploy(days=150)
+        purge_soft_deleted(['system.Organization'], days=90, mode='delete')
+        self.assertEqual(self.remaining(), {'recent', 'live'})
+        self.assertFalse(SoftDeleteArchive.objects.exists())
+
+    def test_not_tracked(self):
+        app, name = TRACKED_SINCE
+        MigrationRecorder.Migration.objects.filter(app=app, name=name).delete()
+        self.assertEqual(purge_soft_deleted(['system.Organization'], days=0)[0]['purged'], 0)
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            purge_soft_deleted(['system.Organization'], mode='drop')
+        with self.assertRaises(ValueError):
+            purge_soft_deleted(['system.User'])
+
+
+class ExportTest(TestCase):
+    """
+    流式导出: 与列表接口相同的过滤, csv/jsonl/xlsx及gzip
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create(username='admin', name='管理员', is_superuser=True)
+        dept = Organization.objects.create(name='研发部')
+        User.objects.create(username='alice', name='<Alice & "Co">', dept=dept)
+        User.objects.create(username='bob', name='鲍勃', is_active=False)
+
+    def export(self, params):
+        request = APIRequestFactory().get('/', params)
+        force_authenticate(request, user=self.admin)
+        response = UserViewSet.as_view({'get': 'export'})(request)
+        return response, b''.join(response.streaming_content)
+
+    def test_csv(self):
+        response, content = self.export({'type': 'csv', 'search': 'alice'})
+        self.assertTrue(response['Content-Disposition'].endswith('.csv"'))
+        rows = list(csv.reader(io.StringIO(content.decode('utf-8-sig'))))
+        self.assertEqual(rows[0][:3], ['账号', '姓名', '手机号码'])
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[1][0], 'alice')
+        self.assertEqual(rows[1][4], '研发部')
+
+    def test_jsonl_gzip(self):
+        response, content = self.export({'type': 'jsonl', 'gzip': 1})
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        rows = [json.loads(i) for i in gzip.decompress(content).decode().splitlines()]
+        self.assertEqual({i['账号'] for i in rows}, {'admin', 'alice', 'bob'})
+        self.assertEqual(next(i for i in rows if i['账号'] == 'bob')['启用'], False)
+
+    def test_xlsx(self):
+        _, content = self.export({'type': 'xlsx'})
+        with zipfile.ZipFile(io.BytesIO(content)) as zf:
+            sheet = zf.read('xl/worksheets/sheet1.xml').decode()
+        self.assertEqual(sheet.count('<row>'), 4)
+        self.assertIn('&lt;Alice &amp; "Co"&gt;', sheet)
+
+    def test_unsupported_type(self):
+        request = APIRequestFactory().get('/', {'type': 'pdf'})
+        force_authenticate(request, user=self.admin)
+        response = UserViewSet.as_view({'get': 'export'})(request)
+        response.render()
+        self.assertEqual(json.loads(response.content)['code'], 400)
+
+
+class EtagTest(TestCase):
+    """
+    ETag按用户区分, 用户的角色变化后失效
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        base = Role.objects.create(name='base')
+        base.perms.add(Permission.objects.create(name='新建工单', method='ticket_create'))
+        cls.role = Role.objects.create(name='role')
+        cls.u1 = User.objects.create(username='u1')
+        cls.u2 = User.objects.create(username='u2')
+        cls.u1.roles.add(base)
+        cls.u2.roles.add(base)
+
+    def setUp(self):
+        cache.clear()
+
+    def get(self, user, etag=None):
+        request = APIRequestFactory().get('/api/system/role/', HTTP_IF_NONE_MATCH=etag or '')
+        force_authenticate(request, user=user)
+        return RoleViewSet.as_view({'get': 'list'})(request)
+
+    def test_not_modified(self):
+        etag = self.get(self.u1)['ETag']
+        self.assertEqual(self.get(self.u1, etag).status_code, 304)
+
+    def test_per_user(self):
+        etag = self.get(self.u1)['ETag']
+        response = self.get(self.u2, etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_role_change(self):
+        etag = self.get(self.u1)['ETag']
+        self.u1.roles.add(self.role)
+        self.assertEqual(self.get(self.u1, etag).status_code, 200)
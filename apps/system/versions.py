@@ -0,0 +1,110 @@
+from functools import lru_cache
+from django.apps import apps
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from utils.model import post_soft_delete
+from .models import ModelVersion
+
+# 已登记版本号的模型: label -> 是否在事务提交后递增
+tracked_models = {}
+
+
+def bump_model_version(label):
+    """
+    在当前事务中递增版本号, 事务提交后读取方才看到新版本
+    """
+    if not ModelVersion.objects.filter(label=label).update(version=F('version') + 1):
+        version, created = ModelVersion.objects.get_or_create(label=label, defaults={'version': 1})
+        if not created:
+            ModelVersion.objects.filter(label=label).update(version=F('version') + 1)
+
+
+def bump_model_version_on_commit(label):
+    """
+    事务提交后递增版本号, 写入事务不持有版本号行锁, 用于写入频繁的模型(如工单);
+    提交后、递增前按旧版本号缓存的数据在递增后即不再使用
+    """
+    transaction.on_commit(lambda: bump_model_version(label))
+
+
+def get_versions(labels):
+    """
+    一次查询获取多个版本号, 按传入顺序返回
+    """
+    versions = dict(ModelVersion.objects.filter(label__in=labels).values_list('label', 'version'))
+    return [versions.get(i, 0) for i in labels]
+
+
+def get_model_versions(models):
+    """
+    一次查询获取多个模型的版本号, 按传入顺序返回
+    """
+    return get_versions([i._meta.label for i in models])
+
+
+def get_version_label(model):
+    # 多对多中间表的写入记在声明该字段的模型上
+    return (model._meta.auto_created or model)._meta.label
+
+
+def track_model_versions(*models, on_commit=False):
+    """
+    模型及其多对多关系写入时递增版本号(queryset.update/bulk_create不触发信号, 写入后调用bump_model_versions)
+    on_commit: 在事务提交后递增, 见bump_model_version_on_commit
+    """
+    bump = bump_model_version_on_commit if on_commit else bump_model_version
+    for model in models:
+        label = model._meta.label
+        tracked_models[label] = on_commit
+
+        def on_change(sender, label=label, **kwargs):
+            if kwargs.get('action', 'post_').startswith('post_'):
+                bump(label)
+
+        post_save.connect(on_change, sender=model, weak=False, dispatch_uid='version_' + label)
+        post_delete.connect(on_change, sender=model, weak=False, dispatch_uid='version_delete_' + label)
+        post_soft_delete.connect(on_change, sender=model, weak=False, dispatch_uid='version_soft_delete_' + label)
+        for field in model._meta.local_many_to_many:
+            m2m_changed.connect(on_change, sender=field.remote_field.through, weak=False,
+                                dispatch_uid='version_{}_{}'.format(label, field.name))
+
+
+def bump_model_versions(*models):
+    """
+    不触发信号的写入(queryset.update/bulk_create/快速删除等)后调用, 未登记版本号的模型忽略
+    """
+    for label in {get_version_label(i) for i in models}:
+        if label in tracked_models:
+            bump_model_version_on_commit(label) if tracked_models[label] else bump_model_version(label)
+
+
+@lru_cache(maxsize=None)
+def get_table_labels():
+    return {i._meta.db_table: get_version_label(i) for i in apps.get_models(include_auto_created=True)}
+
+
+def get_query_tables(query):
+    """
+    查询涉及的数据表(含union的各子查询)
+    """
+    tables = {i.table_name for i in query.alias_map.values()}
+    if query.model is not None:
+        tables.add(query.model._meta.db_table)
+    for i in query.combined_queries:
+        tables.update(get_query_tables(i))
+    return tables
+
+
+def get_query_labels(query):
+    """
+    查询涉及的模型label, 含未登记版本号的模型时返回None
+    """
+    table_labels = get_table_labels()
+    labels = set()
+    for table in get_query_tables(query):
+        label = table_labels.get(table)
+        if label not in tracked_models:
+            return None
+        labels.add(label)
+    return sorted(labels)
@@ -25,7 +25,7 @@ from apps.line_bot.models import LineUser
 from utils.queryset import get_child_queryset2
 
 from .filters import UserFilter
-from .mixins import CreateUpdateModelAMixin, OptimizationMixin
+from .mixins import ConditionalGetMixin, CreateUpdateModelAMixin, ExportMixin, OptimizationMixin
 from .models import (Dict, DictType, File, Organization, Permission, Position,
                      Role, User, VerificationCode)
 from .permission import RbacPermission, get_permission_list
@@ -194,7 +194,7 @@ class PTaskViewSet(OptimizationMixin, ModelViewSet):
         return Response(status=status.HTTP_200_OK)
 
 
-class DictTypeViewSet(ModelViewSet):
+class DictTypeViewSet(ConditionalGetMixin, ModelViewSet):
     """
     数据字典类型-增删改查
     """
@@ -208,7 +208,7 @@ class DictTypeViewSet(ModelViewSet):
     ordering = ['pk']
 
 
-class DictViewSet(ModelViewSet):
+class DictViewSet(ConditionalGetMixin, ModelViewSet):
     """
     数据字典-增删改查
     """
@@ -221,6 +221,7 @@ class DictViewSet(ModelViewSet):
     search_fields = ['name']
     ordering_fields = ['sort']
     ordering = ['sort']
+    etag_models = [Dict, DictType]
 
     def paginate_queryset(self, queryset):
         """
@@ -233,7 +234,7 @@ class DictViewSet(ModelViewSet):
             return None
         return self.paginator.paginate_queryset(queryset, self.request, view=self)
 
-class PositionViewSet(ModelViewSet):
+class PositionViewSet(ConditionalGetMixin, ModelViewSet):
     """
     岗位-增删改查
     """
@@ -255,7 +256,7 @@ class TestView(APIView):
         return Response('测试api接口')
 
 
-class PermissionViewSet(ModelViewSet):
+class PermissionViewSet(ConditionalGetMixin, ModelViewSet):
     """
     权限-增删改查
     """
@@ -269,7 +270,7 @@ class PermissionViewSet(ModelViewSet):
     ordering = ['sort', 'pk']
 
 
-class OrganizationViewSet(ModelViewSet):
+class OrganizationViewSet(ConditionalGetMixin, ModelViewSet):
     """
     群組-增删改查
     """
@@ -363,7 +364,7 @@ class OrganizationViewSet(ModelViewSet):
             }, status=400)       
 
 
-class RoleViewSet(ModelViewSet):
+class RoleViewSet(ConditionalGetMixin, ModelViewSet):
     """
     角色-增删改查
     """
@@ -377,7 +378,7 @@ class RoleViewSet(ModelViewSet):
     ordering = ['pk']
 
 
-class UserViewSet(ModelViewSet):
+class UserViewSet(ExportMixin, ModelViewSet):
     """
     用户管理-增删改查
     """
@@ -388,6 +389,9 @@ class UserViewSet(ModelViewSet):
     filterset_class = UserFilter
     search_fields = ['username', 'name', 'phone', 'email']
     ordering_fields = ['-pk']
+    cursor_pagination = True
+    export_fields = [('username', '账号'), ('name', '姓名'), ('phone', '手机号码'), ('email', '邮箱'),
+                     ('dept__name', '群组'), ('is_active', '启用'), ('date_joined', '创建时间')]
 
     def perform_destroy(self, instance):
         if instance.is_superuser:
@@ -610,6 +614,7 @@ class FileViewSet(CreateModelMixin, DestroyModelMixin, RetrieveModelMixin, ListM
     filterset_fields = ['type']
     search_fields = ['name']
     ordering = ['-create_time']
+    cursor_pagination = True
 
     def perform_create(self, serializer):
         fileobj = self.request.data.get('file')
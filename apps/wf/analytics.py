@@ -0,0 +1,183 @@
+"""
+工作流统计: 写入流转日志时增量更新汇总表, 统计接口只读汇总表
+"""
+import math
+from collections import defaultdict
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+from .models import (ApproverRollup, CycleTimeRollup, StateDwellRollup, Ticket, TicketArchive,
+                     TicketFlow, TicketFlowArchive, Transition)
+
+# 时长区间按对数划分, 第i个区间上界为2^(i/4)秒, 相对误差约19%
+BUCKETS_PER_DOUBLING = 4
+PERCENTILES = (50, 90, 95, 99)
+
+
+def get_bucket(seconds):
+    if seconds <= 1:
+        return 0
+    return int(math.ceil(BUCKETS_PER_DOUBLING * math.log2(seconds)))
+
+
+def get_bucket_bound(bucket):
+    return round(2 ** (bucket / BUCKETS_PER_DOUBLING))
+
+
+def get_day(value):
+    if timezone.is_aware(value):
+        return timezone.localdate(value)
+    return value.date()
+
+
+def get_flow_measures(workflow_id, state_id, participant_id, intervene_type, flow_time, prev_time):
+    """
+    一条流转日志的汇总增量[(model, keys, seconds)]: 在该状态的停留时长, 正常处理时计入处理人
+    """
+    seconds = max(int((flow_time - prev_time).total_seconds()), 0)
+    day = get_day(flow_time)
+    measures = [(StateDwellRollup, {'workflow_id': workflow_id, 'state_id': state_id, 'day': day,
+                                    'bucket': get_bucket(seconds)}, seconds)]
+    if participant_id and intervene_type == 0:
+        measures.append((ApproverRollup, {'workflow_id': workflow_id, 'user_id': participant_id, 'day': day}, seconds))
+    return measures
+
+
+def get_cycle_measure(workflow_id, create_time, finish_time):
+    seconds = max(int((finish_time - create_time).total_seconds()), 0)
+    return (CycleTimeRollup, {'workflow_id': workflow_id, 'day': get_day(finish_time),
+                              'bucket': get_bucket(seconds)}, seconds)
+
+
+def increment(model, keys, seconds, count=1):
+    """
+    汇总行原子累加, 不存在时创建, 并发创建冲突时改为累加
+    """
+    values = {'count': F('count') + count, 'total_seconds': F('total_seconds') + seconds}
+    if model.objects.filter(**keys).update(**values):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(count=count, total_seconds=seconds, **keys)
+    except IntegrityError:
+        model.objects.filter(**keys).update(**values)
+
+
+def record_flow(flow):
+    """
+    新增流转日志后更新汇总, 在事务提交后执行, 避免汇总行锁拖长处理事务
+    """
+    if flow.intervene_type == Transition.TRANSITION_INTERVENE_TYPE_CC:
+        return
+    ticket = flow.ticket
+    prev_time = TicketFlow.objects.filter(ticket_id=flow.ticket_id, id__lt=flow.id)\
+        .exclude(intervene_type=Transition.TRANSITION_INTERVENE_TYPE_CC)\
+        .order_by('-id').values_list('create_time', flat=True).first() or ticket.create_time
+    measures = get_flow_measures(ticket.workflow_id, flow.state_id, flow.participant_id,
+                                 flow.intervene_type, flow.create_time, prev_time)
+    # 处理日志在工单状态更新后写入, 此时工单已完成即为完成的那次处理
+    if flow.intervene_type == 0 and ticket.act_state == Ticket.TICKET_ACT_STATE_FINISH:
+        measures.append(get_cycle_measure(ticket.workflow_id, ticket.create_time, flow.create_time))
+
+    def apply():
+        for model, keys, seconds in measures:
+            increment(model, keys, seconds)
+    transaction.on_commit(apply)
+
+
+def rebuild_rollups(workflow_id=None, batch_size=1000):
+    """
+    根据全部流转日志(含归档)重建汇总表
+    """
+    totals = defaultdict(lambda: [0, 0])
+    sources = ((Ticket.all_objects, TicketFlow.objects), (TicketArchive.objects, TicketFlowArchive.objects))
+    for ticket_manager, flow_manager in sources:
+        tickets_qs = ticket_manager.order_by('id')
+        if workflow_id:
+            tickets_qs = tickets_qs.filter(workflow_id=workflow_id)
+        last_id = 0
+        while True:
+            tickets = list(tickets_qs.filter(id__gt=last_id)
+                           .values_list('id', 'workflow_id', 'create_time', 'act_state')[:batch_size])
+            if not tickets:
+                break
+            last_id = tickets[-1][0]
+            flows = defaultdict(list)
+            for row in flow_manager.filter(ticket_id__in=[i[0] for i in tickets])\
+                    .exclude(intervene_type=Transition.TRANSITION_INTERVENE_TYPE_CC).order_by('id')\
+                    .values_list('ticket_id', 'state_id', 'participant_id', 'intervene_type', 'create_time'):
+                flows[row[0]].append(row[1:])
+            for ticket_id, wf_id, create_time, act_state in tickets:
+                prev_time, finish_time = create_time, None
+                measures = []
+                for state_id, participant_id, intervene_type, flow_time in flows[ticket_id]:
+                    measures.extend(get_flow_measures(wf_id, state_id, participant_id, intervene_type, flow_time, prev_time))
+                    prev_time = flow_time
+                    if intervene_type == 0:
+                        finish_time = flow_time
+                if act_state == Ticket.TICKET_ACT_STATE_FINISH and finish_time:
+                    measures.append(get_cycle_measure(wf_id, create_time, finish_time))
+                for model, keys, seconds in measures:
+                    total = totals[(model, tuple(sorted(keys.items())))]
+                    total[0] += 1
+                    total[1] += seconds
+    with transaction.atomic():
+        for model in (StateDwellRollup, ApproverRollup, CycleTimeRollup):
+            queryset = model.objects.all()
+            if workflow_id:
+                queryset = queryset.filter(workflow_id=workflow_id)
+            queryset.delete()
+            model.objects.bulk_create([model(count=count, total_seconds=seconds, **dict(keys))
+                                       for (m, keys), (count, seconds) in totals.items() if m is model],
+                                      batch_size=batch_size)
+    return sum(i[0] for i in totals.values())
+
+
+def get_histogram_stats(rows):
+    """
+    由区间直方图[(bucket, count, total_seconds)]计算次数、平均值及分位数(取区间上界)
+    """
+    histogram = defaultdict(int)
+    count, total_seconds = 0, 0
+    for bucket, c, seconds in rows:
+        histogram[bucket] += c
+        count += c
+        total_seconds += seconds
+    ret = {'count': count, 'avg_seconds': round(total_seconds / count) if count else None,
+           'histogram': [{'le': get_bucket_bound(i), 'count': histogram[i]} for i in sorted(histogram)]}
+    for p in PERCENTILES:
+        ret['p{}'.format(p)] = None
+        if count:
+            threshold, cumulative = count * p / 100, 0
+            for i in sorted(histogram):
+                cumulative += histogram[i]
+                if cumulative >= threshold:
+                    ret['p{}'.format(p)] = get_bucket_bound(i)
+                    break
+    return ret
+
+
+def get_workflow_analytics(workflow, start, end):
+    """
+    工作流在日期范围内的完成周期、各状态停留时长及处理人处理量
+    """
+    cycle = CycleTimeRollup.objects.filter(workflow=workflow, day__range=(start, end))\
+        .values('bucket').annotate(c=Sum('count'), s=Sum('total_seconds')).values_list('bucket', 'c', 's')
+    states = defaultdict(list)
+    state_names = {}
+    for state_id, state_name, bucket, c, s in StateDwellRollup.objects.filter(workflow=workflow, day__range=(start, end))\
+            .values('state', 'state__name', 'bucket').annotate(c=Sum('count'), s=Sum('total_seconds'))\
+            .values_list('state', 'state__name', 'bucket', 'c', 's'):
+        states[state_id].append((bucket, c, s))
+        state_names[state_id] = state_name
+    approvers = ApproverRollup.objects.filter(workflow=workflow, day__range=(start, end))\
+        .values('user', 'user__name', 'user__username').annotate(count=Sum('count'), total_seconds=Sum('total_seconds'))\
+        .order_by('-count')
+    return {
+        'start': start,
+        'end': end,
+        'cycle_time': get_histogram_stats(cycle),
+        'states': [dict(state=k, state_name=state_names[k], **get_histogram_stats(v)) for k, v in states.items()],
+        'approvers': [{'user': i['user'], 'user_name': i['user__name'] or i['user__username'], 'count': i['count'],
+                       'avg_seconds': round(i['total_seconds'] / i['count']) if i['count'] else None} for i in approvers],
+    }
@@ -0,0 +1,9 @@
+from rest_framework.exceptions import APIException
+from rest_framework import status
+
+
+class TicketVersionConflict(APIException):
+    """工单已被他人修改(乐观锁版本不一致)"""
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = '工单已被他人修改,请刷新后重试'
+    default_code = 'ticket_version_conflict'
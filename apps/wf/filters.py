@@ -1,13 +1,110 @@
+import re
+from datetime import datetime
+from django.db import connection
+from django.db.models import F, FloatField, Func, Q, Value
+from django.utils import timezone
 from django_filters import rest_framework as filters
-from .models import Ticket
+from rest_framework.exceptions import ValidationError
+from .models import CustomField, Ticket, TicketArchive, TicketFieldValue
+
+
+class SearchMatch(Func):
+    """
+    MySQL全文检索相关度: MATCH (document) AGAINST (%s IN BOOLEAN MODE)
+    """
+    output_field = FloatField()
+
+    def __init__(self, expression, query, **extra):
+        self.query = query
+        super().__init__(expression, **extra)
+
+    def as_sql(self, compiler, connection, **extra_context):
+        sql, params = compiler.compile(self.source_expressions[0])
+        return 'MATCH (%s) AGAINST (%%s IN BOOLEAN MODE)' % sql, list(params) + [self.query]
+
+
+FIELD_FILTER_PREFIX = 'field__'
+FIELD_FILTER_LOOKUPS = ('exact', 'gt', 'gte', 'lt', 'lte', 'in', 'contains')
+
+
+def get_search_terms(value):
+    """
+    拆分检索词并去除全文检索的操作符
+    """
+    return [i for i in re.split(r'[\s+\-<>()~*"@]+', value) if i]
+
+
 class TicketFilterSet(filters.FilterSet):
     start_create = filters.DateFilter(field_name="create_time", lookup_expr='gte')
     end_create = filters.DateFilter(field_name="create_time", lookup_expr='lte')
     category = filters.ChoiceFilter(choices = Ticket.category_choices, method='filter_category')
+    q = filters.CharFilter(method='filter_q', label='全文检索')
 
     class Meta:
         model = Ticket
-        fields = ['workflow', 'state', 'act_state', 'start_create', 'end_create', 'category']
+        fields = ['workflow', 'state', 'act_state', 'start_create', 'end_create', 'category', 'q']
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        for key, lookup, field_type, value in self.get_field_filters():
+            queryset = self.filter_field(queryset, key, lookup, field_type, value)
+        return queryset
+
+    def get_field_filters(self):
+        """
+        解析field__<key>__<op>形式的自定义字段过滤条件
+        """
+        result = []
+        for param in self.data.keys():
+            if not param.startswith(FIELD_FILTER_PREFIX):
+                continue
+            key, lookup = param[len(FIELD_FILTER_PREFIX):], 'exact'
+            if '__' in key:
+                key, lookup = key.rsplit('__', 1)
+            if lookup not in FIELD_FILTER_LOOKUPS:
+                raise ValidationError({param: '不支持的过滤方式{}'.format(lookup)})
+            fields = CustomField.objects.filter(field_key=key, is_deleted=False)
+            if self.data.get('workflow', None):
+                fields = fields.filter(workflow_id=self.data.get('workflow'))
+            field_type = fields.values_list('field_type', flat=True).first()
+            if field_type is None:
+                raise ValidationError({param: '字段{}不存在'.format(key)})
+            if lookup == 'contains' and TicketFieldValue.get_value_column(field_type) != 'value_str':
+                raise ValidationError({param: '该字段不支持contains'})
+            value = self.data.get(param)
+            values = value.split(',') if lookup == 'in' else [value]
+            try:
+                values = [v if lookup == 'contains' else TicketFieldValue.to_python(field_type, v) for v in values]
+            except (TypeError, ValueError):
+                raise ValidationError({param: '值{}格式错误'.format(value)})
+            result.append((key, lookup, field_type, values if lookup == 'in' else values[0]))
+        return result
+
+    def filter_field(self, queryset, key, lookup, field_type, value):
+        """
+        通过字段值表(field_key, value_xx)索引筛选工单
+        """
+        column = TicketFieldValue.get_value_column(field_type)
+        if lookup == 'contains':
+            lookup = 'icontains'
+        values = TicketFieldValue.objects.filter(field_key=key, **{'{}__{}'.format(column, lookup): value})
+        return queryset.filter(id__in=values.values('ticket_id'))
+
+    def filter_q(self, queryset, name, value):
+        """
+        检索标题、流水号及自定义字段, 结果带search_rank相关度
+        """
+        terms = get_search_terms(value)
+        if not terms:
+            return queryset
+        if connection.vendor == 'mysql':
+            # 每个词都必须出现, ngram分词下按短语匹配
+            query = ' '.join('+"{}"'.format(i) for i in terms)
+            return queryset.annotate(search_rank=SearchMatch(F('search_index__document'), query))\
+                .filter(search_rank__gt=0)
+        for i in terms:
+            queryset = queryset.filter(search_index__document__icontains=i)
+        return queryset.annotate(search_rank=Value(0.0, output_field=FloatField()))
 
     def filter_category(self, queryset, name, value):
         user=self.request.user
@@ -23,4 +120,33 @@ class TicketFilterSet(filters.FilterSet):
             pass
         else:
             queryset = queryset.none()
-        return queryset
\ No newline at end of file
+        return queryset
+
+
+class TicketArchiveFilterSet(TicketFilterSet):
+    """
+    归档工单的过滤, 条件与工单一致
+    """
+    class Meta(TicketFilterSet.Meta):
+        model = TicketArchive
+
+    def filter_q(self, queryset, name, value):
+        """
+        归档工单不建检索索引, 仅匹配标题和流水号
+        """
+        for i in get_search_terms(value):
+            queryset = queryset.filter(Q(title__icontains=i) | Q(sn__icontains=i))
+        return queryset
+
+    def filter_field(self, queryset, key, lookup, field_type, value):
+        """
+        归档工单无字段值表, 直接按ticket_data过滤
+        """
+        if lookup == 'contains':
+            lookup = 'icontains'
+        elif field_type in TicketFieldValue.DATE_TYPES + TicketFieldValue.DATETIME_TYPES:
+            # JSON中日期以字符串保存, 按字符串比较
+            fmt = '%Y-%m-%d' if field_type in TicketFieldValue.DATE_TYPES else '%Y-%m-%d %H:%M:%S'
+            to_str = lambda i: timezone.localtime(i).strftime(fmt) if isinstance(i, datetime) else i.strftime(fmt)
+            value = [to_str(i) for i in value] if lookup == 'in' else to_str(value)
+        return queryset.filter(**{'ticket_data__{}__{}'.format(key, lookup): value})
@@ -0,0 +1,273 @@
+import json
+import random
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from django import get_version
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from rest_framework.test import APIRequestFactory, force_authenticate
+from apps.system.membership import invalidate_role_users
+from apps.system.models import Organization, Permission, Role, User
+from apps.wf.models import (CustomField, State, Ticket, TicketEvent, Transition, Workflow)
+from apps.wf.services import WfService
+from apps.wf.views import TicketViewSet
+
+WRITE_SQL = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+
+class OperationRecorder:
+    """
+    记录单次操作的耗时、查询数及写入行数(通过execute_wrapper统计)
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.rows_written = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        result = execute(sql, params, many, context)
+        self.queries += 1
+        if sql.lstrip().upper().startswith(WRITE_SQL):
+            self.rows_written += max(context['cursor'].rowcount, 0)
+        return result
+
+
+def get_percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def summarize(values, digits=0):
+    if not values:
+        return {}
+    return {
+        'mean': round(sum(values) / len(values), digits or 2),
+        'p50': round(get_percentile(values, 50), digits),
+        'p90': round(get_percentile(values, 90), digits),
+        'p99': round(get_percentile(values, 99), digits),
+        'max': round(max(values), digits),
+    }
+
+
+class Command(BaseCommand):
+    help = '工作流引擎压测: 生成组织/用户/角色/工作流, 并发驱动工单创建及处理, 输出可对比的JSON结果'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50, help='用户数')
+        parser.add_argument('--depth', type=int, default=3, help='组织树深度')
+        parser.add_argument('--breadth', type=int, default=3, help='每个组织的下级数')
+        parser.add_argument('--states', type=int, default=4, help='开始与结束之间的状态数')
+        parser.add_argument('--role-size', type=int, default=5, help='每个状态角色的成员数')
+        parser.add_argument('--distribute', default='2,3,1', help='各状态依次使用的分配方式(1接单,2直接处理,3随机,4全部处理)')
+        parser.add_argument('--filter-policy', type=int, default=0, help='角色状态的参与人过滤策略')
+        parser.add_argument('--skip-threshold', type=int, default=7, help='days大于该值时条件流转跳过下一个状态')
+        parser.add_argument('--tickets', type=int, default=100, help='工单数')
+        parser.add_argument('--concurrency', type=int, default=4, help='并发线程数(SQLite建议为1)')
+        parser.add_argument('--mode', choices=['api', 'service'], default='api',
+                            help='api: 通过TicketViewSet处理; service: 直接调用WfService.handle_ticket')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--output', default=None, help='结果写入文件, 默认输出到标准输出')
+        parser.add_argument('--keep', action='store_true', help='保留生成的数据')
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.factory = APIRequestFactory()
+        self.results = defaultdict(lambda: {'latency_ms': [], 'queries': [], 'rows_written': [], 'errors': 0})
+        self.outcomes = defaultdict(int)
+        random.seed(options['seed'])  # 随机分配状态使用全局random
+        self.setup_data()
+        try:
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=max(options['concurrency'], 1)) as executor:
+                list(executor.map(self.run_ticket, range(options['tickets'])))
+            elapsed = time.perf_counter() - started
+        finally:
+            if not options['keep']:
+                self.cleanup_data()
+        report = self.get_report(elapsed)
+        content = json.dumps(report, indent=2, sort_keys=True, ensure_ascii=False)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(content + '\n')
+        else:
+            self.stdout.write(content)
+
+    def setup_data(self):
+        """
+        生成组织树、用户、角色及工作流
+        """
+        opts = self.options
+        rng = random.Random(opts['seed'])
+        self.tag = uuid.uuid4().hex[:8]
+        with transaction.atomic():
+            root = Organization.objects.create(name='bench_{}'.format(self.tag), type='root')
+            self.depts, level = [root], [root]
+            for _ in range(opts['depth'] - 1):
+                level = [Organization.objects.create(name='bench_{}_{}'.format(self.tag, len(self.depts) + i), parent=parent)
+                         for i, parent in enumerate(p for p in level for _ in range(opts['breadth']))]
+                self.depts.extend(level)
+            perm = Permission.objects.filter(method='ticket_create').first() \
+                or Permission.objects.create(name='新建工单', method='ticket_create')
+            base_role = Role.objects.create(name='bench_{}'.format(self.tag))
+            base_role.perms.add(perm)
+            self.users = [User.objects.create(username='bench_{}_{}'.format(self.tag, i), dept=rng.choice(self.depts))
+                          for i in range(opts['users'])]
+            self.add_role_users(base_role, self.users)
+            self.roles = [base_role]
+
+            self.workflow = Workflow.objects.create(name='bench_{}'.format(self.tag), key=self.tag, title_template='{title}')
+            CustomField.objects.create(workflow=self.workflow, field_type='int', field_key='days', field_name='天数')
+            CustomField.objects.create(workflow=self.workflow, field_type='string', field_key='reason', field_name='原因')
+            distribute = [int(i) for i in opts['distribute'].split(',')]
+            start = State.objects.create(name='开始', workflow=self.workflow, type=State.STATE_TYPE_START, sort=0,
+                                         participant_type=0, state_fields={'days': State.STATE_FIELD_REQUIRED,
+                                                                           'reason': State.STATE_FIELD_OPTIONAL})
+            states = [start]
+            for i in range(opts['states']):
+                role = Role.objects.create(name='bench_{}_{}'.format(self.tag, i))
+                self.add_role_users(role, rng.sample(self.users, min(opts['role_size'], len(self.users))))
+                self.roles.append(role)
+                states.append(State.objects.create(
+                    name='审批{}'.format(i + 1), workflow=self.workflow, sort=i + 1,
+                    participant_type=State.PARTICIPANT_TYPE_ROLE, participant=[role.id],
+                    distribute_type=distribute[i % len(distribute)], filter_policy=opts['filter_policy'],
+                    state_fields={'reason': State.STATE_FIELD_OPTIONAL}))
+            end = State.objects.create(name='结束', workflow=self.workflow, type=State.STATE_TYPE_END,
+                                       sort=opts['states'] + 1, participant_type=0)
+            states.append(end)
+            self.start_transition = None
+            for i, state in enumerate(states[:-1]):
+                # 条件流转: days较大时跳过下一个审批状态
+                condition = []
+                if 0 < i < len(states) - 2:
+                    condition = [{'expression': '{{days}} > {}'.format(opts['skip_threshold']),
+                                  'target_state': states[i + 2].id}]
+                transition = Transition.objects.create(
+                    name='提交' if i == 0 else '同意', workflow=self.workflow, source_state=state,
+                    destination_state=states[i + 1], condition_expression=condition, field_require_check=i == 0)
+                if i == 0:
+                    self.start_transition = transition
+
+    @staticmethod
+    def add_role_users(role, users):
+        through = User.roles.through
+        through.objects.bulk_create([through(user_id=i.id, role_id=role.id) for i in users])
+        invalidate_role_users()  # bulk_create不触发m2m_changed
+
+    def cleanup_data(self):
+        with transaction.atomic():
+            Ticket.all_objects.filter(workflow=self.workflow).delete(soft=False)
+            TicketEvent.objects.filter(workflow=self.workflow).delete()
+            self.workflow.delete(soft=False)
+            User.objects.filter(id__in=[i.id for i in self.users]).delete()
+            Role.all_objects.filter(id__in=[i.id for i in self.roles]).delete(soft=False)
+            Organization.all_objects.filter(id__in=[i.id for i in self.depts]).delete(soft=False)
+        invalidate_role_users()
+
+    def measure(self, name, func):
+        """
+        执行一次操作并记录指标, 返回操作结果, 失败时返回None
+        """
+        recorder = OperationRecorder()
+        started = time.perf_counter()
+        try:
+            with connection.execute_wrapper(recorder):
+                result = func()
+        except Exception:
+            self.results[name]['errors'] += 1
+            return None
+        latency = (time.perf_counter() - started) * 1000
+        stats = self.results[name]
+        stats['latency_ms'].append(latency)
+        stats['queries'].append(recorder.queries)
+        stats['rows_written'].append(recorder.rows_written)
+        return result
+
+    def call_view(self, action, user, pk=None, data=None):
+        request = self.factory.post('/api/wf/ticket/', data or {}, format='json')
+        force_authenticate(request, user=user)
+        view = TicketViewSet.as_view({'post': action}, detail=pk is not None)
+        response = view(request, pk=pk) if pk is not None else view(request)
+        status_code = response.status_code
+        response.render()
+        if status_code >= 400:
+            raise Exception(response.content)
+        return response
+
+    def run_ticket(self, index):
+        """
+        创建一张工单并处理至结束
+        """
+        rng = random.Random(self.options['seed'] * 100003 + index)
+        try:
+            creator = rng.choice(self.users)
+            data = {'workflow': self.workflow.id, 'transition': self.start_transition.id, 'title': 'bench {}'.format(index),
+                    'ticket_data': {'days': rng.randint(1, 10), 'reason': rng.choice(['出差', '请假', '采购'])}}
+            response = self.measure('create', lambda: self.call_view('create', creator, data=data))
+            if response is None:
+                self.outcomes['failed'] += 1
+                return
+            ticket_id = response.data['id']
+            for _ in range(self.options['states'] * self.options['users'] + 1):
+                ticket = Ticket.objects.select_related('state', 'workflow').get(pk=ticket_id)
+                if ticket.act_state in (Ticket.TICKET_ACT_STATE_FINISH, Ticket.TICKET_ACT_STATE_CLOSED):
+                    self.outcomes['finished'] += 1
+                    return
+                participant = ticket.participant if isinstance(ticket.participant, list) else [ticket.participant]
+                if ticket.multi_all_person:
+                    # 只排除本轮已处理的人, 之前状态(或被退回前)的处理记录不算
+                    vote_round = ticket.vote_rounds.filter(state=ticket.state).order_by('-id').first()
+                    voted = set(vote_round.votes.values_list('user_id', flat=True)) if vote_round else set()
+                    participant = [i for i in participant if i not in voted]
+                if not participant:
+                    break
+                user = User.objects.get(pk=rng.choice(participant))
+                if WfService.ticket_handle_permission_check(ticket, user).get('need_accept', False):
+                    if self.measure('accept', lambda: self.call_view('accpet', user, pk=ticket_id)) is None:
+                        break
+                    continue
+                transition = WfService.get_ticket_transitions(ticket).first()
+                if self.options['mode'] == 'api':
+                    handled = self.measure('handle', lambda: self.call_view(
+                        'handle', user, pk=ticket_id, data={'transition': transition.id, 'ticket_data': {}, 'suggestion': ''}))
+                else:
+                    handled = self.measure('service_handle', lambda: self.handle_by_service(ticket, transition, user))
+                if handled is None:
+                    break
+            self.outcomes['stuck'] += 1
+        except Exception:
+            self.outcomes['failed'] += 1
+        finally:
+            connection.close()
+
+    @staticmethod
+    def handle_by_service(ticket, transition, user):
+        with transaction.atomic():
+            return WfService.handle_ticket(ticket=ticket, transition=transition, new_ticket_data=dict(ticket.ticket_data),
+                                           handler=user, suggestion='')
+
+    def get_report(self, elapsed):
+        operations = {}
+        for name, stats in self.results.items():
+            operations[name] = {
+                'count': len(stats['latency_ms']),
+                'errors': stats['errors'],
+                'latency_ms': summarize(stats['latency_ms'], 2),
+                'queries': summarize(stats['queries']),
+                'rows_written': summarize(stats['rows_written']),
+            }
+        config = {k: v for k, v in self.options.items()
+                  if k in ('users', 'depth', 'breadth', 'states', 'role_size', 'distribute', 'filter_policy',
+                           'skip_threshold', 'tickets', 'concurrency', 'mode', 'seed')}
+        return {
+            'config': config,
+            'environment': {'database': connection.vendor, 'django': get_version()},
+            'operations': operations,
+            'tickets': dict(self.outcomes),
+            'elapsed_s': round(elapsed, 2),
+            'throughput_tickets_per_s': round(self.options['tickets'] / elapsed, 2) if elapsed else None,
+        }
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from apps.wf.analytics import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = '根据历史流转日志重建工作流统计汇总表'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workflow', type=int, default=None, help='只重建指定工作流')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        count = rebuild_rollups(workflow_id=options['workflow'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS('已汇总{}条记录'.format(count)))
@@ -0,0 +1,51 @@
+# Generated by Django 4.2.11 on 2026-10-19 18:59
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('wf', '0002_alter_customfield_create_by_alter_customfield_id_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TicketVoteRound',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('create_time', models.DateTimeField(default=django.utils.timezone.now, help_text='创建时间', verbose_name='创建时间')),
+                ('update_time', models.DateTimeField(auto_now=True, help_text='修改时间', verbose_name='修改时间')),
+                ('is_deleted', models.BooleanField(default=False, help_text='删除标记', verbose_name='删除标记')),
+                ('vote_count', models.IntegerField(default=0, help_text='原子递增,用于判断是否全部处理完成', verbose_name='已处理人数')),
+                ('state', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='wf.state', verbose_name='会签状态')),
+                ('ticket', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='vote_rounds', to='wf.ticket', verbose_name='关联工单')),
+            ],
+            options={
+                'verbose_name': '会签轮次',
+                'verbose_name_plural': '会签轮次',
+            },
+        ),
+        migrations.CreateModel(
+            name='TicketVote',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('create_time', models.DateTimeField(default=django.utils.timezone.now, help_text='创建时间', verbose_name='创建时间')),
+                ('update_time', models.DateTimeField(auto_now=True, help_text='修改时间', verbose_name='修改时间')),
+                ('is_deleted', models.BooleanField(default=False, help_text='删除标记', verbose_name='删除标记')),
+                ('round', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='votes', to='wf.ticketvoteround', verbose_name='会签轮次')),
+                ('ticket', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='votes', to='wf.ticket', verbose_name='关联工单')),
+                ('transition', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='wf.transition', verbose_name='流转')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='处理人')),
+            ],
+            options={
+                'verbose_name': '会签记录',
+                'verbose_name_plural': '会签记录',
+                'unique_together': {('ticket', 'round', 'user')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.11 on 2026-10-19 19:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wf', '0003_ticketvote'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ticket',
+            name='version',
+            field=models.PositiveIntegerField(default=0, help_text='乐观锁版本号,每次变更工单时递增', verbose_name='版本号'),
+        ),
+    ]
@@ -0,0 +1,129 @@
+# Generated by Django 4.2.11 on 2026-10-19 19:02
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('system', '0012_alter_user_avatar'),
+        ('wf', '0004_ticket_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TicketArchive',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('create_time', models.DateTimeField(verbose_name='创建时间')),
+                ('update_time', models.DateTimeField(verbose_name='修改时间')),
+                ('is_deleted', models.BooleanField(default=False, verbose_name='删除标记')),
+                ('title', models.CharField(blank=True, max_length=500, null=True, verbose_name='标题')),
+                ('sn', models.CharField(max_length=25, verbose_name='流水号')),
+                ('ticket_data', models.JSONField(default=dict, verbose_name='工单数据')),
+                ('in_add_node', models.BooleanField(default=False, verbose_name='加签状态中')),
+                ('script_run_last_result', models.BooleanField(default=True, verbose_name='脚本最后一次执行结果')),
+                ('participant_type', models.IntegerField(choices=[(0, '无处理人'), (1, '个人'), (2, '多人'), (4, '角色'), (6, '脚本'), (7, '工单的字段'), (9, '代码获取')], default=0, verbose_name='当前处理人类型')),
+                ('participant', models.JSONField(blank=True, default=list, verbose_name='当前处理人')),
+                ('act_state', models.IntegerField(choices=[(0, '草稿中'), (1, '进行中'), (2, '被退回'), (3, '被撤回'), (4, '已完成'), (5, '已关闭')], default=1, verbose_name='进行状态')),
+                ('multi_all_person', models.JSONField(blank=True, default=dict, verbose_name='全部处理的结果')),
+                ('version', models.PositiveIntegerField(default=0, verbose_name='版本号')),
+                ('archive_time', models.DateTimeField(default=django.utils.timezone.now, verbose_name='归档时间')),
+            ],
+            options={
+                'verbose_name': '归档工单',
+                'verbose_name_plural': '归档工单',
+            },
+        ),
+        migrations.CreateModel(
+            name='TicketFlowArchive',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('create_time', models.DateTimeField(verbose_name='创建时间')),
+                ('update_time', models.DateTimeField(verbose_name='修改时间')),
+                ('is_deleted', models.BooleanField(default=False, verbose_name='删除标记')),
+                ('suggestion', models.CharField(blank=True, default='', max_length=10000, verbose_name='处理意见')),
+                ('participant_type', models.IntegerField(choices=[(0, '无处理人'), (1, '个人'), (2, '多人'), (4, '角色'), (6, '脚本'), (7, '工单的字段'), (9, '代码获取')], default=0, verbose_name='处理人类型')),
+                ('participant_str', models.CharField(blank=True, max_length=200, null=True, verbose_name='处理人')),
+                ('ticket_data', models.JSONField(blank=True, default=dict, verbose_name='工单数据')),
+                ('intervene_type', models.IntegerField(choices=[(0, '正常处理'), (1, '转交'), (2, '加签'), (3, '加签处理完成'), (4, '接单'), (5, '评论'), (6, '删除'), (7, '强制关闭'), (8, '强制修改状态'), (9, 'hook操作'), (10, '撤回'), (11, '抄送')], default=0, verbose_name='干预类型')),
+                ('participant_cc', models.JSONField(blank=True, default=list, verbose_name='抄送给')),
+            ],
+            options={
+                'verbose_name': '归档工单流转日志',
+                'verbose_name_plural': '归档工单流转日志',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['act_state', 'update_time'], name='wf_ticket_act_sta_326a75_idx'),
+        ),
+        migrations.AddField(
+            model_name='ticketflowarchive',
+            name='participant',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='处理人'),
+        ),
+        migrations.AddField(
+            model_name='ticketflowarchive',
+            name='state',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='wf.state', verbose_name='当前状态'),
+        ),
+        migrations.AddField(
+            model_name='ticketflowarchive',
+            name='ticket',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ticketflow_ticket', to='wf.ticketarchive', verbose_name='关联工单'),
+        ),
+        migrations.AddField(
+            model_name='ticketflowarchive',
+            name='transition',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='wf.transition', verbose_name='流转id'),
+        ),
+        migrations.AddField(
+            model_name='ticketarchive',
+            name='add_node_man',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='加签人'),
+        ),
+        migrations.AddField(
+            model_name='ticketarchive',
+            name='belong_dept',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='system.organization', verbose_name='所属部门'),
+        ),
+        migrations.AddField(
+            model_name='ticketarchive',
+            name='create_by',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='创建人'),
+        ),
+        migrations.AddField(
+            model_name='ticketarchive',
+            name='parent',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='wf.ticket', verbose_name='父工单'),
+        ),
+        migrations.AddField(
+            model_name='ticketarchive',
+            name='parent_state',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='wf.state', verbose_name='父工单状态'),
+        ),
+        migrations.AddField(
+            model_name='ticketarchive',
+            name='state',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='wf.state', verbose_name='当前状态'),
+        ),
+        migrations.AddField(
+            model_name='ticketarchive',
+            name='update_by',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='最后编辑人'),
+        ),
+        migrations.AddField(
+            model_name='ticketarchive',
+            name='workflow',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='wf.workflow', verbose_name='关联工作流'),
+        ),
+        migrations.AddIndex(
+            model_name='ticketarchive',
+            index=models.Index(fields=['create_time'], name='wf_ticketar_create__c1d3d9_idx'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.11 on 2026-10-19 19:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def add_fulltext_index(apps, schema_editor):
+    # 仅MySQL支持ngram全文索引, 其他数据库检索时退化为LIKE
+    if schema_editor.connection.vendor == 'mysql':
+        schema_editor.execute('ALTER TABLE `wf_ticketsearchindex` ADD FULLTEXT INDEX `wf_ticketsearchindex_document_ft` (`document`) WITH PARSER ngram')
+
+
+def remove_fulltext_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'mysql':
+        schema_editor.execute('ALTER TABLE `wf_ticketsearchindex` DROP INDEX `wf_ticketsearchindex_document_ft`')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wf', '0005_ticket_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TicketSearchIndex',
+            fields=[
+                ('ticket', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_index', serialize=False, to='wf.ticket', verbose_name='关联工单')),
+                ('document', models.TextField(blank=True, default='', verbose_name='检索文档')),
+                ('update_time', models.DateTimeField(auto_now=True, verbose_name='修改时间')),
+            ],
+            options={
+                'verbose_name': '工单检索索引',
+                'verbose_name_plural': '工单检索索引',
+            },
+        ),
+        migrations.RunPython(add_fulltext_index, remove_fulltext_index),
+    ]
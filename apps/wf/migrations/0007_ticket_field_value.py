@@ -0,0 +1,32 @@
+# Generated by Django 4.2.11 on 2026-10-19 19:06
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wf', '0006_ticket_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TicketFieldValue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('field_key', models.CharField(max_length=50, verbose_name='字段标识')),
+                ('value_int', models.BigIntegerField(blank=True, null=True, verbose_name='整型值')),
+                ('value_float', models.FloatField(blank=True, null=True, verbose_name='浮点值')),
+                ('value_date', models.DateField(blank=True, null=True, verbose_name='日期值')),
+                ('value_datetime', models.DateTimeField(blank=True, null=True, verbose_name='日期时间值')),
+                ('value_str', models.CharField(blank=True, max_length=255, null=True, verbose_name='字符串值')),
+                ('ticket', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='field_values', to='wf.ticket', verbose_name='关联工单')),
+            ],
+            options={
+                'verbose_name': '工单字段值',
+                'verbose_name_plural': '工单字段值',
+                'indexes': [models.Index(fields=['field_key', 'value_int'], name='wf_ticketfi_field_k_3ef9c6_idx'), models.Index(fields=['field_key', 'value_float'], name='wf_ticketfi_field_k_3a0136_idx'), models.Index(fields=['field_key', 'value_date'], name='wf_ticketfi_field_k_76b595_idx'), models.Index(fields=['field_key', 'value_datetime'], name='wf_ticketfi_field_k_062842_idx'), models.Index(fields=['field_key', 'value_str'], name='wf_ticketfi_field_k_b6d210_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 4.2.11 on 2026-10-19 19:08
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('wf', '0007_ticket_field_value'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StateDwellRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='日期')),
+                ('bucket', models.SmallIntegerField(verbose_name='时长区间')),
+                ('count', models.IntegerField(default=0, verbose_name='次数')),
+                ('total_seconds', models.BigIntegerField(default=0, verbose_name='总时长(秒)')),
+                ('state', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='wf.state', verbose_name='状态')),
+                ('workflow', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='wf.workflow', verbose_name='工作流')),
+            ],
+            options={
+                'verbose_name': '状态停留汇总',
+                'verbose_name_plural': '状态停留汇总',
+                'unique_together': {('workflow', 'state', 'day', 'bucket')},
+            },
+        ),
+        migrations.CreateModel(
+            name='CycleTimeRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='日期')),
+                ('bucket', models.SmallIntegerField(verbose_name='时长区间')),
+                ('count', models.IntegerField(default=0, verbose_name='次数')),
+                ('total_seconds', models.BigIntegerField(default=0, verbose_name='总时长(秒)')),
+                ('workflow', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='wf.workflow', verbose_name='工作流')),
+            ],
+            options={
+                'verbose_name': '工单周期汇总',
+                'verbose_name_plural': '工单周期汇总',
+                'unique_together': {('workflow', 'day', 'bucket')},
+            },
+        ),
+        migrations.CreateModel(
+            name='ApproverRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='日期')),
+                ('count', models.IntegerField(default=0, verbose_name='处理次数')),
+                ('total_seconds', models.BigIntegerField(default=0, verbose_name='总等待时长(秒)')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='处理人')),
+                ('workflow', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='wf.workflow', verbose_name='工作流')),
+            ],
+            options={
+                'verbose_name': '处理人处理量汇总',
+                'verbose_name_plural': '处理人处理量汇总',
+                'unique_together': {('workflow', 'user', 'day')},
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.11 on 2026-10-19 19:10
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('wf', '0008_analytics_rollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TicketEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_type', models.CharField(choices=[('create', '创建'), ('handle', '处理'), ('accept', '接单'), ('retreat', '撤回'), ('close', '关闭'), ('add_node', '加签'), ('add_node_end', '加签完成')], max_length=20, verbose_name='事件类型')),
+                ('act_state', models.IntegerField(choices=[(0, '草稿中'), (1, '进行中'), (2, '被退回'), (3, '被撤回'), (4, '已完成'), (5, '已关闭')], verbose_name='进行状态')),
+                ('payload', models.JSONField(blank=True, default=dict, verbose_name='事件内容')),
+                ('create_time', models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='创建时间')),
+                ('destination_state', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='wf.state', verbose_name='目标状态')),
+                ('operator', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='操作人')),
+                ('source_state', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='wf.state', verbose_name='源状态')),
+                ('ticket', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='wf.ticket', verbose_name='关联工单')),
+                ('workflow', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='wf.workflow', verbose_name='工作流')),
+            ],
+            options={
+                'verbose_name': '工单事件',
+                'verbose_name_plural': '工单事件',
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+from django.db import migrations, models
+from django.db.models import F, Max
+
+
+def backfill_seq(apps, schema_editor):
+    """
+    已有事件按id分配序号, 原有游标(id)继续有效
+    """
+    TicketEvent = apps.get_model('wf', 'TicketEvent')
+    ModelVersion = apps.get_model('system', 'ModelVersion')
+    TicketEvent.objects.update(seq=F('id'))
+    last = TicketEvent.objects.aggregate(last=Max('id'))['last'] or 0
+    ModelVersion.objects.update_or_create(label='wf.ticket_event_seq', defaults={'version': last})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('system', '0015_user_manager'),
+        ('wf', '0009_ticket_event'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ticketevent',
+            name='seq',
+            field=models.PositiveBigIntegerField(blank=True, null=True, unique=True, verbose_name='提交序号'),
+        ),
+        migrations.RunPython(backfill_seq, migrations.RunPython.noop),
+    ]
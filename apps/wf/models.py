@@ -1,7 +1,9 @@
 from random import choice
+from datetime import date, datetime
 from django.db import models
 from django.db.models.base import Model
 import django.utils.timezone as timezone
+from django.utils.dateparse import parse_date, parse_datetime
 from django.db.models.query import QuerySet
 from apps.system.models import CommonAModel, CommonBModel, Organization, User, Dict, File
 from utils.model import SoftModel, BaseModel
@@ -217,6 +219,12 @@ class Ticket(CommonBModel):
     participant = models.JSONField('当前处理人', default=list, blank=True, help_text='可以为空(无处理人的情况，如结束状态)、userid、userid列表')
     act_state = models.IntegerField('进行状态', default=1, help_text='当前工单的进行状态', choices=act_state_choices)
     multi_all_person = models.JSONField('全部处理的结果', default=dict, blank=True, help_text='需要当前状态处理人全部处理时实际的处理结果，json格式')
+    version = models.PositiveIntegerField('版本号', default=0, help_text='乐观锁版本号,每次变更工单时递增')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['act_state', 'update_time']),
+        ]
 
 
 class TicketFlow(BaseModel):
@@ -234,3 +242,289 @@ class TicketFlow(BaseModel):
     intervene_type = models.IntegerField('干预类型', default=0, help_text='流转类型', choices=Transition.intervene_type_choices)
     participant_cc = models.JSONField('抄送给', default=list, blank=True, help_text='抄送给(userid列表)')
 
+
+class TicketVoteRound(BaseModel):
+    """
+    全部处理状态的一次会签(工单每进入一次该状态生成一轮)
+    """
+    ticket = models.ForeignKey(Ticket, on_delete=models.CASCADE, verbose_name='关联工单', related_name='vote_rounds')
+    state = models.ForeignKey(State, on_delete=models.CASCADE, verbose_name='会签状态')
+    vote_count = models.IntegerField('已处理人数', default=0, help_text='原子递增,用于判断是否全部处理完成')
+
+    class Meta:
+        verbose_name = '会签轮次'
+        verbose_name_plural = verbose_name
+
+
+class TicketVote(BaseModel):
+    """
+    会签处理记录, 每人每轮一条
+    """
+    ticket = models.ForeignKey(Ticket, on_delete=models.CASCADE, verbose_name='关联工单', related_name='votes')
+    round = models.ForeignKey(TicketVoteRound, on_delete=models.CASCADE, verbose_name='会签轮次', related_name='votes')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name='处理人')
+    transition = models.ForeignKey(Transition, on_delete=models.CASCADE, verbose_name='流转')
+
+    class Meta:
+        verbose_name = '会签记录'
+        verbose_name_plural = verbose_name
+        unique_together = ('ticket', 'round', 'user')
+
+
+class TicketArchive(models.Model):
+    """
+    归档工单, 已完成/已关闭且超过保留期的工单, 字段与工单一致
+    """
+    id = models.BigIntegerField(primary_key=True)
+    create_time = models.DateTimeField('创建时间')
+    update_time = models.DateTimeField('修改时间')
+    is_deleted = models.BooleanField('删除标记', default=False)
+    create_by = models.ForeignKey(User, null=True, blank=True, on_delete=models.DO_NOTHING, db_constraint=False, verbose_name='创建人', related_name='+')
+    update_by = models.ForeignKey(User, null=True, blank=True, on_delete=models.DO_NOTHING, db_constraint=False, verbose_name='最后编辑人', related_name='+')
+    belong_dept = models.ForeignKey(Organization, null=True, blank=True, on_delete=models.DO_NOTHING, db_constraint=False, verbose_name='所属部门', related_name='+')
+    title = models.CharField('标题', max_length=500, null=True, blank=True)
+    workflow = models.ForeignKey(Workflow, on_delete=models.DO_NOTHING, db_constraint=False, verbose_name='关联工作流', related_name='+')
+    sn = models.CharField('流水号', max_length=25)
+    state = models.ForeignKey(State, on_delete=models.DO_NOTHING, db_constraint=False, verbose_name='当前状态', related_name='+')
+    parent = models.ForeignKey(Ticket, null=True, blank=True, on_delete=models.DO_NOTHING, db_constraint=False, verbose_name='父工单', related_name='+')
+    parent_state = models.ForeignKey(State, null=True, blank=True, on_delete=models.DO_NOTHING, db_constraint=False, verbose_name='父工单状态', related_name='+')
+    ticket_data = models.JSONField('工单数据', default=dict)
+    in_add_node = models.BooleanField('加签状态中', default=False)
+    add_node_man = models.ForeignKey(User, null=True, blank=True, on_delete=models.DO_NOTHING, db_constraint=False, verbose_name='加签人', related_name='+')
+    script_run_last_result = models.BooleanField('脚本最后一次执行结果', default=True)
+    participant_type = models.IntegerField('当前处理人类型', default=0, choices=State.state_participanttype_choices)
+    participant = models.JSONField('当前处理人', default=list, blank=True)
+    act_state = models.IntegerField('进行状态', default=1, choices=Ticket.act_state_choices)
+    multi_all_person = models.JSONField('全部处理的结果', default=dict, blank=True)
+    version = models.PositiveIntegerField('版本号', default=0)
+    archive_time = models.DateTimeField('归档时间', default=timezone.now)
+
+    class Meta:
+        verbose_name = '归档工单'
+        verbose_name_plural = verbose_name
+        indexes = [
+            models.Index(fields=['create_time']),
+        ]
+
+
+class TicketFlowArchive(models.Model):
+    """
+    归档工单的流转日志
+    """
+    id = models.BigIntegerField(primary_key=True)
+    create_time = models.DateTimeField('创建时间')
+    update_time = models.DateTimeField('修改时间')
+    is_deleted = models.BooleanField('删除标记', default=False)
+    ticket = models.ForeignKey(TicketArchive, on_delete=models.CASCADE, verbose_name='关联工单', related_name='ticketflow_ticket')
+    transition = models.ForeignKey(Transition, null=True, blank=True, on_delete=models.DO_NOTHING, db_constraint=False, verbose_name='流转id', related_name='+')
+    suggestion = models.CharField('处理意见', max_length=10000, default='', blank=True)
+    participant_type = models.IntegerField('处理人类型', default=0, choices=State.state_participanttype_choices)
+    participant = models.ForeignKey(User, null=True, blank=True, on_delete=models.DO_NOTHING, db_constraint=False, verbose_name='处理人', related_name='+')
+    participant_str = models.CharField('处理人', max_length=200, null=True, blank=True)
+    state = models.ForeignKey(State, on_delete=models.DO_NOTHING, db_constraint=False, verbose_name='当前状态', related_name='+')
+    ticket_data = models.JSONField('工单数据', default=dict, blank=True)
+    intervene_type = models.IntegerField('干预类型', default=0, choices=Transition.intervene_type_choices)
+    participant_cc = models.JSONField('抄送给', default=list, blank=True)
+
+    class Meta:
+        verbose_name = '归档工单流转日志'
+        verbose_name_plural = verbose_name
+
+
+class TicketSearchIndex(models.Model):
+    """
+    工单全文检索文档(标题、流水号及自定义字段的文本值), MySQL下建立ngram全文索引
+    """
+    ticket = models.OneToOneField(Ticket, primary_key=True, on_delete=models.CASCADE, verbose_name='关联工单', related_name='search_index')
+    document = models.TextField('检索文档', default='', blank=True)
+    update_time = models.DateTimeField('修改时间', auto_now=True)
+
+    class Meta:
+        verbose_name = '工单检索索引'
+        verbose_name_plural = verbose_name
+
+
+class TicketFieldValue(models.Model):
+    """
+    工单自定义字段值的类型化存储, 按CustomField.field_type写入对应列, 多选字段每个选项一行
+    用于按ticket_data条件过滤工单
+    """
+    INT_TYPES = ('int', 'boolean')
+    FLOAT_TYPES = ('float',)
+    DATE_TYPES = ('date',)
+    DATETIME_TYPES = ('datetime',)
+    MULTI_TYPES = ('checkbox', 'selects', 'cascaders', 'select_dgs')
+    SKIP_TYPES = ('file',)
+
+    ticket = models.ForeignKey(Ticket, on_delete=models.CASCADE, verbose_name='关联工单', related_name='field_values')
+    field_key = models.CharField('字段标识', max_length=50)
+    value_int = models.BigIntegerField('整型值', null=True, blank=True)
+    value_float = models.FloatField('浮点值', null=True, blank=True)
+    value_date = models.DateField('日期值', null=True, blank=True)
+    value_datetime = models.DateTimeField('日期时间值', null=True, blank=True)
+    value_str = models.CharField('字符串值', max_length=255, null=True, blank=True)
+
+    class Meta:
+        verbose_name = '工单字段值'
+        verbose_name_plural = verbose_name
+        indexes = [
+            models.Index(fields=['field_key', 'value_int']),
+            models.Index(fields=['field_key', 'value_float']),
+            models.Index(fields=['field_key', 'value_date']),
+            models.Index(fields=['field_key', 'value_datetime']),
+            models.Index(fields=['field_key', 'value_str']),
+        ]
+
+    @classmethod
+    def get_value_column(cls, field_type):
+        """
+        字段类型对应的存储列
+        """
+        if field_type in cls.INT_TYPES:
+            return 'value_int'
+        elif field_type in cls.FLOAT_TYPES:
+            return 'value_float'
+        elif field_type in cls.DATE_TYPES:
+            return 'value_date'
+        elif field_type in cls.DATETIME_TYPES:
+            return 'value_datetime'
+        return 'value_str'
+
+    @classmethod
+    def to_python(cls, field_type, value):
+        """
+        按字段类型转换单个值, 无法转换时抛出ValueError
+        """
+        if field_type in cls.INT_TYPES:
+            if isinstance(value, str) and value.lower() in ('true', 'false'):
+                return int(value.lower() == 'true')
+            return int(value)
+        elif field_type in cls.FLOAT_TYPES:
+            return float(value)
+        elif field_type in cls.DATE_TYPES:
+            if isinstance(value, date):
+                return value
+            # 兼容带时间的日期字符串
+            value = parse_date(str(value)[:10])
+            if value is None:
+                raise ValueError('日期格式错误')
+            return value
+        elif field_type in cls.DATETIME_TYPES:
+            if not isinstance(value, datetime):
+                value = parse_datetime(str(value))
+                if value is None:
+                    raise ValueError('日期时间格式错误')
+            if timezone.is_naive(value):
+                value = timezone.make_aware(value)
+            return value
+        if isinstance(value, (list, tuple)):
+            # 级联选择取最后一级
+            if not value:
+                raise ValueError('空值')
+            value = value[-1]
+        return str(value)[:255]
+
+    @classmethod
+    def from_ticket_data(cls, ticket, fields):
+        """
+        根据自定义字段(field_key -> field_type)生成工单的字段值行
+        """
+        rows = []
+        for field_key, field_type in fields.items():
+            value = ticket.ticket_data.get(field_key, None)
+            if value is None or value == '' or field_type in cls.SKIP_TYPES:
+                continue
+            values = value if field_type in cls.MULTI_TYPES and isinstance(value, list) else [value]
+            column = cls.get_value_column(field_type)
+            for i in values:
+                try:
+                    rows.append(cls(ticket=ticket, field_key=field_key, **{column: cls.to_python(field_type, i)}))
+                except (TypeError, ValueError):
+                    continue
+        return rows
+
+
+class StateDwellRollup(models.Model):
+    """
+    状态停留时长汇总, 每(工作流, 状态, 日期, 时长区间)一行
+    """
+    workflow = models.ForeignKey(Workflow, on_delete=models.CASCADE, verbose_name='工作流', related_name='+')
+    state = models.ForeignKey(State, on_delete=models.CASCADE, verbose_name='状态', related_name='+')
+    day = models.DateField('日期')
+    bucket = models.SmallIntegerField('时长区间')
+    count = models.IntegerField('次数', default=0)
+    total_seconds = models.BigIntegerField('总时长(秒)', default=0)
+
+    class Meta:
+        verbose_name = '状态停留汇总'
+        verbose_name_plural = verbose_name
+        unique_together = ('workflow', 'state', 'day', 'bucket')
+
+
+class ApproverRollup(models.Model):
+    """
+    处理人处理量汇总, 每(工作流, 处理人, 日期)一行
+    """
+    workflow = models.ForeignKey(Workflow, on_delete=models.CASCADE, verbose_name='工作流', related_name='+')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name='处理人', related_name='+')
+    day = models.DateField('日期')
+    count = models.IntegerField('处理次数', default=0)
+    total_seconds = models.BigIntegerField('总等待时长(秒)', default=0)
+
+    class Meta:
+        verbose_name = '处理人处理量汇总'
+        verbose_name_plural = verbose_name
+        unique_together = ('workflow', 'user', 'day')
+
+
+class CycleTimeRollup(models.Model):
+    """
+    工单完成周期汇总, 每(工作流, 日期, 时长区间)一行
+    """
+    workflow = models.ForeignKey(Workflow, on_delete=models.CASCADE, verbose_name='工作流', related_name='+')
+    day = models.DateField('日期')
+    bucket = models.SmallIntegerField('时长区间')
+    count = models.IntegerField('次数', default=0)
+    total_seconds = models.BigIntegerField('总时长(秒)', default=0)
+
+    class Meta:
+        verbose_name = '工单周期汇总'
+        verbose_name_plural = verbose_name
+        unique_together = ('workflow', 'day', 'bucket')
+
+
+class TicketEvent(models.Model):
+    """
+    工单变更事件(outbox), 与工单变更在同一事务写入
+    自增id按写入顺序分配, 先写入的事务可能后提交; 提交后按提交顺序分配seq, 以seq作为消费游标(见WfService.sequence_events)
+    """
+    EVENT_CREATE = 'create'
+    EVENT_HANDLE = 'handle'
+    EVENT_ACCEPT = 'accept'
+    EVENT_RETREAT = 'retreat'
+    EVENT_CLOSE = 'close'
+    EVENT_ADD_NODE = 'add_node'
+    EVENT_ADD_NODE_END = 'add_node_end'
+    event_type_choices = (
+        (EVENT_CREATE, '创建'),
+        (EVENT_HANDLE, '处理'),
+        (EVENT_ACCEPT, '接单'),
+        (EVENT_RETREAT, '撤回'),
+        (EVENT_CLOSE, '关闭'),
+        (EVENT_ADD_NODE, '加签'),
+        (EVENT_ADD_NODE_END, '加签完成'),
+    )
+    event_type = models.CharField('事件类型', max_length=20, choices=event_type_choices)
+    ticket = models.ForeignKey(Ticket, on_delete=models.DO_NOTHING, db_constraint=False, verbose_name='关联工单', related_name='+')
+    workflow = models.ForeignKey(Workflow, on_delete=models.DO_NOTHING, db_constraint=False, verbose_name='工作流', related_name='+')
+    source_state = models.ForeignKey(State, null=True, blank=True, on_delete=models.DO_NOTHING, db_constraint=False, verbose_name='源状态', related_name='+')
+    destination_state = models.ForeignKey(State, null=True, blank=True, on_delete=models.DO_NOTHING, db_constraint=False, verbose_name='目标状态', related_name='+')
+    act_state = models.IntegerField('进行状态', choices=Ticket.act_state_choices)
+    operator = models.ForeignKey(User, null=True, blank=True, on_delete=models.DO_NOTHING, db_constraint=False, verbose_name='操作人', related_name='+')
+    payload = models.JSONField('事件内容', default=dict, blank=True)
+    seq = models.PositiveBigIntegerField('提交序号', null=True, blank=True, unique=True)
+    create_time = models.DateTimeField('创建时间', default=timezone.now, db_index=True)
+
+    class Meta:
+        verbose_name = '工单事件'
+        verbose_name_plural = verbose_name
@@ -0,0 +1,132 @@
+"""
+待办数推送: 工单处理人变更时经Redis发布, ASGI进程内单个订阅再按用户分发给SSE连接
+未配置REDIS_URL时不发布
+"""
+import asyncio
+import json
+import logging
+import secrets
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+logger = logging.getLogger('log')
+
+DUTY_CHANNEL = 'wf__duty_changed'
+STREAM_TICKET_KEY = 'wf__stream_ticket__{}'
+STREAM_TICKET_SECONDS = 30
+
+_redis = None
+
+
+def get_redis():
+    global _redis
+    if _redis is None:
+        import redis
+        _redis = redis.Redis.from_url(settings.REDIS_URL)
+    return _redis
+
+
+def get_participant_ids(participant):
+    """
+    工单处理人字段(userid或userid列表)转为id集合
+    """
+    if isinstance(participant, list):
+        return {int(i) for i in participant if i}
+    if participant:
+        return {int(participant)}
+    return set()
+
+
+def publish_duty_change(user_ids):
+    """
+    事务提交后发布待办发生变化的用户
+    """
+    if not settings.REDIS_URL or not user_ids:
+        return
+    message = json.dumps(sorted(user_ids))
+
+    def publish():
+        try:
+            get_redis().publish(DUTY_CHANNEL, message)
+        except Exception:
+            logger.exception('发布待办变更失败')
+    transaction.on_commit(publish)
+
+
+def issue_stream_ticket(user_id):
+    """
+    签发推送连接凭证, STREAM_TICKET_SECONDS秒内有效且只能使用一次, 代替在URL中传递access token
+    配置REDIS_URL时存于Redis, 各进程共享; 否则存于本进程缓存, 仅适用于单进程部署
+    """
+    ticket = secrets.token_urlsafe(32)
+    key = STREAM_TICKET_KEY.format(ticket)
+    if settings.REDIS_URL:
+        get_redis().set(key, user_id, ex=STREAM_TICKET_SECONDS)
+    else:
+        cache.set(key, user_id, STREAM_TICKET_SECONDS)
+    return ticket
+
+
+def consume_stream_ticket(ticket):
+    """
+    使用凭证, 返回签发时的用户id; 已使用或已过期返回None
+    """
+    key = STREAM_TICKET_KEY.format(ticket)
+    if settings.REDIS_URL:
+        user_id, _ = get_redis().pipeline().get(key).delete(key).execute()
+    else:
+        user_id = cache.get(key)
+        if user_id is not None and not cache.delete(key):
+            user_id = None  # 已被并发的连接使用
+    return int(user_id) if user_id else None
+
+
+class DutyHub:
+    """
+    进程内订阅中心, 每个进程只保持一个Redis订阅
+    """
+
+    def __init__(self):
+        self.queues = {}
+        self.task = None
+
+    def subscribe(self, user_id):
+        queue = asyncio.Queue(maxsize=1)
+        self.queues.setdefault(user_id, set()).add(queue)
+        if settings.REDIS_URL and (self.task is None or self.task.done()):
+            self.task = asyncio.ensure_future(self.listen())
+        return queue
+
+    def unsubscribe(self, user_id, queue):
+        queues = self.queues.get(user_id, set())
+        queues.discard(queue)
+        if not queues:
+            self.queues.pop(user_id, None)
+
+    def notify(self, user_ids):
+        for user_id in user_ids:
+            for queue in self.queues.get(user_id, ()):
+                if queue.empty():  # 未消费的通知合并为一次
+                    queue.put_nowait(True)
+
+    async def listen(self):
+        import redis.asyncio as aioredis
+        while True:
+            client = aioredis.Redis.from_url(settings.REDIS_URL)
+            try:
+                pubsub = client.pubsub()
+                await pubsub.subscribe(DUTY_CHANNEL)
+                async for message in pubsub.listen():
+                    if message['type'] == 'message':
+                        self.notify(json.loads(message['data']))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('订阅待办变更失败')
+                await asyncio.sleep(5)
+            finally:
+                await client.aclose()
+
+
+duty_hub = DutyHub()
@@ -3,7 +3,7 @@ from apps.system.serializers import UserSimpleSerializer
 import rest_framework
 from rest_framework import serializers
 
-from .models import State, Ticket, TicketFlow, Workflow, Transition, CustomField
+from .models import State, Ticket, TicketArchive, TicketEvent, TicketFlow, Workflow, Transition, CustomField
 
 
 class WorkflowSerializer(serializers.ModelSerializer):
@@ -190,4 +190,20 @@ class TicketAddNodeEndSerializer(serializers.Serializer):
     suggestion = serializers.CharField(label="加签意见", required = False)
 
 class TicketDestorySerializer(serializers.Serializer):
-    ids = serializers.ListField(child=serializers.PrimaryKeyRelatedField(queryset=Ticket.objects.all()), label='工单ID列表')
\ No newline at end of file
+    ids = serializers.ListField(child=serializers.PrimaryKeyRelatedField(queryset=Ticket.objects.all()), label='工单ID列表')
+
+
+class TicketArchiveListSerializer(TicketListSerializer):
+    class Meta(TicketListSerializer.Meta):
+        model = TicketArchive
+
+
+class TicketArchiveDetailSerializer(TicketDetailSerializer):
+    class Meta(TicketDetailSerializer.Meta):
+        model = TicketArchive
+
+
+class TicketEventSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = TicketEvent
+        fields = '__all__'
@@ -1,14 +1,23 @@
 from apps.wf.serializers import CustomFieldSerializer
-from apps.wf.serializers import TicketSerializer, TicketSimpleSerializer
+from apps.wf.serializers import TicketEventSerializer, TicketSerializer, TicketSimpleSerializer
 from typing import Tuple
-from apps.system.models import User
-from apps.wf.models import CustomField, State, Ticket, TicketFlow, Transition, Workflow
+from apps.system.models import ModelVersion, User
+from apps.wf.models import CustomField, State, Ticket, TicketArchive, TicketEvent, TicketFieldValue, TicketFlow, TicketFlowArchive, TicketSearchIndex, TicketVote, TicketVoteRound, Transition, Workflow
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
 from rest_framework.exceptions import APIException, PermissionDenied
 from django.utils import timezone
 from datetime import timedelta
 import random
 from .scripts import GetParticipants, HandleScripts
-from utils.queryset import get_parent_queryset
+from .exceptions import TicketVersionConflict
+from .push import get_participant_ids, publish_duty_change
+from apps.system.versions import bump_model_versions
+from apps.system.membership import get_dept_user_ids, get_parent_dept_ids, get_role_user_ids
+
+# 工单事件提交序号的计数行(ModelVersion)
+EVENT_SEQUENCE = 'wf.ticket_event_seq'
+
 
 class WfService(object):
     @staticmethod
@@ -163,21 +172,21 @@ class WfService(object):
                 state=state, ticket=ticket, new_ticket_data=new_ticket_data, handler=handler)
 
         elif destination_participant_type == State.PARTICIPANT_TYPE_DEPT:#部门
-            destination_participant = list(User.objects.filter(dept__in=destination_participant).values_list('id', flat=True))
+            destination_participant = list(get_dept_user_ids(destination_participant))
 
         elif destination_participant_type == State.PARTICIPANT_TYPE_ROLE:#角色
-            user_queryset = User.objects.filter(roles__in=destination_participant)
+            # 使用缓存的角色/部门成员关系, 常规情况下无需查询
+            user_ids = get_role_user_ids(destination_participant)
             # 如果选择了角色, 需要走过滤策略
-            if state.filter_policy == 1:
-                depts = get_parent_queryset(ticket.belong_dept)
-                user_queryset = user_queryset.filter(dept__in=depts)
-            elif state.filter_policy == 2:
-                depts = get_parent_queryset(ticket.create_by.dept)
-                user_queryset = user_queryset.filter(dept__in=depts)
-            elif state.filter_policy == 3:
-                depts = get_parent_queryset(handler.dept)
-                user_queryset = user_queryset.filter(dept__in=depts)
-            destination_participant = list(user_queryset.values_list('id', flat=True))
+            if state.filter_policy in (1, 2, 3):
+                if state.filter_policy == 1:
+                    dept_id = ticket.belong_dept_id
+                elif state.filter_policy == 2:
+                    dept_id = ticket.create_by.dept_id
+                else:
+                    dept_id = handler.dept_id
+                user_ids &= get_dept_user_ids(get_parent_dept_ids(dept_id))
+            destination_participant = list(user_ids)
         if type(destination_participant) == list:
             destination_participant_type = State.PARTICIPANT_TYPE_MULTI
             destination_participant = list(set(destination_participant))
@@ -188,6 +197,7 @@ class WfService(object):
             destination_participant_type = State.PARTICIPANT_TYPE_PERSONAL
         if destination_participant_type == State.PARTICIPANT_TYPE_MULTI:
             if state.distribute_type == State.STATE_DISTRIBUTE_TYPE_RANDOM:
+                destination_participant_type = State.PARTICIPANT_TYPE_PERSONAL
                 destination_participant = random.choice(destination_participant)
             elif state.distribute_type == State.STATE_DISTRIBUTE_TYPE_ALL:
                 for i in destination_participant:
@@ -258,12 +268,175 @@ class WfService(object):
             field_info_dict[i.field_key] = ticket.ticket_data.get(i.field_key, None)
         return field_info_dict
 
+    @classmethod
+    def get_ticket_search_document(cls, ticket:Ticket)->str:
+        """
+        工单检索文档: 标题、流水号及自定义字段中的文本值
+        """
+        words = [ticket.title or '', ticket.sn or '']
+        for value in ticket.ticket_data.values():
+            if isinstance(value, str):
+                words.append(value)
+            elif isinstance(value, list):
+                words.extend(i for i in value if isinstance(i, str))
+        return ' '.join(w.strip() for w in words if w and w.strip())
+
+    @classmethod
+    def update_ticket_search_index(cls, ticket:Ticket):
+        """
+        增量更新工单检索文档
+        """
+        TicketSearchIndex.objects.update_or_create(ticket=ticket,
+            defaults={'document': cls.get_ticket_search_document(ticket)})
+
+    @classmethod
+    def update_ticket_field_values(cls, ticket:Ticket):
+        """
+        按自定义字段类型重建工单的类型化字段值
+        """
+        fields = dict(cls.get_workflow_custom_fields(ticket.workflow).values_list('field_key', 'field_type'))
+        TicketFieldValue.objects.filter(ticket=ticket).delete()
+        TicketFieldValue.objects.bulk_create(TicketFieldValue.from_ticket_data(ticket, fields))
+        bump_model_versions(TicketFieldValue)
+
+    @classmethod
+    def get_duty_agg(cls, user_id:int)->dict:
+        """
+        用户待办数及按工作流的分布
+        """
+        queryset = Ticket.objects.filter(participant__contains=user_id, is_deleted=False)\
+            .exclude(act_state__in=[Ticket.TICKET_ACT_STATE_FINISH, Ticket.TICKET_ACT_STATE_CLOSED])
+        details = list(queryset.values('workflow', 'workflow__name').annotate(count = Count('workflow')).order_by('workflow'))
+        return {'total_count': sum(i['count'] for i in details), 'details': details}
+
+    @classmethod
+    def record_event(cls, ticket:Ticket, event_type:str, source_state:State, operator:User=None,
+                     old_participant=None, transition:Transition=None, suggestion:str=''):
+        """
+        写入工单变更事件(outbox), 须在工单变更的同一事务中调用
+        """
+        publish_duty_change(get_participant_ids(old_participant) | get_participant_ids(ticket.participant))
+        return TicketEvent.objects.create(ticket=ticket, workflow_id=ticket.workflow_id, event_type=event_type,
+            source_state=source_state, destination_state_id=ticket.state_id, act_state=ticket.act_state,
+            operator=operator, payload={
+                'sn': ticket.sn,
+                'title': ticket.title,
+                'version': ticket.version,
+                'transition': transition.id if transition else None,
+                'suggestion': suggestion,
+                'old_participant': old_participant,
+                'participant': ticket.participant,
+            })
+
+    @classmethod
+    def sequence_events(cls, batch_size=500):
+        """
+        按提交顺序为事件分配seq: 持有序号行锁后只能读到已提交的事件, 之后提交的事件分到更大的序号, 不会被游标跳过
+        """
+        while TicketEvent.objects.filter(seq__isnull=True).exists():
+            with transaction.atomic():
+                counter, _ = ModelVersion.objects.select_for_update().get_or_create(label=EVENT_SEQUENCE)
+                ids = TicketEvent.objects.filter(seq__isnull=True).order_by('id').values_list('id', flat=True)
+                events = [TicketEvent(id=pk, seq=counter.version + i) for i, pk in enumerate(ids[:batch_size], 1)]
+                TicketEvent.objects.bulk_update(events, ['seq'])
+                ModelVersion.objects.filter(pk=counter.pk).update(version=counter.version + len(events))
+
+    @classmethod
+    def get_events(cls, after:int, limit:int)->dict:
+        """
+        读取游标after之后的事件, 返回{cursor, has_more, events}
+        """
+        cls.sequence_events()
+        events = list(TicketEvent.objects.filter(seq__gt=after).order_by('seq')[:limit + 1])
+        has_more = len(events) > limit
+        events = events[:limit]
+        return {
+            'cursor': events[-1].seq if events else after,
+            'has_more': has_more,
+            'events': TicketEventSerializer(instance=events, many=True).data,
+        }
+
+    @classmethod
+    def save_ticket(cls, ticket:Ticket, update_fields:list, guard:dict=None):
+        """
+        乐观锁保存工单: 只更新指定字段并递增版本号
+        以UPDATE ... WHERE version=n执行, 工单在读取后已被修改时抛出409
+        guard: 会签处理时代替版本号的条件(见vote_ticket), 同一轮的处理人基于同一版本并发处理,
+        工单仍处于读取时的状态即可保存, 期间被撤回、关闭或加签时抛出409
+        """
+        now = timezone.now()
+        values = {field: getattr(ticket, field) for field in update_fields}
+        rows = Ticket.objects.filter(pk=ticket.pk, **(guard or {'version': ticket.version}))\
+            .update(version=F('version')+1, update_time=now, **values)
+        if not rows:
+            raise TicketVersionConflict()
+        bump_model_versions(Ticket)  # update不触发post_save
+        if guard:
+            ticket.version = Ticket.objects.filter(pk=ticket.pk).values_list('version', flat=True).get()
+        else:
+            ticket.version += 1
+        ticket.update_time = now
+        return ticket
+
+    @classmethod
+    def update_editable_ticket_data(cls, state:State, ticket_data:dict, new_ticket_data:dict)->bool:
+        """
+        只更新状态中必填和可选的字段, 返回是否有字段被更新
+        """
+        changed = False
+        for key, value in state.state_fields.items():
+            if value in (State.STATE_FIELD_REQUIRED, State.STATE_FIELD_OPTIONAL):
+                if key in new_ticket_data:
+                    changed = changed or ticket_data.get(key) != new_ticket_data[key]
+                    ticket_data[key] = new_ticket_data[key]
+        return changed
+
+    @classmethod
+    def get_vote_round(cls, ticket:Ticket)->TicketVoteRound:
+        """
+        当前会签轮次; 升级前已处于会签中的工单没有轮次, 创建时按multi_all_person中已有的处理结果补录处理记录,
+        这些处理人已不在待处理人中, 不补录则会签永远无法完成
+        """
+        vote_round = TicketVoteRound.objects.filter(ticket=ticket, state=ticket.state).order_by('-id').first()
+        if vote_round is not None:
+            return vote_round
+        voted = {int(user_id): result['transition'] for user_id, result in ticket.multi_all_person.items()
+                 if isinstance(result, dict) and result.get('transition')}
+        vote_round = TicketVoteRound.objects.create(ticket=ticket, state=ticket.state, vote_count=len(voted))
+        TicketVote.objects.bulk_create([TicketVote(ticket=ticket, round=vote_round, user_id=user_id, transition_id=transition_id)
+                                        for user_id, transition_id in voted.items()])
+        return vote_round
+
+    @classmethod
+    def vote_ticket(cls, ticket:Ticket, transition:Transition, handler:User)->tuple:
+        """
+        会签处理: 记录本人的处理结果, 不锁定工单及处理记录
+        重复处理由(轮次, 处理人)唯一约束拒绝; 计数以UPDATE原子递增, 读到的计数达到应处理人数者为最后一人,
+        只有其流转工单; 递增在前一处理人提交后才返回, 读已提交隔离级别下此时其处理记录已可见
+        返回(是否所有人都已选择该流转, 未处理人id列表, 处理人id -> 流转id)
+        """
+        vote_round = cls.get_vote_round(ticket)
+        try:
+            with transaction.atomic():
+                TicketVote.objects.create(ticket=ticket, round=vote_round, user=handler, transition=transition)
+        except IntegrityError:
+            raise APIException('您已处理过该工单')
+        TicketVoteRound.objects.filter(pk=vote_round.pk).update(vote_count=F('vote_count')+1)
+        vote_count = TicketVoteRound.objects.filter(pk=vote_round.pk).values_list('vote_count', flat=True).get()
+        persons = [int(i) for i in ticket.multi_all_person]
+        voted = dict(TicketVote.objects.filter(round=vote_round).values_list('user_id', 'transition_id'))
+        pending = [i for i in persons if i not in voted]
+        agreed_count = len([i for i in voted.values() if i == transition.id])
+        all_agreed = vote_count >= len(persons) and agreed_count >= len(persons)
+        return all_agreed, pending, voted
+
     @classmethod
     def handle_ticket(cls, ticket:Ticket, transition: Transition, new_ticket_data:dict={}, handler:User=None, 
         suggestion:str='', created:bool=False, by_timer:bool=False, by_task:bool=False, by_hook:bool=False):
 
         source_state = ticket.state
         source_ticket_data = ticket.ticket_data
+        source_participant = ticket.participant
 
         # 校验处理权限
         if not handler or not created: # 没有处理人意味着系统触发不校验处理权限
@@ -279,29 +452,35 @@ class WfService(object):
                         raise APIException('字段{}必填'.format(key))
 
         destination_state = cls.get_next_state_by_transition_and_ticket_info(ticket, transition, new_ticket_data)
-        multi_all_person = ticket.multi_all_person
-        if multi_all_person:
-            multi_all_person[handler.id] =dict(transition=transition.id)
-            # 判断所有人处理结果是否一致
-            if WfService.check_dict_has_all_same_value(multi_all_person):
-                participant_info = WfService.get_ticket_state_participant_info(destination_state, ticket, new_ticket_data)
-                destination_participant_type = participant_info.get('destination_participant_type', 0)
-                destination_participant = participant_info.get('destination_participant', 0)
-                multi_all_person = {}
-            else:
-                # 处理人没有没有全部处理完成或者处理动作不一致
-                destination_participant_type = ticket.participant_type
-                destination_state = ticket.state  # 保持原状态
-                destination_participant = []
-                for key, value in multi_all_person.items():
-                    if not value:
-                        destination_participant.append(key)
-        else:
-            # 当前处理人类型非全部处理
-            participant_info = WfService.get_ticket_state_participant_info(destination_state, ticket, new_ticket_data)
-            destination_participant_type = participant_info.get('destination_participant_type', 0)
-            destination_participant = participant_info.get('destination_participant', 0)
-            multi_all_person = participant_info.get('multi_all_person', {})
+        guard = None
+        if ticket.multi_all_person and handler:
+            # 全部处理(会签): 每人一条处理记录, 由原子计数决定是否流转; 以工单仍在会签中代替版本号校验
+            guard = {'state': source_state, 'act_state': ticket.act_state, 'in_add_node': ticket.in_add_node}
+            all_agreed, pending, voted = cls.vote_ticket(ticket, transition, handler)
+            if not all_agreed:
+                # 处理人没有全部处理完成或者处理动作不一致, 只更新待处理人及处理结果, 不整行保存工单
+                # 处理结果按已提交的处理记录重建, 并发处理时后保存者包含先前所有人的结果
+                update_fields = ['participant', 'multi_all_person']
+                if not created and cls.update_editable_ticket_data(source_state, source_ticket_data, new_ticket_data):
+                    update_fields.append('ticket_data')
+                ticket.participant = pending
+                ticket.multi_all_person = {key: dict(transition=voted[int(key)]) if int(key) in voted else value
+                                           for key, value in ticket.multi_all_person.items()}
+                ticket.ticket_data = source_ticket_data
+                cls.save_ticket(ticket, update_fields, guard)
+                if 'ticket_data' in update_fields:
+                    cls.update_ticket_search_index(ticket)
+                    cls.update_ticket_field_values(ticket)
+                cls.record_event(ticket, TicketEvent.EVENT_HANDLE, source_state, handler, source_participant,
+                    transition, suggestion)
+                TicketFlow.objects.create(ticket=ticket, state=source_state, ticket_data=WfService.get_ticket_all_field_value(ticket),
+                                suggestion=suggestion, participant_type=State.PARTICIPANT_TYPE_PERSONAL,
+                                participant=handler, transition=transition)
+                return ticket
+        participant_info = WfService.get_ticket_state_participant_info(destination_state, ticket, new_ticket_data)
+        destination_participant_type = participant_info.get('destination_participant_type', 0)
+        destination_participant = participant_info.get('destination_participant', 0)
+        multi_all_person = participant_info.get('multi_all_person', {})
 
         # 更新工单信息：基础字段及自定义字段， add_relation字段 需要下个处理人是部门、角色等的情况
         ticket.state = destination_state
@@ -319,13 +498,23 @@ class WfService(object):
             ticket.act_state = Ticket.TICKET_ACT_STATE_BACK
 
         # 只更新必填和可选的字段
+        data_changed = created
         if not created:
-            for key, value in source_state.state_fields.items(): 
-                    if value in (State.STATE_FIELD_REQUIRED, State.STATE_FIELD_OPTIONAL):
-                        if key in new_ticket_data:
-                            source_ticket_data[key] = new_ticket_data[key]
+            data_changed = cls.update_editable_ticket_data(source_state, source_ticket_data, new_ticket_data)
             ticket.ticket_data = source_ticket_data
-        ticket.save()
+        cls.save_ticket(ticket, ['state', 'participant_type', 'participant', 'multi_all_person', 'act_state', 'ticket_data'],
+            guard)
+
+        if data_changed:
+            cls.update_ticket_search_index(ticket)
+            cls.update_ticket_field_values(ticket)
+
+        cls.record_event(ticket, TicketEvent.EVENT_CREATE if created else TicketEvent.EVENT_HANDLE,
+            source_state, handler, source_participant, transition, suggestion)
+
+        # 进入全部处理状态, 开启新一轮会签
+        if multi_all_person:
+            TicketVoteRound.objects.create(ticket=ticket, state=destination_state)
 
         # 更新工单流转记录
         if not by_task:
@@ -351,3 +540,37 @@ class WfService(object):
         
         return ticket
 
+    @classmethod
+    def archive_finished_tickets(cls, days:int, batch_size:int=500)->int:
+        """
+        将完成/关闭超过days天的工单及其流转日志分批移入归档表, 返回归档数量
+        仍被其他工单作为父工单引用的不归档
+        """
+        before = timezone.now() - timedelta(days=days)
+        ticket_fields = [f.attname for f in Ticket._meta.concrete_fields]
+        flow_fields = [f.attname for f in TicketFlow._meta.concrete_fields]
+        total = 0
+        while True:
+            with transaction.atomic():
+                ids = list(Ticket.all_objects.filter(
+                    act_state__in=[Ticket.TICKET_ACT_STATE_FINISH, Ticket.TICKET_ACT_STATE_CLOSED],
+                    update_time__lt=before).exclude(
+                    id__in=Ticket.all_objects.filter(parent__isnull=False).values('parent_id'))
+                    .order_by('id').values_list('id', flat=True)[:batch_size])
+                if not ids:
+                    break
+                # 锁定本批工单, 防止归档期间被再次处理
+                tickets = list(Ticket.all_objects.select_for_update().filter(
+                    id__in=ids, update_time__lt=before).values(*ticket_fields))
+                archive_time = timezone.now()
+                TicketArchive.objects.bulk_create(
+                    [TicketArchive(archive_time=archive_time, **i) for i in tickets])
+                ids = [i['id'] for i in tickets]
+                TicketFlowArchive.objects.bulk_create(
+                    [TicketFlowArchive(**i) for i in TicketFlow.objects.filter(ticket_id__in=ids).values(*flow_fields)],
+                    batch_size=batch_size)
+                bump_model_versions(TicketArchive, TicketFlowArchive)
+                # 硬删除, 流转日志/会签记录随之级联删除
+                Ticket.all_objects.filter(id__in=ids).delete(soft=False)
+                total = total + len(ids)
+        return total
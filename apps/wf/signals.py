@@ -0,0 +1,16 @@
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from apps.system.versions import track_model_versions
+from .models import CustomField, State, Ticket, TicketArchive, TicketFieldValue, TicketFlow, TicketFlowArchive, TicketSearchIndex, Transition, Workflow
+from .analytics import record_flow
+
+# 工作流配置变更时递增版本号, 用于ETag
+track_model_versions(Workflow, State, Transition, CustomField)
+# 列表总数缓存按版本号失效(见utils.pagination.get_count), 写入频繁, 提交后递增
+track_model_versions(Ticket, TicketFlow, TicketFieldValue, TicketSearchIndex, TicketArchive, TicketFlowArchive, on_commit=True)
+
+# 流转日志写入时增量更新统计汇总
+@receiver(post_save, sender=TicketFlow)
+def update_analytics_rollup(sender, instance, created, **kwargs):
+    if created:
+        record_flow(instance)
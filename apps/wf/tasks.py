@@ -0,0 +1,77 @@
+# Create your tasks here
+from __future__ import absolute_import, unicode_literals
+
+from celery import shared_task
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from apps.wf.models import Ticket, TicketEvent
+from apps.wf.services import WfService
+
+
+@shared_task
+def archive_finished_tickets(days=None, batch_size=500):
+    """
+    归档已完成/关闭超过保留期的工单, 可在django_celery_beat中配置为定时任务
+    """
+    if days is None:
+        days = settings.TICKET_ARCHIVE_DAYS
+    return WfService.archive_finished_tickets(days, batch_size)
+
+
+@shared_task
+def rebuild_ticket_search_index(batch_size=1000):
+    """
+    为尚无检索文档的工单补建索引
+    """
+    total = 0
+    queryset = Ticket.all_objects.filter(search_index__isnull=True).order_by('id')
+    last_id = 0
+    while True:
+        tickets = list(queryset.filter(id__gt=last_id)[:batch_size])
+        if not tickets:
+            break
+        for ticket in tickets:
+            WfService.update_ticket_search_index(ticket)
+        last_id = tickets[-1].id
+        total = total + len(tickets)
+    return total
+
+
+@shared_task
+def rebuild_ticket_field_values(workflow=None, batch_size=1000):
+    """
+    重建工单的类型化字段值, 可用于自定义字段类型变更后
+    """
+    total = 0
+    queryset = Ticket.all_objects.select_related('workflow').order_by('id')
+    if workflow:
+        queryset = queryset.filter(workflow_id=workflow)
+    last_id = 0
+    while True:
+        tickets = list(queryset.filter(id__gt=last_id)[:batch_size])
+        if not tickets:
+            break
+        for ticket in tickets:
+            WfService.update_ticket_field_values(ticket)
+        last_id = tickets[-1].id
+        total = total + len(tickets)
+    return total
+
+
+@shared_task
+def prune_ticket_events(days=None, batch_size=5000):
+    """
+    分批删除超过保留期的工单事件
+    """
+    if days is None:
+        days = settings.TICKET_EVENT_RETENTION_DAYS
+    before = timezone.now() - timedelta(days=days)
+    total = 0
+    while True:
+        ids = list(TicketEvent.objects.filter(create_time__lt=before).order_by('id').values_list('id', flat=True)[:batch_size])
+        if not ids:
+            break
+        TicketEvent.objects.filter(id__in=ids).delete()
+        total = total + len(ids)
+    return total
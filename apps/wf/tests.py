@@ -1,3 +1,669 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+import threading
+from datetime import timedelta
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.models.query import QuerySet
+from asgiref.sync import async_to_sync
+from django.http import Http404
+from django.test import AsyncRequestFactory, RequestFactory, TestCase, TransactionTestCase, skipUnlessDBFeature
+from django.utils import timezone
+from unittest import mock, skipIf
+from rest_framework.exceptions import APIException
+from rest_framework.test import APIRequestFactory, force_authenticate
+from rest_framework_simplejwt.tokens import AccessToken
+from apps.system.models import Permission, Role, User
+from .exceptions import TicketVersionConflict
+from .models import ApproverRollup, CustomField, CycleTimeRollup, State, StateDwellRollup, Ticket, TicketArchive, TicketEvent, TicketFlow, TicketFlowArchive, TicketVote, \
+    TicketVoteRound, Transition, Workflow
+from .services import WfService
+from apps.system.versions import bump_model_version
+from utils.pagination import get_count
+from .analytics import rebuild_rollups
+from .push import consume_stream_ticket, issue_stream_ticket
+from .views import TicketEventView, TicketViewSet, WorkflowViewSet, duty_stream, ticket_event_wait
 
-# Create your tests here.
+
+def as_view(viewset, method, action, detail):
+    """
+    与路由相同, 额外操作带上@action的参数(如perms_map)
+    """
+    initkwargs = getattr(getattr(viewset, action), 'kwargs', {})
+    return viewset.as_view({method: action}, detail=detail, **initkwargs)
+
+
+class WfTestMixin:
+    """
+    开始 -> 会签(u1, u2全部处理) -> 结束, 会签状态可撤回, 可拒绝退回开始
+    """
+
+    @classmethod
+    def create_workflow(cls):
+        cls.admin = User.objects.create(username='admin', is_superuser=True, is_staff=True)
+        cls.u1 = User.objects.create(username='u1')
+        cls.u2 = User.objects.create(username='u2')
+        cls.role = Role.objects.create(name='员工')
+        cls.role.perms.add(Permission.objects.create(name='新建工单', method='ticket_create'))
+        for user in (cls.u1, cls.u2):
+            user.roles.add(cls.role)
+        cls.workflow = Workflow.objects.create(name='请假', key='leave', title_template='')
+        CustomField.objects.create(workflow=cls.workflow, field_type='int', field_key='days', field_name='天数')
+        cls.start = State.objects.create(name='开始', workflow=cls.workflow, type=State.STATE_TYPE_START,
+                                         state_fields={'days': State.STATE_FIELD_REQUIRED})
+        cls.vote = State.objects.create(name='会签', workflow=cls.workflow, participant_type=State.PARTICIPANT_TYPE_MULTI,
+                                        participant=[cls.u1.id, cls.u2.id], distribute_type=State.STATE_DISTRIBUTE_TYPE_ALL,
+                                        enable_retreat=True, state_fields={'days': State.STATE_FIELD_OPTIONAL})
+        cls.end = State.objects.create(name='结束', workflow=cls.workflow, type=State.STATE_TYPE_END)
+        cls.submit = Transition.objects.create(name='提交', workflow=cls.workflow, source_state=cls.start,
+                                               destination_state=cls.vote)
+        cls.agree = Transition.objects.create(name='同意', workflow=cls.workflow, source_state=cls.vote,
+                                              destination_state=cls.end, field_require_check=False)
+        cls.refuse = Transition.objects.create(name='拒绝', workflow=cls.workflow, source_state=cls.vote,
+                                               destination_state=cls.start, field_require_check=False,
+                                               attribute_type=Transition.TRANSITION_ATTRIBUTE_TYPE_REFUSE)
+
+    def call(self, action, user, pk=None, data=None, method='post', headers=None, query=''):
+        """
+        调用TicketViewSet, 返回{code, data, msg}
+        """
+        request = getattr(APIRequestFactory(), method)('/api/wf/ticket/' + query, data or {}, format='json',
+                                                         **(headers or {}))
+        force_authenticate(request, user=user)
+        view = as_view(TicketViewSet, method, action, detail=pk is not None)
+        response = view(request, pk=pk) if pk is not None else view(request)
+        response.render()
+        return json.loads(response.content)
+
+    def create_ticket(self, days=3, title='请假'):
+        ret = self.call('create', self.admin, data={'workflow': self.workflow.id, 'transition': self.submit.id,
+                                                    'title': title, 'ticket_data': {'days': days}})
+        self.assertEqual(ret['code'], 200, ret['msg'])
+        return Ticket.objects.get(pk=ret['data']['id'])
+
+    def handle(self, user, ticket, transition, headers=None):
+        return self.call('handle', user, pk=ticket.id, headers=headers,
+                         data={'transition': transition.id, 'ticket_data': {}, 'suggestion': ''})
+
+    def finish_ticket(self, days=3):
+        ticket = self.create_ticket(days)
+        for user in (self.u1, self.u2):
+            self.handle(user, ticket, self.agree)
+        ticket.refresh_from_db()
+        return ticket
+
+
+class WfTestCase(WfTestMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.create_workflow()
+
+
+class TicketVoteTest(WfTestCase):
+    """
+    会签: 每人每轮一条处理记录, 计数决定是否流转
+    """
+
+    def test_all_agree(self):
+        ticket = self.create_ticket()
+        self.assertEqual(ticket.participant, [self.u1.id, self.u2.id])
+        self.assertEqual(self.handle(self.u1, ticket, self.agree)['code'], 200)
+        ticket.refresh_from_db()
+        self.assertEqual((ticket.state, ticket.participant), (self.vote, [self.u2.id]))
+        self.assertEqual(self.handle(self.u2, ticket, self.agree)['code'], 200)
+        ticket.refresh_from_db()
+        self.assertEqual(ticket.state, self.end)
+        self.assertEqual(ticket.act_state, Ticket.TICKET_ACT_STATE_FINISH)
+        self.assertEqual(TicketVoteRound.objects.get(ticket=ticket).vote_count, 2)
+
+    def test_vote_results_recorded(self):
+        ticket = self.create_ticket()
+        self.handle(self.u1, ticket, self.agree)
+        ticket.refresh_from_db()
+        self.assertEqual(ticket.multi_all_person, {str(self.u1.id): {'transition': self.agree.id}, str(self.u2.id): {}})
+
+    def test_votes_on_same_version(self):
+        """
+        同一轮的处理人基于同一版本并发处理, 均成功且只流转一次
+        """
+        ticket = self.create_ticket()
+        first, second = Ticket.objects.get(pk=ticket.pk), Ticket.objects.get(pk=ticket.pk)
+        WfService.handle_ticket(first, self.agree, {}, handler=self.u1)
+        WfService.handle_ticket(second, self.agree, {}, handler=self.u2)
+        ticket.refresh_from_db()
+        self.assertEqual((ticket.state, ticket.act_state), (self.end, Ticket.TICKET_ACT_STATE_FINISH))
+        self.assertEqual(ticket.version, 3)
+        self.assertEqual(TicketFlow.objects.filter(ticket=ticket, transition=self.agree).count(), 2)
+
+    def test_duplicate_vote(self):
+        ticket = self.create_ticket()
+        WfService.vote_ticket(ticket, self.agree, self.u1)
+        with self.assertRaises(APIException):
+            WfService.vote_ticket(ticket, self.agree, self.u1)
+        # 重复处理被唯一约束拒绝, 计数未变
+        self.assertEqual(TicketVoteRound.objects.get(ticket=ticket).vote_count, 1)
+        self.assertEqual(TicketVote.objects.filter(ticket=ticket).count(), 1)
+        # 通过接口处理后已不是处理人, 再次处理直接拒绝
+        ticket = self.create_ticket()
+        self.assertEqual(self.handle(self.u1, ticket, self.agree)['code'], 200)
+        self.assertEqual(self.handle(self.u1, ticket, self.agree)['code'], 403)
+        self.assertEqual(TicketVoteRound.objects.get(ticket=ticket).vote_count, 1)
+
+    def test_disagreeing_votes(self):
+        ticket = self.create_ticket()
+        self.assertEqual(self.handle(self.u1, ticket, self.agree)['code'], 200)
+        self.assertEqual(self.handle(self.u2, ticket, self.refuse)['code'], 200)
+        ticket.refresh_from_db()
+        # 处理结果不一致时不流转(与原实现一致)
+        self.assertEqual(ticket.state, self.vote)
+        self.assertEqual(ticket.act_state, Ticket.TICKET_ACT_STATE_ONGOING)
+        self.assertEqual(dict(TicketVote.objects.filter(ticket=ticket).values_list('user_id', 'transition_id')),
+                         {self.u1.id: self.agree.id, self.u2.id: self.refuse.id})
+
+    def test_legacy_ticket_in_vote(self):
+        """
+        升级前已处于会签中的工单: 按multi_all_person补录已处理的记录, 剩余处理人处理后完成
+        """
+        ticket = self.create_ticket()
+        TicketVoteRound.objects.filter(ticket=ticket).delete()
+        Ticket.objects.filter(pk=ticket.pk).update(participant=[self.u2.id], multi_all_person={
+            str(self.u1.id): {'transition': self.agree.id}, str(self.u2.id): {}})
+        ret = self.handle(self.u2, ticket, self.agree)
+        self.assertEqual(ret['code'], 200, ret['msg'])
+        ticket.refresh_from_db()
+        self.assertEqual(ticket.act_state, Ticket.TICKET_ACT_STATE_FINISH)
+        vote_round = TicketVoteRound.objects.get(ticket=ticket)
+        self.assertEqual(vote_round.vote_count, 2)
+        self.assertEqual(set(vote_round.votes.values_list('user_id', flat=True)), {self.u1.id, self.u2.id})
+
+    def test_new_round_after_refuse(self):
+        ticket = self.create_ticket()
+        self.handle(self.u1, ticket, self.agree)
+        self.handle(self.u2, ticket, self.agree)
+        ticket = self.create_ticket()
+        for user in (self.u1, self.u2):
+            self.handle(user, ticket, self.refuse)
+        ticket.refresh_from_db()
+        self.assertEqual(ticket.state, self.start)
+        ret = self.call('handle', self.admin, pk=ticket.id, data={
+            'transition': self.submit.id, 'ticket_data': {'days': 2}, 'suggestion': ''})
+        self.assertEqual(ret['code'], 200, ret['msg'])
+        # 再次进入会签开启新一轮, 上一轮的处理记录不影响本轮
+        self.assertEqual(TicketVoteRound.objects.filter(ticket=ticket).count(), 2)
+        self.assertEqual(self.handle(self.u1, ticket, self.agree)['code'], 200)
+        ticket.refresh_from_db()
+        self.assertEqual(ticket.participant, [self.u2.id])
+
+
+class TicketArchiveTest(WfTestCase):
+    """
+    完成/关闭超过保留期的工单移入归档表, 查询全部时合并返回
+    """
+
+    def test_archive_finished(self):
+        old = self.finish_ticket()
+        recent = self.finish_ticket()
+        ongoing = self.create_ticket()
+        Ticket.objects.filter(pk__in=[old.pk, ongoing.pk]).update(update_time=timezone.now() - timedelta(days=200))
+        flows = TicketFlow.objects.filter(ticket=old).count()
+        self.assertEqual(WfService.archive_finished_tickets(180), 1)
+        self.assertFalse(Ticket.all_objects.filter(pk=old.pk).exists())
+        self.assertEqual(Ticket.objects.filter(pk__in=[recent.pk, ongoing.pk]).count(), 2)
+        archive = TicketArchive.objects.get(pk=old.pk)
+        self.assertEqual((archive.sn, archive.act_state), (old.sn, Ticket.TICKET_ACT_STATE_FINISH))
+        self.assertEqual(TicketFlowArchive.objects.filter(ticket_id=old.pk).count(), flows)
+
+    def test_parent_not_archived(self):
+        parent = self.finish_ticket()
+        child = self.create_ticket()
+        Ticket.objects.filter(pk=child.pk).update(parent=parent)
+        Ticket.objects.filter(pk=parent.pk).update(update_time=timezone.now() - timedelta(days=200))
+        self.assertEqual(WfService.archive_finished_tickets(180), 0)
+
+    def test_list_and_retrieve_archived(self):
+        old = self.finish_ticket()
+        recent = self.finish_ticket()
+        Ticket.objects.filter(pk=old.pk).update(update_time=timezone.now() - timedelta(days=200))
+        WfService.archive_finished_tickets(180)
+        ret = self.call('list', self.admin, method='get', query='?category=all&page=1')
+        rows = {i['id']: i['archived'] for i in ret['data']['results']}
+        self.assertEqual(rows, {old.pk: True, recent.pk: False})
+        # 只查我的等分类时不包含归档工单
+        ret = self.call('list', self.admin, method='get', query='?category=owner&page=1')
+        self.assertEqual([i['id'] for i in ret['data']['results']], [recent.pk])
+        ret = self.call('retrieve', self.admin, pk=old.pk, method='get', query='?category=all')
+        self.assertEqual(ret['data']['sn'], old.sn)
+        self.assertEqual(self.call('retrieve', self.admin, pk=old.pk, method='get')['code'], 404)
+
+
+class TicketSearchTest(WfTestCase):
+    """
+    ?q=全文检索标题、流水号及自定义字段文本, 非MySQL下逐词包含匹配
+    """
+
+    def search(self, q):
+        ret = self.call('list', self.admin, method='get', query='?category=all&page=1&q=' + q)
+        return {i['id'] for i in ret['data']['results']}
+
+    def test_search_title(self):
+        sick = self.create_ticket(title='病假申请')
+        annual = self.create_ticket(title='年假申请')
+        self.assertEqual(self.search('申请'), {sick.pk, annual.pk})
+        self.assertEqual(self.search('病假 申请'), {sick.pk})
+        self.assertEqual(self.search('加班'), set())
+
+    def test_search_sn(self):
+        ticket = self.create_ticket(title='病假申请')
+        self.assertEqual(self.search(ticket.sn), {ticket.pk})
+
+    def test_operators_ignored(self):
+        sick = self.create_ticket(title='病假申请')
+        self.assertEqual(self.search('+病假*'), {sick.pk})
+
+    def test_document_updated(self):
+        ticket = self.create_ticket(title='病假')
+        self.assertEqual(ticket.search_index.document, '病假 ' + ticket.sn)
+        self.assertEqual(WfService.get_ticket_search_document(Ticket(title='a', sn='b', ticket_data={
+            'reason': '感冒', 'days': 3, 'tags': ['急', 1]})), 'a b 感冒 急')
+
+
+class TicketFieldFilterTest(WfTestCase):
+    """
+    field__<key>__<op>按类型化字段值过滤
+    """
+
+    def filter(self, query):
+        return self.call('list', self.admin, method='get', query='?category=all&page=1&' + query)
+
+    def ids(self, query):
+        ret = self.filter(query)
+        self.assertEqual(ret['code'], 200, ret['msg'])
+        return {i['id'] for i in ret['data']['results']}
+
+    def test_lookups(self):
+        short, long = self.create_ticket(days=1), self.create_ticket(days=10)
+        self.assertEqual(self.ids('field__days=10'), {long.pk})
+        self.assertEqual(self.ids('field__days__gte=2'), {long.pk})
+        self.assertEqual(self.ids('field__days__lt=2'), {short.pk})
+        self.assertEqual(self.ids('field__days__in=1,10'), {short.pk, long.pk})
+        self.assertEqual(self.ids('workflow={}&field__days__lte=10'.format(self.workflow.id)), {short.pk, long.pk})
+
+    def test_invalid(self):
+        self.create_ticket()
+        self.assertEqual(self.filter('field__days__regex=1')['code'], 400)
+        self.assertEqual(self.filter('field__nothing=1')['code'], 400)
+        self.assertEqual(self.filter('field__days=abc')['code'], 400)
+        self.assertEqual(self.filter('field__days__contains=1')['code'], 400)
+
+    def test_values_follow_ticket_data(self):
+        ticket = self.create_ticket(days=1)
+        ret = self.call('handle', self.u1, pk=ticket.id, data={
+            'transition': self.agree.id, 'ticket_data': {'days': 5}, 'suggestion': ''})
+        self.assertEqual(ret['code'], 200, ret['msg'])
+        self.assertEqual(list(ticket.field_values.values_list('field_key', 'value_int')), [('days', 5)])
+        self.assertEqual(self.ids('field__days=5'), {ticket.pk})
+
+
+class WorkflowAnalyticsTest(WfTestCase):
+    """
+    工作流统计: 流转日志写入后增量汇总, 仅可配置工作流的用户可查看
+    """
+
+    def analytics(self, user):
+        request = APIRequestFactory().get('/api/wf/workflow/{}/analytics/'.format(self.workflow.id))
+        force_authenticate(request, user=user)
+        response = as_view(WorkflowViewSet, 'get', 'analytics', detail=True)(request, pk=self.workflow.id)
+        response.render()
+        return json.loads(response.content)
+
+    def test_rollups(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.finish_ticket()
+        ret = self.analytics(self.admin)
+        self.assertEqual(ret['code'], 200, ret['msg'])
+        self.assertEqual(ret['data']['cycle_time']['count'], 1)
+        self.assertEqual({i['user'] for i in ret['data']['approvers']}, {self.admin.id, self.u1.id, self.u2.id})
+        self.assertEqual({i['state'] for i in ret['data']['states']}, {self.start.id, self.vote.id})
+
+    def test_rebuild_matches_incremental(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.finish_ticket()
+            self.create_ticket()
+        rows = lambda model: sorted(model.objects.values_list('count', 'total_seconds'))
+        before = [rows(i) for i in (StateDwellRollup, ApproverRollup, CycleTimeRollup)]
+        rebuild_rollups(self.workflow.id)
+        self.assertEqual([rows(i) for i in (StateDwellRollup, ApproverRollup, CycleTimeRollup)], before)
+
+    def test_permission(self):
+        self.assertEqual(self.analytics(self.u1)['code'], 403)
+        self.role.perms.add(Permission.objects.create(name='编辑工作流', method='workflow_update'))
+        cache.clear()  # 权限列表缓存
+        self.assertEqual(self.analytics(self.u1)['code'], 200)
+
+
+class TicketEventTest(WfTestCase):
+    """
+    工单事件流: 按提交顺序分配的游标增量拉取, 长轮询仅ASGI提供
+    """
+
+    def events(self, user, **params):
+        request = APIRequestFactory().get('/api/wf/ticket_event/', params)
+        force_authenticate(request, user=user)
+        response = TicketEventView.as_view()(request)
+        response.render()
+        return json.loads(response.content)
+
+    def wait(self, user, **params):
+        request = AsyncRequestFactory().get('/api/wf/ticket_event/wait/', params,
+                                            headers={'Authorization': 'Bearer {}'.format(AccessToken.for_user(user))})
+        return json.loads(async_to_sync(ticket_event_wait)(request).content)
+
+    def test_feed(self):
+        ticket = self.create_ticket()
+        self.handle(self.u1, ticket, self.agree)
+        ret = self.events(self.admin, limit=1)
+        self.assertEqual(ret['code'], 200, ret['msg'])
+        self.assertTrue(ret['data']['has_more'])
+        self.assertEqual([i['event_type'] for i in ret['data']['events']], [TicketEvent.EVENT_CREATE])
+        ret = self.events(self.admin, after=ret['data']['cursor'])['data']
+        self.assertFalse(ret['has_more'])
+        self.assertEqual([i['event_type'] for i in ret['events']], [TicketEvent.EVENT_HANDLE])
+        self.assertEqual(self.events(self.admin, after=ret['cursor'])['data']['events'], [])
+        self.assertEqual(self.events(self.u1)['code'], 403)
+
+    def test_late_commit_not_skipped(self):
+        """
+        id较小的事件晚于游标提交, 仍按提交顺序分到更大的游标
+        """
+        ticket = self.create_ticket()
+        last = TicketEvent.objects.latest('id').id
+        event = TicketEvent.objects.get(ticket=ticket)
+        event.pk, event.seq = last + 10, None
+        event.save()
+        cursor = self.events(self.admin)['data']['cursor']
+        event.pk = last + 5  # 先写入、后提交的事务
+        event.save()
+        ret = self.events(self.admin, after=cursor)['data']
+        self.assertEqual([i['id'] for i in ret['events']], [last + 5])
+        self.assertGreater(ret['cursor'], cursor)
+
+    def test_wait_requires_asgi(self):
+        request = RequestFactory().get('/api/wf/ticket_event/wait/', {'wait': 1})
+        with self.assertRaises(Http404):
+            async_to_sync(ticket_event_wait)(request)
+
+    def test_wait(self):
+        self.create_ticket()
+        ret = self.wait(self.admin, wait=1)
+        self.assertEqual(ret['code'], 200, ret['msg'])
+        self.assertEqual(len(ret['data']['events']), 1)
+        ret = self.wait(self.admin, after=ret['data']['cursor'], wait=0.6)
+        self.assertEqual(ret['data']['events'], [])
+        self.assertEqual(self.wait(self.u1)['code'], 403)
+        self.assertEqual(self.wait(self.admin, limit='x')['code'], 400)
+
+
+class StreamTicketTest(WfTestCase):
+    """
+    待办推送连接凭证: 一次性使用
+    """
+
+    def test_issue_and_consume(self):
+        ret = self.call('stream_ticket', self.u1)
+        self.assertEqual(ret['code'], 200, ret['msg'])
+        ticket = ret['data']['ticket']
+        self.assertEqual(consume_stream_ticket(ticket), self.u1.id)
+        self.assertIsNone(consume_stream_ticket(ticket))
+        self.assertIsNone(consume_stream_ticket('invalid'))
+
+    def test_stream_requires_asgi(self):
+        request = RequestFactory().get('/api/wf/duty_stream/', {'ticket': issue_stream_ticket(self.u1.id)})
+        with self.assertRaises(Http404):
+            async_to_sync(duty_stream)(request)
+
+
+class DutyStreamTest(WfTestMixin, TransactionTestCase):
+    """
+    待办推送(ASGI): 以一次性凭证建立连接, 连接后先推送当前待办数
+    连接期间会关闭数据库连接, 不能在TestCase的事务中执行
+    """
+
+    def setUp(self):
+        self.create_workflow()
+
+    def stream(self, ticket):
+        request = AsyncRequestFactory().get('/api/wf/duty_stream/', {'ticket': ticket})
+        return async_to_sync(duty_stream)(request)
+
+    def read(self, response, count):
+        async def read():
+            chunks = []
+            iterator = response.streaming_content.__aiter__()
+            while len(chunks) < count:
+                chunks.append((await iterator.__anext__()).decode())
+            await iterator.aclose()
+            return chunks
+        return async_to_sync(read)()
+
+    def test_stream_ticket(self):
+        stream_ticket = issue_stream_ticket(self.u1.id)
+        response = self.stream(stream_ticket)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(self.read(response, 1), ['retry: 3000\n\n'])
+        self.assertEqual(self.stream(stream_ticket).status_code, 401)  # 凭证已使用
+        self.assertEqual(self.stream('').status_code, 401)
+
+    @skipUnlessDBFeature('supports_json_field_contains')
+    def test_stream_duty(self):
+        self.create_ticket()
+        chunks = self.read(self.stream(issue_stream_ticket(self.u1.id)), 2)
+        self.assertTrue(chunks[1].startswith('event: duty\n'))
+        self.assertEqual(json.loads(chunks[1].split('data: ', 1)[1])['total_count'], 1)
+
+
+class TicketCountCacheTest(WfTestCase):
+    """
+    分页总数缓存按模型版本号失效: 不触发信号的写入(update/软删除/批量归档)及其他进程的写入也使缓存失效
+    """
+
+    def setUp(self):
+        cache.clear()
+
+    def test_save_ticket(self):
+        ticket = self.create_ticket()
+        self.assertEqual(get_count(Ticket.objects.filter(state=self.vote)), (1, False))
+        with self.assertNumQueries(1):  # 仅查询版本号
+            self.assertEqual(get_count(Ticket.objects.filter(state=self.vote)), (1, False))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.handle(self.u1, ticket, self.agree)
+            self.handle(self.u2, ticket, self.agree)  # save_ticket以update写入
+        self.assertEqual(get_count(Ticket.objects.filter(state=self.vote)), (0, False))
+
+    def test_soft_delete(self):
+        ticket = self.create_ticket()
+        self.assertEqual(get_count(Ticket.objects.all()), (1, False))
+        with self.captureOnCommitCallbacks(execute=True):
+            Ticket.objects.filter(pk=ticket.pk).delete()
+        self.assertEqual(get_count(Ticket.objects.all()), (0, False))
+
+    def test_archive(self):
+        self.finish_ticket()
+        self.assertEqual(get_count(TicketArchive.objects.all()), (0, False))
+        with self.captureOnCommitCallbacks(execute=True):
+            WfService.archive_finished_tickets(days=-1)
+        self.assertEqual(get_count(TicketArchive.objects.all()), (1, False))
+
+    def test_bump_after_commit(self):
+        """
+        提交前读到的旧总数缓存在旧版本号下, 提交后递增版本号即不再使用
+        """
+        ticket = self.create_ticket()
+        with self.captureOnCommitCallbacks(execute=True):
+            Ticket.objects.filter(pk=ticket.pk).delete()
+            with mock.patch.object(QuerySet, 'count', return_value=1):
+                self.assertEqual(get_count(Ticket.objects.all()), (1, False))
+        self.assertEqual(get_count(Ticket.objects.all()), (0, False))
+
+    def test_other_process_write(self):
+        """
+        版本号存于数据库, 进程内存缓存也能看到其他进程的写入
+        """
+        ticket = self.create_ticket()
+        self.assertEqual(get_count(Ticket.objects.all()), (1, False))
+        QuerySet(Ticket).filter(pk=ticket.pk).update(is_deleted=True)
+        bump_model_version('wf.Ticket')  # 其他进程提交后递增
+        self.assertEqual(get_count(Ticket.objects.all()), (0, False))
+
+    def test_untracked_model(self):
+        # 未登记版本号的模型无法判断何时失效, 不缓存
+        with mock.patch.object(QuerySet, 'count', return_value=5) as count:
+            get_count(TicketEvent.objects.all())
+            get_count(TicketEvent.objects.all())
+        self.assertEqual(count.call_count, 2)
+
+    @mock.patch('utils.pagination.estimate_count')
+    def test_estimate_large_table_only(self, estimate):
+        self.create_ticket()
+        # 主表较小时只估算一次主表(按缓存秒数缓存), 之后直接COUNT
+        estimate.return_value = 10
+        with self.settings(COUNT_ESTIMATE_THRESHOLD=100):
+            self.assertEqual(get_count(Ticket.objects.all()), (1, False))
+            self.assertEqual(get_count(Ticket.objects.filter(state=self.vote)), (1, False))
+        self.assertEqual(estimate.call_count, 1)
+        cache.clear()
+        estimate.reset_mock()
+        estimate.return_value = 1000
+        with self.settings(COUNT_ESTIMATE_THRESHOLD=100):
+            # 无过滤条件时直接使用主表估算
+            self.assertEqual(get_count(Ticket.all_objects.all()), (1000, True))
+            self.assertEqual(estimate.call_count, 1)
+            self.assertEqual(get_count(Ticket.objects.filter(state=self.vote)), (1000, True))
+            self.assertEqual(estimate.call_count, 2)
+
+
+class TicketConcurrencyTest(WfTestCase):
+    """
+    工单变更的乐观锁: 基于同一版本的两个冲突操作, 只有一个成功, 另一个返回409
+    """
+
+    def if_match(self, ticket):
+        return {'HTTP_IF_MATCH': '"{}"'.format(ticket.version)}
+
+    def test_vote_then_retreat_conflict(self):
+        ticket = self.create_ticket()
+        ret = self.handle(self.u1, ticket, self.agree, headers=self.if_match(ticket))
+        self.assertEqual(ret['code'], 200, ret['msg'])
+        ret = self.call('retreat', self.admin, pk=ticket.id, headers=self.if_match(ticket))
+        self.assertEqual(ret['code'], 409)
+        ticket.refresh_from_db()
+        self.assertEqual(ticket.state, self.vote)
+        self.assertEqual(ticket.participant, [self.u2.id])
+
+    def test_retreat_then_vote_conflict(self):
+        ticket = self.create_ticket()
+        ret = self.call('retreat', self.admin, pk=ticket.id, headers=self.if_match(ticket))
+        self.assertEqual(ret['code'], 200, ret['msg'])
+        ret = self.handle(self.u1, ticket, self.agree, headers=self.if_match(ticket))
+        self.assertEqual(ret['code'], 409)
+        ticket.refresh_from_db()
+        # 撤回未被会签覆盖
+        self.assertEqual(ticket.state, self.start)
+        self.assertEqual(ticket.participant, self.admin.id)
+        self.assertEqual(ticket.act_state, Ticket.TICKET_ACT_STATE_RETREAT)
+
+    def test_two_handles_same_version(self):
+        ticket = self.create_ticket()
+        headers = self.if_match(ticket)
+        results = [self.handle(self.u1, ticket, self.agree, headers=headers),
+                   self.handle(self.u2, ticket, self.agree, headers=headers)]
+        self.assertEqual(sorted(i['code'] for i in results), [200, 409])
+
+    def test_stale_ticket_in_service(self):
+        """
+        不经过接口加锁读取时, 基于旧数据的处理被版本号拒绝
+        """
+        ticket = self.create_ticket()
+        stale = Ticket.objects.get(pk=ticket.pk)
+        self.call('retreat', self.admin, pk=ticket.id)
+        with self.assertRaises(TicketVersionConflict):
+            WfService.handle_ticket(stale, self.agree, dict(stale.ticket_data), handler=self.u1)
+
+    def test_handles_without_if_match(self):
+        """
+        未携带If-Match时基于读取时的版本处理, 两人先后会签均成功
+        """
+        ticket = self.create_ticket()
+        self.assertEqual(self.handle(self.u1, ticket, self.agree)['code'], 200)
+        ret = self.handle(self.u2, ticket, self.agree)
+        self.assertEqual(ret['code'], 200, ret['msg'])
+        ticket.refresh_from_db()
+        self.assertEqual(ticket.act_state, Ticket.TICKET_ACT_STATE_FINISH)
+        self.assertEqual(ticket.version, 3)
+
+
+@skipIf(connection.vendor == 'sqlite', 'sqlite不支持并发写入')
+class TicketRaceTest(WfTestMixin, TransactionTestCase):
+    """
+    真实并发: 不加行锁, 基于旧版本的变更由版本号条件拒绝(409), 不会覆盖先提交的一方; 会签处理人互不冲突
+    """
+
+    def setUp(self):
+        self.create_workflow()
+
+    def run_concurrently(self, *funcs):
+        results, barrier = [None] * len(funcs), threading.Barrier(len(funcs))
+
+        def run(i, func):
+            try:
+                barrier.wait()
+                results[i] = func()
+            finally:
+                connection.close()
+        threads = [threading.Thread(target=run, args=(i, func)) for i, func in enumerate(funcs)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_retreat_and_vote(self):
+        ticket = self.create_ticket()
+        retreat, vote = self.run_concurrently(
+            lambda: self.call('retreat', self.admin, pk=ticket.id),
+            lambda: self.handle(self.u1, ticket, self.agree))
+        self.assertIn(200, (retreat['code'], vote['code']))
+        ticket.refresh_from_db()
+        if retreat['code'] == 200:
+            self.assertEqual((ticket.state, ticket.participant), (self.start, self.admin.id))
+            # 会签先提交时撤回读到其结果后执行(版本+2), 否则会签被拒绝(版本+1)
+            self.assertEqual(ticket.version, 3 if vote['code'] == 200 else 2)
+        else:
+            self.assertEqual(retreat['code'], 409)
+            self.assertEqual((ticket.state, ticket.participant, ticket.version), (self.vote, [self.u2.id], 2))
+
+    def test_two_votes(self):
+        ticket = self.create_ticket()
+        results = self.run_concurrently(lambda: self.handle(self.u1, ticket, self.agree),
+                                        lambda: self.handle(self.u2, ticket, self.agree))
+        self.assertEqual([i['code'] for i in results], [200, 200], results)
+        ticket.refresh_from_db()
+        self.assertEqual(ticket.act_state, Ticket.TICKET_ACT_STATE_FINISH)
+
+
+class BenchmarkTest(TransactionTestCase):
+    """
+    压测命令: 连续的全部处理状态(成员相同)均能处理至结束
+    """
+
+    def test_all_must_handle(self):
+        fd, path = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        call_command('wf_benchmark', users=6, depth=1, states=2, role_size=3, distribute='4', tickets=3,
+                     concurrency=1, output=path)
+        with open(path, encoding='utf-8') as f:
+            report = json.load(f)
+        self.assertEqual(report['tickets'], {'finished': 3})
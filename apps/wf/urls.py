@@ -1,6 +1,6 @@
 from django.db.models import base
 from rest_framework import urlpatterns
-from apps.wf.views import CustomFieldViewSet, FromCodeListView, StateViewSet, TicketFlowViewSet, TicketViewSet, TransitionViewSet, WorkflowViewSet
+from apps.wf.views import duty_stream, CustomFieldViewSet, FromCodeListView, StateViewSet, TicketEventView, ticket_event_wait, TicketFlowViewSet, TicketViewSet, TransitionViewSet, WorkflowViewSet
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 
@@ -13,6 +13,9 @@ router.register('ticket', TicketViewSet, basename='wf_ticket')
 router.register('ticketflow', TicketFlowViewSet, basename='wf_ticketflow')
 urlpatterns = [
     path('participant_from_code', FromCodeListView.as_view()),
+    path('ticket_event/', TicketEventView.as_view()),
+    path('ticket_event/wait/', ticket_event_wait),
+    path('duty_stream/', duty_stream),
     path('', include(router.urls)),
 ]
 
@@ -1,24 +1,41 @@
+import asyncio
+import json
+from asgiref.sync import sync_to_async
+from datetime import timedelta
 from django.utils import timezone
+from django.utils.dateparse import parse_date
 from django.db import transaction
 from django.db.models import query
 from rest_framework.utils import serializer_helpers
 from rest_framework.views import APIView
 from apps.system.models import User
-from apps.wf.filters import TicketFilterSet
+from apps.wf.filters import TicketArchiveFilterSet, TicketFilterSet
 from django.core.exceptions import AppRegistryNotReady
 from rest_framework.response import Response
 from rest_framework import serializers
 from rest_framework.mixins import CreateModelMixin, DestroyModelMixin, ListModelMixin, RetrieveModelMixin, UpdateModelMixin
-from apps.wf.serializers import CustomFieldCreateUpdateSerializer, CustomFieldSerializer, StateSerializer, TicketAddNodeEndSerializer, TicketAddNodeSerializer, TicketCloseSerializer, TicketCreateSerializer, TicketDestorySerializer, TicketFlowSerializer, TicketFlowSimpleSerializer, TicketHandleSerializer, TicketRetreatSerializer, TicketSerializer, TransitionSerializer, WorkflowSerializer, TicketListSerializer, TicketDetailSerializer
+from apps.wf.serializers import CustomFieldCreateUpdateSerializer, CustomFieldSerializer, StateSerializer, TicketAddNodeEndSerializer, TicketAddNodeSerializer, TicketCloseSerializer, TicketCreateSerializer, TicketDestorySerializer, TicketFlowSerializer, TicketFlowSimpleSerializer, TicketHandleSerializer, TicketRetreatSerializer, TicketSerializer, TransitionSerializer, WorkflowSerializer, TicketListSerializer, TicketDetailSerializer, TicketArchiveListSerializer, TicketArchiveDetailSerializer
 from django.shortcuts import get_object_or_404, render
 from rest_framework.viewsets import GenericViewSet, ModelViewSet
 from rest_framework.decorators import action, api_view
-from apps.wf.models import CustomField, Ticket, Workflow, State, Transition, TicketFlow
-from apps.system.mixins import CreateUpdateCustomMixin, CreateUpdateModelAMixin, OptimizationMixin
+from apps.wf.models import CustomField, Ticket, TicketArchive, TicketEvent, Workflow, State, Transition, TicketFlow
+from apps.system.mixins import ConditionalGetMixin, CreateUpdateCustomMixin, CreateUpdateModelAMixin, ExportMixin, OptimizationMixin
 from apps.wf.services import WfService
-from rest_framework.exceptions import APIException, PermissionDenied
+from apps.wf.analytics import get_workflow_analytics
+from apps.wf.exceptions import TicketVersionConflict
+from rest_framework.exceptions import APIException, ParseError, PermissionDenied
 from rest_framework import status
-from django.db.models import Count
+from django.db.models import BooleanField, Count, Value
+from django.db import connection
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from apps.system.permission import get_permission_list
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from apps.wf.push import STREAM_TICKET_SECONDS, consume_stream_ticket, duty_hub, issue_stream_ticket
+from rest_framework.filters import OrderingFilter, SearchFilter
 from .scripts import GetParticipants, HandleScripts
 
 
@@ -30,7 +47,7 @@ class FromCodeListView(APIView):
         """
         return Response(GetParticipants.all_funcs)
 
-class WorkflowViewSet(CreateUpdateModelAMixin, ModelViewSet):
+class WorkflowViewSet(ConditionalGetMixin, CreateUpdateModelAMixin, ModelViewSet):
     perms_map = {'get': '*', 'post': 'workflow_create',
                  'put': 'workflow_update', 'delete': 'workflow_delete'}
     queryset = Workflow.objects.all()
@@ -39,6 +56,23 @@ class WorkflowViewSet(CreateUpdateModelAMixin, ModelViewSet):
     filterset_fields = []
     ordering_fields = ['create_time']
     ordering = ['-create_time']    
+    etag_models = [Workflow, State, Transition, CustomField]
+    etag_actions = ['list', 'retrieve', 'states', 'transitions', 'customfields', 'init']
+
+    @action(methods=['get'], detail=True, perms_map={'get':'workflow_update'}, pagination_class=None)
+    def analytics(self, request, pk=None):
+        """
+        工作流统计: 完成周期、状态停留时长分位数及处理人处理量, 只读汇总表
+        含各处理人的处理量及耗时, 仅可配置工作流的用户可查看
+        ?start=&end= 日期范围, 默认最近30天
+        """
+        wf = self.get_object()
+        try:
+            end = parse_date(request.query_params.get('end', '')) or timezone.localdate()
+            start = parse_date(request.query_params.get('start', '')) or end - timedelta(days=29)
+        except ValueError:
+            raise ParseError('日期格式错误')
+        return Response(get_workflow_analytics(wf, start, end))
 
     @action(methods=['get'], detail=True, perms_map={'get':'workflow_update'}, pagination_class=None, serializer_class=StateSerializer)
     def states(self, request, pk=None):
@@ -119,13 +153,17 @@ class CustomFieldViewSet(CreateModelMixin, UpdateModelMixin, RetrieveModelMixin,
             return CustomFieldCreateUpdateSerializer
         return super().get_serializer_class()
 
-class TicketViewSet(OptimizationMixin, CreateUpdateCustomMixin, CreateModelMixin, ListModelMixin, RetrieveModelMixin, GenericViewSet):
+class TicketViewSet(OptimizationMixin, CreateUpdateCustomMixin, ExportMixin, CreateModelMixin, ListModelMixin, RetrieveModelMixin, GenericViewSet):
     perms_map = {'get':'*', 'post':'ticket_create'}
     queryset = Ticket.objects.all()
     serializer_class = TicketSerializer
     search_fields = ['title']
     filterset_class = TicketFilterSet
     ordering = ['-create_time']
+    cursor_pagination = True
+    export_fields = [('sn', '流水号'), ('title', '标题'), ('workflow__name', '工作流'), ('state__name', '当前状态'),
+                     ('act_state', '进行状态'), ('create_by__name', '创建人'), ('belong_dept__name', '所属部门'),
+                     ('ticket_data', '工单数据'), ('create_time', '创建时间'), ('update_time', '更新时间')]
 
     def get_serializer_class(self):
         if self.action == 'create':
@@ -143,7 +181,84 @@ class TicketViewSet(OptimizationMixin, CreateUpdateCustomMixin, CreateModelMixin
     def filter_queryset(self, queryset):
         if not self.detail and not self.request.query_params.get('category', None):
             raise APIException('请指定查询分类')
-        return super().filter_queryset(queryset)
+        queryset = super().filter_queryset(queryset)
+        params = self.request.query_params
+        if not self.detail and params.get('q', None) and not params.get('ordering', None)\
+                and 'search_rank' in queryset.query.annotations:
+            queryset = queryset.order_by('-search_rank', '-create_time')
+        return queryset
+
+    def get_ticket_for_update(self):
+        """
+        获取待变更的工单, 若请求头携带If-Match则校验版本号
+        不加锁: 并发的变更由save_ticket的版本号条件拒绝并返回409, 客户端重新获取后重试
+        """
+        ticket = self.get_object()
+        if_match = self.request.META.get('HTTP_IF_MATCH', '').strip()
+        if if_match:
+            if if_match.startswith('W/'):
+                if_match = if_match[2:]
+            if_match = if_match.strip('"')
+            if if_match != '*' and if_match != str(ticket.version):
+                raise TicketVersionConflict()
+        return ticket
+
+    def include_archive(self):
+        """
+        仅在查询全部或指定创建时间范围时才包含归档工单
+        """
+        params = self.request.query_params
+        return params.get('category', None) == 'all' or bool(params.get('start_create', None)) \
+            or bool(params.get('end_create', None))
+
+    def get_archive_ordering(self):
+        ordering = OrderingFilter().get_ordering(self.request, self.get_queryset(), self) or []
+        if all(i.lstrip('-') in ('id', 'create_time', 'update_time') for i in ordering):
+            return list(ordering) + ['-id']
+        return ['-create_time', '-id']
+
+    def list(self, request, *args, **kwargs):
+        if not self.include_archive():
+            return super().list(request, *args, **kwargs)
+        # 合并在线工单与归档工单, 分页后再分别取出本页数据
+        fields = ['id', 'create_time', 'update_time', 'archived']
+        hot = self.filter_queryset(self.get_queryset()).order_by()\
+            .annotate(archived=Value(False, output_field=BooleanField())).values(*fields)
+        archive = TicketArchive.objects.filter(is_deleted=False)
+        archive = TicketArchiveFilterSet(request.query_params, queryset=archive, request=request).qs
+        archive = SearchFilter().filter_queryset(request, archive, self).order_by()\
+            .annotate(archived=Value(True, output_field=BooleanField())).values(*fields)
+        queryset = hot.union(archive, all=True).order_by(*self.get_archive_ordering())
+        page = self.paginate_queryset(queryset)
+        rows = list(queryset) if page is None else page
+        hot_objs = TicketListSerializer.setup_eager_loading(
+            Ticket.objects.filter(id__in=[i['id'] for i in rows if not i['archived']])).in_bulk()
+        archive_objs = TicketArchiveListSerializer.setup_eager_loading(
+            TicketArchive.objects.filter(id__in=[i['id'] for i in rows if i['archived']])).in_bulk()
+        data = []
+        for i in rows:
+            if i['archived']:
+                item = TicketArchiveListSerializer(instance=archive_objs[i['id']]).data
+            else:
+                item = TicketListSerializer(instance=hot_objs[i['id']]).data
+            item['archived'] = i['archived']
+            data.append(item)
+        if page is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            response = super().retrieve(request, *args, **kwargs)
+        except Http404:
+            if not self.include_archive():
+                raise
+            instance = get_object_or_404(TicketArchiveDetailSerializer.setup_eager_loading(
+                TicketArchive.objects.filter(is_deleted=False)), pk=kwargs['pk'])
+            self.check_object_permissions(request, instance)
+            return Response(TicketArchiveDetailSerializer(instance=instance).data)
+        response['ETag'] = '"{}"'.format(response.data['version'])
+        return response
 
     @transaction.atomic
     def create(self, request, *args, **kwargs):
@@ -194,12 +309,14 @@ class TicketViewSet(OptimizationMixin, CreateUpdateCustomMixin, CreateModelMixin
         """
         工单待办聚合
         """
-        ret = {}
-        queryset = Ticket.objects.filter(participant__contains=request.user.id, is_deleted=False)\
-            .exclude(act_state__in=[Ticket.TICKET_ACT_STATE_FINISH, Ticket.TICKET_ACT_STATE_CLOSED])
-        ret['total_count'] = queryset.count()
-        ret['details'] = list(queryset.values('workflow', 'workflow__name').annotate(count = Count('workflow')))
-        return Response(ret)
+        return Response(WfService.get_duty_agg(request.user.id))
+
+    @action(methods=['post'], detail=False, perms_map={'post':'*'})
+    def stream_ticket(self, request, pk=None):
+        """
+        签发待办推送(duty_stream)的一次性连接凭证
+        """
+        return Response({'ticket': issue_stream_ticket(request.user.id), 'expires_in': STREAM_TICKET_SECONDS})
 
     @action(methods=['post'], detail=True, perms_map={'post':'*'})
     @transaction.atomic
@@ -207,11 +324,12 @@ class TicketViewSet(OptimizationMixin, CreateUpdateCustomMixin, CreateModelMixin
         """
         处理工单
         """
-        ticket = self.get_object()
+        ticket = self.get_ticket_for_update()
         serializer = TicketHandleSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         vdata = serializer.validated_data
-        new_ticket_data = ticket.ticket_data
+        # 复制一份, 以便与原数据比较是否有字段被修改
+        new_ticket_data = dict(ticket.ticket_data)
         new_ticket_data.update(**vdata['ticket_data'])
 
         ticket = WfService.handle_ticket(ticket=ticket, transition=vdata['transition'], 
@@ -248,16 +366,19 @@ class TicketViewSet(OptimizationMixin, CreateUpdateCustomMixin, CreateModelMixin
         return Response(TransitionSerializer(instance=transitions, many=True).data)
 
     @action(methods=['post'], detail=True, perms_map={'post':'*'})
+    @transaction.atomic
     def accpet(self, request, pk=None):
         """
         接单,当工单当前处理人实际为多个人时(角色、部门、多人都有可能， 注意角色和部门有可能实际只有一人)
         """
-        ticket = self.get_object()
+        ticket = self.get_ticket_for_update()
         result = WfService.ticket_handle_permission_check(ticket, request.user)
         if result.get('need_accept', False):
+            old_participant = ticket.participant
             ticket.participant_type = State.PARTICIPANT_TYPE_PERSONAL
             ticket.participant = request.user.id
-            ticket.save()
+            WfService.save_ticket(ticket, ['participant_type', 'participant'])
+            WfService.record_event(ticket, TicketEvent.EVENT_ACCEPT, ticket.state, request.user, old_participant)
             # 接单日志
             # 更新工单流转记录
             TicketFlow.objects.create(ticket=ticket, state=ticket.state, ticket_data=WfService.get_ticket_all_field_value(ticket),
@@ -268,61 +389,73 @@ class TicketViewSet(OptimizationMixin, CreateUpdateCustomMixin, CreateModelMixin
             raise APIException('无需接单')
     
     @action(methods=['post'], detail=True, perms_map={'post':'*'})
+    @transaction.atomic
     def retreat(self, request, pk=None):
         """
         撤回工单，允许创建人在指定状态撤回工单至初始状态，状态设置中开启允许撤回
         """
-        ticket = self.get_object()
+        ticket = self.get_ticket_for_update()
         if ticket.create_by != request.user:
             raise APIException('非创建人不可撤回')
         if not ticket.state.enable_retreat:
             raise APIException('该状态不可撤回')
+        source_state, old_participant = ticket.state, ticket.participant
         start_state = WfService.get_workflow_start_state(ticket.workflow)
         ticket.state = start_state
         ticket.participant_type = State.PARTICIPANT_TYPE_PERSONAL
         ticket.participant = request.user.id
         ticket.act_state = Ticket.TICKET_ACT_STATE_RETREAT
-        ticket.save()
+        WfService.save_ticket(ticket, ['state', 'participant_type', 'participant', 'act_state'])
         # 更新流转记录
         suggestion = request.data.get('suggestion', '') # 撤回原因
+        WfService.record_event(ticket, TicketEvent.EVENT_RETREAT, source_state, request.user, old_participant,
+            suggestion=suggestion)
         TicketFlow.objects.create(ticket=ticket, state=ticket.state, ticket_data=WfService.get_ticket_all_field_value(ticket),
                         suggestion=suggestion, participant_type=State.PARTICIPANT_TYPE_PERSONAL, intervene_type=Transition.TRANSITION_INTERVENE_TYPE_RETREAT,
                         participant=request.user, transition=None)
         return Response()
     
     @action(methods=['post'], detail=True, perms_map={'post':'*'}, serializer_class=TicketAddNodeSerializer)
+    @transaction.atomic
     def add_node(self, request, pk=None):
         """
         加签
         """
-        ticket = self.get_object()
+        ticket = self.get_ticket_for_update()
         data = request.data
         add_user = User.objects.get(pk=data['toadd_user'])
+        old_participant = ticket.participant
         ticket.participant_type = State.PARTICIPANT_TYPE_PERSONAL
         ticket.participant = add_user.id
         ticket.in_add_node = True
         ticket.add_node_man = request.user
-        ticket.save()
+        WfService.save_ticket(ticket, ['participant_type', 'participant', 'in_add_node', 'add_node_man'])
         # 更新流转记录
         suggestion = request.data.get('suggestion', '') # 加签说明
+        WfService.record_event(ticket, TicketEvent.EVENT_ADD_NODE, ticket.state, request.user, old_participant,
+            suggestion=suggestion)
         TicketFlow.objects.create(ticket=ticket, state=ticket.state, ticket_data=WfService.get_ticket_all_field_value(ticket),
                         suggestion=suggestion, participant_type=State.PARTICIPANT_TYPE_PERSONAL, intervene_type=Transition.TRANSITION_INTERVENE_TYPE_ADD_NODE,
                         participant=request.user, transition=None)
         return Response()
 
     @action(methods=['post'], detail=True, perms_map={'post':'*'}, serializer_class=TicketAddNodeEndSerializer)
+    @transaction.atomic
     def add_node_end(self, request, pk=None):
         """
         加签完成
         """
-        ticket = self.get_object()
+        ticket = self.get_ticket_for_update()
+        old_participant = ticket.participant
         ticket.participant_type = State.PARTICIPANT_TYPE_PERSONAL
         ticket.in_add_node = False
         ticket.participant = ticket.add_node_man.id
         ticket.add_node_man = None
-        ticket.save()
+        WfService.save_ticket(ticket, ['participant_type', 'in_add_node', 'participant', 'add_node_man'])
         # 更新流转记录
         suggestion = request.data.get('suggestion', '') # 加签意见
+        WfService.record_event(ticket, TicketEvent.EVENT_ADD_NODE_END, ticket.state, request.user, old_participant,
+            suggestion=suggestion)
         TicketFlow.objects.create(ticket=ticket, state=ticket.state, ticket_data=WfService.get_ticket_all_field_value(ticket),
                         suggestion=suggestion, participant_type=State.PARTICIPANT_TYPE_PERSONAL, intervene_type=Transition.TRANSITION_INTERVENE_TYPE_ADD_NODE_END,
                         participant=request.user, transition=None)
@@ -330,20 +463,24 @@ class TicketViewSet(OptimizationMixin, CreateUpdateCustomMixin, CreateModelMixin
     
 
     @action(methods=['post'], detail=True, perms_map={'post':'*'}, serializer_class=TicketCloseSerializer)
+    @transaction.atomic
     def close(self, request, pk=None):
         """
         关闭工单(创建人在初始状态)
         """
-        ticket = self.get_object()
+        ticket = self.get_ticket_for_update()
         if ticket.state.type == State.STATE_TYPE_START and ticket.create_by==request.user:
+            source_state, old_participant = ticket.state, ticket.participant
             end_state = WfService.get_workflow_end_state(ticket.workflow)
             ticket.state = end_state
             ticket.participant_type = 0
             ticket.participant = 0
             ticket.act_state = Ticket.TICKET_ACT_STATE_CLOSED
-            ticket.save()
+            WfService.save_ticket(ticket, ['state', 'participant_type', 'participant', 'act_state'])
             # 更新流转记录
             suggestion = request.data.get('suggestion', '') # 关闭原因
+            WfService.record_event(ticket, TicketEvent.EVENT_CLOSE, source_state, request.user, old_participant,
+                suggestion=suggestion)
             TicketFlow.objects.create(ticket=ticket, state=ticket.state, ticket_data=WfService.get_ticket_all_field_value(ticket),
                             suggestion=suggestion, participant_type=State.PARTICIPANT_TYPE_PERSONAL, intervene_type=Transition.TRANSITION_INTERVENE_TYPE_CLOSE,
                             participant=request.user, transition=None)
@@ -361,7 +498,7 @@ class TicketViewSet(OptimizationMixin, CreateUpdateCustomMixin, CreateModelMixin
 
 
 
-class TicketFlowViewSet(ListModelMixin, RetrieveModelMixin, GenericViewSet):
+class TicketFlowViewSet(ExportMixin, ListModelMixin, RetrieveModelMixin, GenericViewSet):
     """
     工单日志
     """
@@ -370,4 +507,145 @@ class TicketFlowViewSet(ListModelMixin, RetrieveModelMixin, GenericViewSet):
     serializer_class = TicketFlowSerializer
     search_fields = ['suggestion']
     filterset_fields = ['ticket']
-    ordering = ['-create_time']
\ No newline at end of file
+    ordering = ['-create_time']
+    cursor_pagination = True
+    export_fields = [('ticket__sn', '工单流水号'), ('ticket__title', '工单标题'), ('state__name', '状态'),
+                     ('transition__name', '操作'), ('intervene_type', '干预类型'), ('participant__name', '处理人'),
+                     ('participant_str', '其他处理人'), ('suggestion', '处理意见'), ('create_time', '处理时间')]
+
+
+def get_event_params(params):
+    """
+    事件流参数: after=游标(上次返回的cursor) &limit=条数(最多500) &wait=无新事件时等待秒数(最多30)
+    """
+    try:
+        after = int(params.get('after', 0))
+        limit = min(max(int(params.get('limit', 100)), 1), TicketEventView.max_limit)
+        wait = min(max(float(params.get('wait', 0)), 0), TicketEventView.max_wait)
+    except ValueError:
+        raise ParseError('参数格式错误')
+    return after, limit, wait
+
+
+def is_asgi(request):
+    return isinstance(getattr(request, '_request', request), ASGIRequest)
+
+
+class TicketEventView(APIView):
+    """
+    工单变更事件流, 按游标增量拉取, 无新事件时立即返回
+    ?after=游标(上次返回的cursor) &limit=条数(最多500)
+    长轮询(wait)见ticket_event_wait, 仅ASGI部署时提供, 避免同步worker线程被等待占用
+    """
+    perms_map = {'get':'ticket_event'}
+    max_limit = 500
+    max_wait = 30
+    poll_interval = 0.5
+
+    def get(self, request, format=None):
+        after, limit, _ = get_event_params(request.query_params)
+        return Response(WfService.get_events(after, limit))
+
+
+@sync_to_async
+def authenticate_event_request(request):
+    """
+    以Authorization请求头认证, 返回(user, 错误码)
+    """
+    try:
+        ret = JWTAuthentication().authenticate(request)
+    except (InvalidToken, AuthenticationFailed):
+        ret = None
+    if ret is None or not ret[0].is_active:
+        return None, 401
+    user = ret[0]
+    perms = cache.get(user.username + '__perms') or get_permission_list(user)
+    if 'admin' not in perms and TicketEventView.perms_map['get'] not in perms:
+        return None, 403
+    return user, None
+
+
+async def ticket_event_wait(request):
+    """
+    工单变更事件长轮询, 参数同TicketEventView, 无新事件时最多等待wait秒
+    等待期间不占用worker线程, 仅ASGI部署(SERVER_MODE=asgi)时提供
+    """
+    if not is_asgi(request):
+        raise Http404
+    try:
+        after, limit, wait = get_event_params(request.GET)
+    except ParseError as e:
+        return JsonResponse({'code': 400, 'data': None, 'msg': e.detail})
+    user, code = await authenticate_event_request(request)
+    if user is None:
+        return JsonResponse({'code': code, 'data': None, 'msg': '认证失败' if code == 401 else '无权限'})
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + wait
+    while True:
+        data = await sync_to_async(WfService.get_events)(after, limit)
+        if data['events'] or loop.time() >= deadline:
+            break
+        await asyncio.sleep(TicketEventView.poll_interval)
+    return JsonResponse({'code': 200, 'data': data, 'msg': ''}, json_dumps_params={'ensure_ascii': False})
+
+
+@sync_to_async
+def get_user_by_ticket(ticket):
+    user_id = consume_stream_ticket(ticket) if ticket else None
+    try:
+        return User.objects.filter(pk=user_id, is_active=True).first() if user_id else None
+    finally:
+        connection.close()
+
+
+@sync_to_async
+def get_duty_agg(user_id):
+    try:
+        return WfService.get_duty_agg(user_id)
+    finally:
+        # 长连接期间不占用数据库连接
+        connection.close()
+
+
+DUTY_STREAM_HEARTBEAT = 15
+DUTY_STREAM_REFRESH = 300
+DUTY_STREAM_MAX_AGE = 600
+
+
+async def duty_stream(request):
+    """
+    待办数推送(SSE), 仅ASGI部署(SERVER_MODE=asgi)时提供, 避免长连接占用同步worker线程
+    EventSource无法设置请求头, 以?ticket=传递stream_ticket签发的一次性凭证, 不在URL中暴露access token;
+    连接到期后由客户端重新获取凭证并连接
+    """
+    if not is_asgi(request):
+        raise Http404
+    user = await get_user_by_ticket(request.GET.get('ticket', ''))
+    if user is None:
+        return JsonResponse({'code': 401, 'data': None, 'msg': '认证失败'}, status=401)
+
+    async def events():
+        loop = asyncio.get_running_loop()
+        queue = duty_hub.subscribe(user.id)
+        try:
+            yield 'retry: 3000\n\n'
+            started = last_sent = loop.time()
+            changed = True
+            while loop.time() - started < DUTY_STREAM_MAX_AGE:
+                if changed or loop.time() - last_sent >= DUTY_STREAM_REFRESH:
+                    data = await get_duty_agg(user.id)
+                    yield 'event: duty\ndata: {}\n\n'.format(json.dumps(data, ensure_ascii=False))
+                    last_sent = loop.time()
+                try:
+                    await asyncio.wait_for(queue.get(), timeout=DUTY_STREAM_HEARTBEAT)
+                    changed = True
+                except asyncio.TimeoutError:
+                    changed = False
+                    yield ': ping\n\n'
+        finally:
+            duty_hub.unsubscribe(user.id, queue)
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # 关闭nginx缓冲
+    return response
@@ -1,6 +1,8 @@
 import os
+import time
 
 from celery import Celery
+from celery.signals import task_postrun, task_prerun
 
 # set the default Django settings module for the 'celery' program.
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'server.settings')
@@ -17,6 +19,26 @@ app.config_from_object('django.conf:settings', namespace='CELERY')
 app.autodiscover_tasks()
 
 
+_task_started = {}
+
+
+@task_prerun.connect
+def record_task_start(task_id=None, **kwargs):
+    _task_started[task_id] = time.perf_counter()
+
+
+@task_postrun.connect
+def record_task_end(task_id=None, task=None, state=None, **kwargs):
+    # 失败的任务同样触发postrun(state为FAILURE); 与web进程共享PROMETHEUS_MULTIPROC_DIR时可统一采集
+    from apps.monitor.metrics import CELERY_TASK_LATENCY, CELERY_TASKS, update_db_connections
+    started = _task_started.pop(task_id, None)
+    name = getattr(task, 'name', 'unknown')
+    CELERY_TASKS.labels(name, state or 'UNKNOWN').inc()
+    if started is not None:
+        CELERY_TASK_LATENCY.labels(name).observe(time.perf_counter() - started)
+    update_db_connections()
+
+
 @app.task(bind=True)
 def debug_task(self):
     print(f'Request: {self.request!r}')
\ No newline at end of file
@@ -1,4 +1,5 @@
 # conf_e.py
+import copy
 import os
 from dotenv import load_dotenv
 
@@ -8,15 +9,31 @@ load_dotenv(override=True)
 DEBUG = os.environ.get('DJANGO_DEBUG'), # 是否開啟debug模式
 DATABASES = {
     "default": {
-        "ENGINE": "django.db.backends.mysql",
+        "ENGINE": "utils.db.mysql_pool",  # 带连接池的mysql引擎, 每个worker进程一个连接池
         'NAME': os.environ.get('MYSQL_DATABASE'), # MySQL 資料庫的名稱
         'USER': os.environ.get('MYSQL_USER'), # 使用者名稱
         # 'PASSWORD': os.environ.get('MYSQL_PASSWORD'), # 密碼
         'HOST': os.environ.get('DB_HOST', default='db'), # IP 地址
         'PORT': os.environ.get('DB_PORT', default='3306'), # 埠號(mysql為 3306)
+        # 连接池: 每进程最大连接数(gthread线程数以上), 连接最长使用秒数, 等待超时秒数, 取出前ping
+        'POOL': {
+            'SIZE': int(os.environ.get('DB_POOL_SIZE', 10)),
+            'MAX_LIFETIME': int(os.environ.get('DB_POOL_MAX_LIFETIME', 1800)),
+            'TIMEOUT': int(os.environ.get('DB_POOL_TIMEOUT', 10)),
+            'PRE_PING': True,
+        },
         "OPTIONS": {
             "sql_mode": "traditional",
             "charset": "utf8mb4"
         }
     }
-}
\ No newline at end of file
+}
+
+# 只读从库, 设置DB_REPLICA_HOST后启用(见settings.DATABASE_ROUTERS)
+if os.environ.get('DB_REPLICA_HOST'):
+    DATABASES['replica'] = copy.deepcopy(DATABASES['default'])
+    DATABASES['replica'].update({
+        'HOST': os.environ.get('DB_REPLICA_HOST'),
+        'PORT': os.environ.get('DB_REPLICA_PORT', default='3306'),
+        'TEST': {'MIRROR': 'default'},
+    })
@@ -0,0 +1,7 @@
+# gunicorn配置, 通过 -c server/gunicorn_conf.py 加载
+
+
+def child_exit(server, worker):
+    # worker退出后清理其Prometheus多进程指标中的实时值(如连接数)
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
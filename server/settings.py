@@ -10,7 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.0/ref/settings/
 """
 
-from datetime import datetime, timedelta
+from datetime import timedelta
 import os
 from dotenv import load_dotenv
 from . import conf_e
@@ -58,6 +58,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'apps.monitor.middleware.RequestIdMiddleware',
+    'apps.monitor.middleware.EndpointMetricsMiddleware',
+    'utils.db.router.ReplicaMiddleware',  # 在接口统计之内, 统计数据写入不影响读库选择
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -67,6 +70,7 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'simple_history.middleware.HistoryRequestMiddleware',
+    'apps.monitor.middleware.ProfilerMiddleware',
 ]
 
 ROOT_URLCONF = 'server.urls'
@@ -90,6 +94,10 @@ TEMPLATES = [
 # Database
 # https://docs.djangoproject.com/en/3.0/ref/settings/#databases
 DATABASES = conf_e.DATABASES
+# 读写分离: 配置了从库时, 安全方法请求读从库; 写入后REPLICA_PIN_SECONDS秒内该客户端仍读主库
+DATABASE_ROUTERS = ['utils.db.router.ReplicaRouter']
+REPLICA_DATABASE = 'replica'
+REPLICA_PIN_SECONDS = 5
 
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
@@ -198,6 +206,43 @@ AUTHENTICATION_BACKENDS = (
 # CELERY_ENABLE_UTC = True  # 启动时区设置
 # CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers:DatabaseScheduler'
 
+# 工单完成/关闭超过该天数后归档
+TICKET_ARCHIVE_DAYS = 180
+# 工单事件保留天数
+TICKET_EVENT_RETENTION_DAYS = 30
+# 软删除数据清理: 删除超过保留天数后归档(archive)或直接删除(delete), 按顺序处理的模型, 每批间隔秒数
+# 上线前删除的数据删除时间未知, 上线满保留天数后才开始清理(见apps.system.purge.get_tracked_since)
+SOFT_DELETE_RETENTION_DAYS = 90
+SOFT_DELETE_PURGE_MODE = 'archive'
+SOFT_DELETE_PURGE_MODELS = [
+    'wf.Ticket', 'wf.Transition', 'wf.CustomField', 'wf.State', 'wf.Workflow',
+    'system.Dict', 'system.Role', 'system.Organization', 'system.Permission',
+    'line_bot.LineMessage', 'line_bot.LineUser',
+]
+SOFT_DELETE_PURGE_SLEEP = 0.5
+
+# 角色/部门成员关系版本号在进程内缓存的秒数, 其他进程的写入最迟在该时间后生效
+MEMBERSHIP_VERSION_SECONDS = 5
+
+# 分页总数缓存秒数, 按数据库中的模型版本号(ModelVersion)失效, 未配置共享缓存(如上方Redis的CACHES)时各进程分别缓存;
+# 在随后回滚的事务中读取的总数最多保留该秒数; 主表估算也按该秒数缓存
+# 主表估算行数超过该值时按执行计划估算, 返回估算值(approximate), 0为不估算
+COUNT_CACHE_TIMEOUT = 60
+COUNT_ESTIMATE_THRESHOLD = 200000
+
+# 接口统计: 是否开启, 进程内汇总后由后台线程写入数据库的间隔秒数, 保留天数
+ENDPOINT_METRICS = True
+ENDPOINT_METRICS_FLUSH_SECONDS = 60
+ENDPOINT_METRICS_RETENTION_DAYS = 7
+# 慢查询阈值(ms)及慢查询表最多保留的指纹数
+SLOW_QUERY_MS = 200
+SLOW_QUERY_MAX_ROWS = 500
+# 服务器状态采样间隔(秒)及保留的采样数(默认1小时)
+SERVER_SAMPLER_INTERVAL = 5
+SERVER_SAMPLER_SIZE = 720
+# Prometheus采集令牌, 未设置时仅管理员可访问/api/monitor/metrics
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
 # swagger配置
 SWAGGER_SETTINGS = {
    'LOGIN_URL':'/django/admin/login/',
@@ -210,6 +255,13 @@ LOG_PATH = os.path.join(BASE_DIR, 'log')
 # 如果地址不存在，则自动创建log文件夹
 if not os.path.exists(LOG_PATH):
     os.mkdir(LOG_PATH)
+# 按需性能分析报告的路径及最多保留的文件数
+PROFILE_PATH = os.path.join(LOG_PATH, 'profiles')
+PROFILE_MAX_FILES = 200
+# 文件日志保留天数
+LOG_BACKUP_DAYS = 30
+# 日志队列长度, 写入线程跟不上时超出部分丢弃
+LOG_QUEUE_SIZE = 10000
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -221,64 +273,79 @@ LOGGING = {
         'simple': {  # 简单格式
             'format': '%(levelname)s %(message)s'
         },
+        # JSON行格式, 含请求id
+        'json': {
+            '()': 'utils.log.JsonFormatter',
+        },
     },
     # 过滤
     'filters': {
         'require_debug_true': {
             '()': 'django.utils.log.RequireDebugTrue',
         },
+        'request_id': {
+            '()': 'utils.log.RequestIdFilter',
+        },
+        'only_log': {
+            '()': 'utils.log.LoggerNameFilter',
+            'names': ['log'],
+        },
     },
     # 定义具体处理日志的方式
+    # 文件按日期命名且不重命名, 多进程写入安全; 由queue的后台线程统一写入, 请求线程不做文件IO
     'handlers': {
         # 默认记录所有日志
         'default': {
             'level': 'INFO',
-            'class': 'logging.handlers.RotatingFileHandler',
-            'filename': os.path.join(LOG_PATH, 'all-{}.log'.format(datetime.now().strftime('%Y-%m-%d'))),
-            'maxBytes': 1024 * 1024 * 5,  # 文件大小
-            'backupCount': 5,  # 备份数
-            'formatter': 'standard',  # 输出格式
-            'encoding': 'utf-8',  # 设置默认编码，否则打印出来汉字乱码
+            'class': 'utils.log.DailyFileHandler',
+            'prefix': os.path.join(LOG_PATH, 'all'),
+            'backup_days': LOG_BACKUP_DAYS,
+            'formatter': 'json',
         },
         # 输出错误日志
         'error': {
             'level': 'ERROR',
-            'class': 'logging.handlers.RotatingFileHandler',
-            'filename': os.path.join(LOG_PATH, 'error-{}.log'.format(datetime.now().strftime('%Y-%m-%d'))),
-            'maxBytes': 1024 * 1024 * 5,  # 文件大小
-            'backupCount': 5,  # 备份数
-            'formatter': 'standard',  # 输出格式
-            'encoding': 'utf-8',  # 设置默认编码
+            'class': 'utils.log.DailyFileHandler',
+            'prefix': os.path.join(LOG_PATH, 'error'),
+            'backup_days': LOG_BACKUP_DAYS,
+            'formatter': 'json',
+            'filters': ['only_log'],
         },
         # 控制台输出
         'console': {
             'level': 'DEBUG',
             'class': 'logging.StreamHandler',
-            'filters': ['require_debug_true'],
+            'filters': ['require_debug_true', 'request_id'],
             'formatter': 'standard'
         },
         # 输出info日志
         'info': {
             'level': 'INFO',
-            'class': 'logging.handlers.RotatingFileHandler',
-            'filename': os.path.join(LOG_PATH, 'info-{}.log'.format(datetime.now().strftime('%Y-%m-%d'))),
-            'maxBytes': 1024 * 1024 * 5,
-            'backupCount': 5,
-            'formatter': 'standard',
-            'encoding': 'utf-8',  # 设置默认编码
+            'class': 'utils.log.DailyFileHandler',
+            'prefix': os.path.join(LOG_PATH, 'info'),
+            'backup_days': LOG_BACKUP_DAYS,
+            'formatter': 'json',
+            'filters': ['only_log'],
+        },
+        # 日志队列, 须在被引用的handlers之后配置(按名称排序)
+        'queue': {
+            'class': 'utils.log.QueueListenerHandler',
+            'handlers': ['cfg://handlers.default', 'cfg://handlers.error', 'cfg://handlers.info'],
+            'maxsize': LOG_QUEUE_SIZE,
+            'filters': ['request_id'],
         },
     },
     # 配置用哪几种 handlers 来处理日志
     'loggers': {
         # 类型 为 django 处理所有类型的日志， 默认调用
         'django': {
-            'handlers': ['default', 'console'],
+            'handlers': ['queue', 'console'],
             'level': 'INFO',
             'propagate': False
         },
         # log 调用时需要当作参数传入
         'log': {
-            'handlers': ['error', 'info', 'console', 'default'],
+            'handlers': ['queue', 'console'],
             'level': 'INFO',
             'propagate': True
         },
@@ -313,4 +380,8 @@ LINE_CHANNEL_SECRET = os.environ.get('LINE_CHANNEL_SECRET')
 # Line Login
 LINE_LOGIN_CHANNEL_ID = os.environ.get('LINE_LOGIN_CHANNEL_ID')
 LINE_LOGIN_CHANNEL_SECRET = os.environ.get('LINE_LOGIN_CHANNEL_SECRET')
-LINE_LOGIN_CALLBACK_URL = os.environ.get('LINE_LOGIN_CALLBACK_URL')
\ No newline at end of file
+LINE_LOGIN_CALLBACK_URL = os.environ.get('LINE_LOGIN_CALLBACK_URL')
+
+
+# Redis(待办推送等进程间通知), 未配置时不推送
+REDIS_URL = os.environ.get('REDIS_URL')
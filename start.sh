@@ -6,5 +6,13 @@ if [ v"$DJANGO_ENV" == 'vdev' ]; then
     else
     python manage.py migrate
     python manage.py collectstatic --noinput
-    gunicorn server.wsgi:application -w 4 -k gthread -b 0.0.0.0:80
+    # Prometheus多进程指标目录, 各worker共享, 启动时清空; celery worker使用相同目录即可一并采集
+    export PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus}
+    rm -rf "$PROMETHEUS_MULTIPROC_DIR" && mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+    if [ v"$SERVER_MODE" == 'vasgi' ]; then
+        # ASGI部署, 支持待办推送等长连接
+        gunicorn server.asgi:application -c server/gunicorn_conf.py -w 4 -k uvicorn.workers.UvicornWorker -b 0.0.0.0:80
+    else
+        gunicorn server.wsgi:application -c server/gunicorn_conf.py -w 4 -k gthread -b 0.0.0.0:80
+    fi
 fi
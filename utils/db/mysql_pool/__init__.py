@@ -0,0 +1,3 @@
+"""
+带连接池的MySQL数据库引擎, 用法: DATABASES['default']['ENGINE'] = 'utils.db.mysql_pool'
+"""
@@ -0,0 +1,220 @@
+import os
+import threading
+import time
+from collections import deque
+from django.db import OperationalError
+
+# 默认连接池配置, 可在DATABASES[alias]['POOL']中覆盖
+POOL_DEFAULTS = {
+    'SIZE': 10,  # 每个进程的最大连接数
+    'MAX_LIFETIME': 1800,  # 连接最长使用秒数, 应小于MySQL的wait_timeout
+    'TIMEOUT': 10,  # 连接全部占用时等待的秒数, 超时抛出OperationalError
+    'PRE_PING': True,  # 取出空闲连接时先ping, 失效则重建
+}
+
+_pools = {}
+_pools_lock = threading.Lock()
+_inherited = []  # fork前父进程的连接, 保留引用避免回收时关闭父进程仍在使用的连接
+
+
+class ConnectionPool:
+    """
+    进程内数据库连接池, 线程安全; 空闲连接后进先出, 使热连接优先复用
+    """
+
+    def __init__(self, size, max_lifetime, timeout, pre_ping):
+        self.size = size
+        self.max_lifetime = max_lifetime
+        self.timeout = timeout
+        self.pre_ping = pre_ping
+        self.pid = os.getpid()
+        self.cond = threading.Condition()
+        self.idle = deque()  # (连接, 创建时间)
+        self.born = {}  # id(连接) -> 创建时间
+        self.initialized = set()  # 已执行init_connection_state的连接
+        self.in_use = 0
+        self.opened = 0
+        # 累计值
+        self.created = 0
+        self.closed = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.ping_failures = 0
+        self.wait_seconds = 0
+
+    def acquire(self, factory):
+        """
+        取出连接, factory用于新建物理连接
+        """
+        deadline = None
+        with self.cond:
+            while True:
+                if self.idle:
+                    conn, created = self.idle.pop()
+                    self.in_use += 1
+                    break
+                if self.opened < self.size:
+                    conn = None
+                    self.opened += 1
+                    self.in_use += 1
+                    break
+                # 连接全部占用, 等待归还
+                now = time.monotonic()
+                if deadline is None:
+                    deadline = now + self.timeout
+                    self.waits += 1
+                    started = now
+                if now >= deadline:
+                    self.timeouts += 1
+                    self.wait_seconds += now - started
+                    raise OperationalError('数据库连接池已满({}), 等待{}秒超时'.format(self.size, self.timeout))
+                self.cond.wait(deadline - now)
+            if deadline is not None:
+                self.wait_seconds += time.monotonic() - started
+        try:
+            if conn is not None and time.monotonic() - created >= self.max_lifetime:
+                self.discard(conn)
+                conn = None
+            if conn is not None and self.pre_ping and not self.ping(conn):
+                self.discard(conn)
+                conn = None
+            if conn is None:
+                conn = self.create(factory)
+        except BaseException:
+            with self.cond:
+                self.in_use -= 1
+                self.opened -= 1
+                self.cond.notify()
+            raise
+        return conn
+
+    def create(self, factory):
+        conn = factory()
+        with self.cond:
+            self.born[id(conn)] = time.monotonic()
+            self.created += 1
+        return conn
+
+    def ping(self, conn):
+        try:
+            conn.ping()
+            return True
+        except Exception:
+            self.ping_failures += 1
+            return False
+
+    def release(self, conn, discard=False):
+        """
+        归还连接; discard为True或超过最长使用时间时关闭
+        """
+        created = self.born.get(id(conn))
+        if created is None:  # 非本连接池的连接(如fork前父进程取出), 保留引用不关闭
+            _inherited.append(conn)
+            return
+        if discard or time.monotonic() - created >= self.max_lifetime:
+            self.discard(conn)
+            with self.cond:
+                self.in_use -= 1
+                self.opened -= 1
+                self.cond.notify()
+            return
+        with self.cond:
+            self.in_use -= 1
+            self.idle.append((conn, created))
+            self.cond.notify()
+
+    def discard(self, conn):
+        """
+        关闭物理连接, 连接名额由调用方处理
+        """
+        with self.cond:
+            self.born.pop(id(conn), None)
+            self.initialized.discard(id(conn))
+            self.closed += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def mark_initialized(self, conn):
+        """
+        标记连接已初始化, 返回是否为首次
+        """
+        with self.cond:
+            if id(conn) in self.initialized:
+                return False
+            self.initialized.add(id(conn))
+            return True
+
+    def get_stats(self):
+        with self.cond:
+            return {
+                'size': self.size,
+                'in_use': self.in_use,
+                'idle': len(self.idle),
+                'created': self.created,
+                'closed': self.closed,
+                'waits': self.waits,
+                'timeouts': self.timeouts,
+                'ping_failures': self.ping_failures,
+                'wait_seconds': round(self.wait_seconds, 3),
+            }
+
+
+def get_pool(alias, settings_dict):
+    pid = os.getpid()
+    pool = _pools.get(alias)
+    if pool is not None and pool.pid == pid:
+        return pool
+    with _pools_lock:
+        pool = _pools.get(alias)
+        if pool is None or pool.pid != pid:
+            if pool is not None:
+                _inherited.extend(i[0] for i in pool.idle)
+            config = dict(POOL_DEFAULTS, **settings_dict.get('POOL', {}))
+            pool = _pools[alias] = ConnectionPool(
+                config['SIZE'], config['MAX_LIFETIME'], config['TIMEOUT'], config['PRE_PING'])
+        return pool
+
+
+def get_pool_stats():
+    """
+    本进程各数据库别名的连接池统计
+    """
+    pid = os.getpid()
+    return {alias: pool.get_stats() for alias, pool in list(_pools.items()) if pool.pid == pid}
+
+
+class PooledDatabaseWrapperMixin:
+    """
+    DatabaseWrapper混入: 新建连接改为从连接池取出, 关闭连接改为归还连接池;
+    Django在每个请求结束时关闭连接(CONN_MAX_AGE=0), 即请求结束时归还
+    """
+
+    def get_pool(self):
+        return get_pool(self.alias, self.settings_dict)
+
+    def get_new_connection(self, conn_params):
+        factory = super().get_new_connection
+        return self.get_pool().acquire(lambda: factory(conn_params))
+
+    def init_connection_state(self):
+        # 会话设置只需在物理连接上执行一次
+        if self.get_pool().mark_initialized(self.connection):
+            super().init_connection_state()
+
+    def _set_autocommit(self, autocommit):
+        # 连接池中的连接通常已是所需模式, 省去一次往返
+        get_autocommit = getattr(self.connection, 'get_autocommit', None)
+        if get_autocommit is not None and get_autocommit() == autocommit:
+            return
+        super()._set_autocommit(autocommit)
+
+    def _close(self):
+        if self.connection is None:
+            return
+        # 事务中关闭、自动提交被修改或出错后的连接不再复用
+        discard = self.in_atomic_block or self.errors_occurred or \
+            self.autocommit != self.settings_dict['AUTOCOMMIT']
+        with self.wrap_database_errors:
+            self.get_pool().release(self.connection, discard=discard)
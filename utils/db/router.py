@@ -0,0 +1,87 @@
+import contextvars
+import time
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.deprecation import MiddlewareMixin
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+PIN_COOKIE = 'db_pin'
+
+routing_state = contextvars.ContextVar('db_routing', default=None)
+
+
+class RoutingState:
+    """
+    单次请求的读库选择, 请求内发生写入后改读主库
+    """
+
+    def __init__(self, read_replica):
+        self.read_replica = read_replica
+        self.wrote = False
+
+
+def get_replica():
+    alias = getattr(settings, 'REPLICA_DATABASE', None)
+    return alias if alias and alias in settings.DATABASES else None
+
+
+class ReplicaRouter:
+    """
+    读写分离: 只有ReplicaMiddleware标记的安全方法请求读从库;
+    事务内(如TicketViewSet.create/handle)、select_for_update及写入均走主库
+    """
+
+    def db_for_read(self, model, **hints):
+        state = routing_state.get()
+        if state is None or not state.read_replica:
+            return None
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        return get_replica()
+
+    def db_for_write(self, model, **hints):
+        state = routing_state.get()
+        if state is not None:
+            state.wrote = True
+            state.read_replica = False
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True  # 主从数据相同
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == get_replica():
+            return False
+        return None
+
+
+class ReplicaMiddleware(MiddlewareMixin):
+    """
+    GET/HEAD/OPTIONS请求读从库; 发生写入的请求返回Cookie db_pin,
+    REPLICA_PIN_SECONDS内该客户端的请求仍读主库, 保证读到自己的写入
+    """
+
+    def process_request(self, request):
+        if get_replica() is None:
+            return
+        read_replica = request.method in SAFE_METHODS and not self.is_pinned(request)
+        state = RoutingState(read_replica)
+        request._db_routing = (state, routing_state.set(state))
+
+    def is_pinned(self, request):
+        try:
+            return float(request.COOKIES.get(PIN_COOKIE, 0)) > time.time()
+        except ValueError:
+            return False
+
+    def process_response(self, request, response):
+        routing = getattr(request, '_db_routing', None)
+        if routing is None:
+            return response
+        state, token = routing
+        routing_state.reset(token)
+        if state.wrote or request.method not in SAFE_METHODS:
+            seconds = settings.REPLICA_PIN_SECONDS
+            response.set_cookie(PIN_COOKIE, str(int(time.time() + seconds)), max_age=seconds, httponly=True,
+                                samesite='Lax')
+        return response
@@ -0,0 +1,147 @@
+import csv
+import json
+import re
+import zipfile
+import zlib
+from datetime import date, datetime
+from decimal import Decimal
+from xml.sax.saxutils import escape
+from django.utils import timezone
+
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+XLSX_FLUSH_ROWS = 500
+_illegal_xml_chars = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+def format_value(value):
+    """
+    导出单元格值, 时间转为本地时间字符串
+    """
+    if isinstance(value, datetime):
+        if timezone.is_aware(value):
+            value = timezone.localtime(value)
+        return value.strftime(DATETIME_FORMAT)
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+class StreamBuffer:
+    """
+    只写缓冲区, 供csv/zipfile写入后由生成器取出
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(data if isinstance(data, str) else bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = ''.join(self.chunks).encode('utf-8') if self.chunks and isinstance(self.chunks[0], str) \
+            else b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def iter_csv(headers, rows):
+    buffer = StreamBuffer()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')  # BOM, Excel打开中文不乱码
+    writer.writerow(headers)
+    yield buffer.pop()
+    for row in rows:
+        writer.writerow([json.dumps(i, ensure_ascii=False) if isinstance(i, (dict, list)) else i for i in row])
+        yield buffer.pop()
+
+
+def iter_jsonl(headers, rows):
+    for row in rows:
+        yield (json.dumps(dict(zip(headers, row)), ensure_ascii=False, default=str) + '\n').encode('utf-8')
+
+
+XLSX_FILES = {
+    '[Content_Types].xml':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>',
+    '_rels/.rels':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/></Relationships>',
+    'xl/workbook.xml':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Sheet1" sheetId="1" r:id="rId1"/></sheets></workbook>',
+    'xl/_rels/workbook.xml.rels':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/></Relationships>',
+}
+
+
+def xlsx_cell(value):
+    if value is None:
+        return '<c/>'
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return '<c t="n"><v>{}</v></c>'.format(value)
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value, ensure_ascii=False)
+    value = _illegal_xml_chars.sub('', str(value))
+    return '<c t="inlineStr"><is><t xml:space="preserve">{}</t></is></c>'.format(escape(value))
+
+
+def iter_xlsx(headers, rows):
+    """
+    逐行写入sheet并随zip压缩输出, 无需第三方库, 内存占用与行数无关
+    """
+    buffer = StreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name, content in XLSX_FILES.items():
+            zf.writestr(name, content)
+        with zf.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write(b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                        b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>')
+            lines = ['<row>{}</row>'.format(''.join(xlsx_cell(i) for i in headers))]
+            for row in rows:
+                lines.append('<row>{}</row>'.format(''.join(xlsx_cell(i) for i in row)))
+                if len(lines) >= XLSX_FLUSH_ROWS:
+                    sheet.write(''.join(lines).encode('utf-8'))
+                    lines = []
+                    yield buffer.pop()
+            lines.append('</sheetData></worksheet>')
+            sheet.write(''.join(lines).encode('utf-8'))
+    yield buffer.pop()
+
+
+def iter_gzip(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+EXPORT_TYPES = {
+    'csv': (iter_csv, 'text/csv; charset=utf-8'),
+    'jsonl': (iter_jsonl, 'application/x-ndjson; charset=utf-8'),
+    'xlsx': (iter_xlsx, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+}
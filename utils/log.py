@@ -0,0 +1,139 @@
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+from datetime import date, datetime, timedelta
+from logging.handlers import QueueHandler, QueueListener
+
+request_id = contextvars.ContextVar('request_id', default='-')
+
+
+class RequestIdFilter(logging.Filter):
+    """
+    在产生日志的线程中写入当前请求id
+    """
+
+    def filter(self, record):
+        record.request_id = request_id.get()
+        return True
+
+
+class LoggerNameFilter(logging.Filter):
+    """
+    只接收指定logger(含子logger)的日志, 用于共用一个队列时区分各文件的来源
+    """
+
+    def __init__(self, names=()):
+        super().__init__()
+        self.names = tuple(names)
+
+    def filter(self, record):
+        return any(record.name == i or record.name.startswith(i + '.') for i in self.names)
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    JSON行格式
+    """
+
+    def format(self, record):
+        data = {
+            'time': datetime.fromtimestamp(record.created).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3],
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'module': record.module,
+            'func': record.funcName,
+            'line': record.lineno,
+            'process': record.process,
+            'request_id': getattr(record, 'request_id', '-'),
+        }
+        if record.exc_info:
+            data['exc_info'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data['exc_info'] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class DailyFileHandler(logging.FileHandler):
+    """
+    按日期写入{prefix}-YYYY-MM-DD.log, 跨天时切换到新文件;
+    不重命名文件, 多进程以追加方式写同一文件也不会损坏, 超过backup_days的文件自动删除
+    """
+
+    def __init__(self, prefix, backup_days=30, encoding='utf-8'):
+        self.prefix = prefix
+        self.backup_days = backup_days
+        self.current_date = date.today()
+        super().__init__(self.get_filename(self.current_date), mode='a', encoding=encoding, delay=True)
+
+    def get_filename(self, day):
+        return '{}-{}.log'.format(self.prefix, day.strftime('%Y-%m-%d'))
+
+    def emit(self, record):
+        today = date.today()
+        if today != self.current_date:
+            self.current_date = today
+            if self.stream:
+                self.stream.close()
+                self.stream = None
+            self.baseFilename = os.path.abspath(self.get_filename(today))
+            self.prune()
+        super().emit(record)
+
+    def prune(self):
+        directory, name = os.path.split(self.prefix)
+        expire = (self.current_date - timedelta(days=self.backup_days)).strftime('%Y-%m-%d')
+        for file in os.listdir(directory or '.'):
+            day = file[len(name) + 1:-len('.log')]
+            if file.startswith(name + '-') and file.endswith('.log') and len(day) == 10 and day < expire:
+                try:
+                    os.remove(os.path.join(directory, file))
+                except OSError:  # 其他进程已删除
+                    pass
+
+
+class QueueListenerHandler(QueueHandler):
+    """
+    请求线程只将日志放入队列, 每个进程由一个后台线程写入handlers;
+    队列满时丢弃并计数, 不阻塞请求; fork出的子进程(如celery prefork)重新启动写入线程
+    """
+
+    def __init__(self, handlers, maxsize=10000):
+        self.maxsize = maxsize
+        self.handlers = [handlers[i] for i in range(len(handlers))]  # 解析dictConfig的cfg://引用
+        self.dropped = 0
+        super().__init__(queue.Queue(maxsize))
+        self.start()
+        atexit.register(self.stop)
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self.restart)
+
+    def start(self):
+        self.listener = QueueListener(self.queue, *self.handlers, respect_handler_level=True)
+        self.listener.start()
+
+    def restart(self):
+        self.queue = queue.Queue(self.maxsize)
+        self.start()
+
+    def stop(self):
+        if self.listener._thread is not None:
+            self.listener.stop()
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        # 异常信息在入队前格式化, 保留给JsonFormatter
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.message = record.getMessage()
+        record.msg, record.args, record.exc_info = record.message, None, None
+        return record
+
@@ -1,7 +1,11 @@
 from django.db import models
+from django.dispatch import Signal
 import django.utils.timezone as timezone
 from django.db.models.query import QuerySet
 
+# queryset软删除(update)不触发post_save, 以此信号通知依赖该模型的缓存失效, sender为模型
+post_soft_delete = Signal()
+
 # 自定义软删除查询基类
 
 
@@ -14,10 +18,13 @@ class SoftDeletableQuerySetMixin(object):
     def delete(self, soft=True):
         '''
         Soft delete objects from queryset (set their ``is_deleted``
-        field to True)
+        field to True). ``update_time`` is refreshed so that it records
+        the deletion time, as ``SoftModel.delete`` does.
         '''
         if soft:
-            self.update(is_deleted=True)
+            rows = self.update(is_deleted=True, update_time=timezone.now())
+            post_soft_delete.send(sender=self.model, queryset=self, rows=rows)
+            return rows
         else:
             return super(SoftDeletableQuerySetMixin, self).delete()
 
@@ -1,23 +1,190 @@
-from rest_framework.pagination import PageNumberPagination
+import hashlib
+from collections import OrderedDict
+from rest_framework.pagination import PageNumberPagination, CursorPagination
 from rest_framework.exceptions import ParseError
+from rest_framework.filters import OrderingFilter
+from rest_framework.response import Response
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.core.exceptions import EmptyResultSet
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.functional import cached_property
+
+
+def estimate_count(queryset):
+    """
+    通过执行计划估算行数, 不执行COUNT; 不支持的数据库返回None
+    """
+    connection = connections[queryset.db]
+    try:
+        sql, params = queryset.order_by().query.sql_with_params()
+    except EmptyResultSet:
+        return 0
+    with connection.cursor() as cursor:
+        if connection.vendor == 'mysql':
+            cursor.execute('EXPLAIN ' + sql, params)
+            columns = [i[0] for i in cursor.description]
+            rows = [dict(zip(columns, i)) for i in cursor.fetchall()]
+            # 取首个驱动表的估算行数乘以过滤比例
+            row = rows[0] if rows else {}
+            return int((row.get('rows') or 0) * float(row.get('filtered') or 100) / 100)
+        if connection.vendor == 'postgresql':
+            cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+            plan = cursor.fetchone()[0]
+            return int(plan[0]['Plan']['Plan Rows'])
+    return None
+
+
+def get_table_estimate(queryset):
+    """
+    查询主表的估算行数(不含过滤条件), 按COUNT_CACHE_TIMEOUT缓存, 避免每次列表都执行EXPLAIN
+    """
+    model = queryset.model
+    key = 'count_estimate__{}__{}'.format(queryset.db, model._meta.db_table)
+    estimate = cache.get(key)
+    if estimate is None:
+        estimate = estimate_count(model._base_manager.using(queryset.db).all())
+        if estimate is None:  # 不支持估算的数据库
+            estimate = -1
+        cache.set(key, estimate, settings.COUNT_CACHE_TIMEOUT)
+    return estimate
+
+
+def get_count(queryset):
+    """
+    获取查询总数, 返回(总数, 是否为估算值)
+    按SQL及所涉模型的版本号(ModelVersion, 见apps.system.versions)缓存, 表有写入时自动失效;
+    版本号存于数据库, 各进程读到的版本号一致, 未配置共享缓存时各进程分别缓存;
+    查询涉及未登记版本号的模型时不缓存; 读从库时不缓存: 从库延迟期间的总数会以新版本号缓存;
+    主表估算行数不少于COUNT_ESTIMATE_THRESHOLD时才执行计划估算, 无过滤条件时直接使用主表估算值
+    """
+    from apps.system.versions import get_query_labels, get_versions
+    queryset = queryset.order_by()
+    try:
+        sql, params = queryset.query.sql_with_params()
+    except EmptyResultSet:
+        return 0, False
+    key = None
+    labels = get_query_labels(queryset.query) if queryset.db == DEFAULT_DB_ALIAS else None
+    if labels:
+        signature = '{}|{}|{!r}|{}'.format(queryset.db, sql, params, get_versions(labels))
+        key = 'count__' + hashlib.md5(signature.encode()).hexdigest()
+        result = cache.get(key)
+        if result is not None:
+            return result
+    threshold = settings.COUNT_ESTIMATE_THRESHOLD
+    result = None
+    if threshold and not queryset.query.combinator:
+        table_estimate = get_table_estimate(queryset)
+        if table_estimate >= threshold:
+            query = queryset.query
+            unfiltered = not query.where and not query.distinct and len(query.alias_map) <= 1
+            estimate = table_estimate if unfiltered else estimate_count(queryset)
+            if estimate is not None and estimate >= threshold:
+                result = (estimate, True)
+    if result is None:
+        result = (queryset.count(), False)
+    if key is not None:
+        cache.set(key, result, settings.COUNT_CACHE_TIMEOUT)
+    return result
+
+
+def count_exceeds(queryset, limit):
+    """
+    是否不少于limit条, 只统计前limit条
+    """
+    return queryset.order_by()[:limit].count() >= limit
+
+
+class CachedCountPaginator(Paginator):
+    """
+    总数使用get_count, 可能为缓存值或估算值
+    """
+    approximate = False
+
+    @cached_property
+    def count(self):
+        if not hasattr(self.object_list, 'query'):
+            return super().count
+        count, self.approximate = get_count(self.object_list)
+        return count
+
+
+class KeysetPagination(CursorPagination):
+    """
+    游标分页, 按视图的排序字段定位, 不执行COUNT及OFFSET
+    """
+    page_size = 10
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    estimate_query_param = 'estimate'
+
+    def get_ordering(self, request, queryset, view):
+        ordering = OrderingFilter().get_ordering(request, queryset, view) \
+            or queryset.query.order_by or queryset.model._meta.ordering or ['-pk']
+        if isinstance(ordering, str):
+            ordering = [ordering]
+        for i in ordering:
+            if '__' in i or i.lstrip('-') not in [f.attname for f in queryset.model._meta.concrete_fields] + ['pk']:
+                raise ParseError('游标分页不支持该排序字段: {}'.format(i))
+        return tuple(ordering)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.estimate = None
+        if request.query_params.get(self.estimate_query_param, None):
+            self.estimate = estimate_count(queryset)
+        return super().paginate_queryset(queryset, request, view=view)
+
+    def get_paginated_response(self, data):
+        rdata = {'next': self.get_next_link(), 'previous': self.get_previous_link(), 'results': data}
+        if self.estimate is not None:
+            rdata['estimate'] = self.estimate
+        return Response(rdata)
+
 
 class MyPagination(PageNumberPagination):
     page_size = 10
     page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    django_paginator_class = CachedCountPaginator
+
+    def use_cursor(self, queryset, request, view):
+        """
+        视图声明cursor_pagination且请求携带cursor参数(可为空表示首页)时使用游标分页;
+        union等组合查询无法附加游标条件, 仍使用页码分页
+        """
+        return getattr(view, 'cursor_pagination', False) and self.cursor_query_param in request.query_params \
+            and not queryset.query.combinator
 
     def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if self.use_cursor(queryset, request, view):
+            self.keyset = KeysetPagination()
+            return self.keyset.paginate_queryset(queryset, request, view=view)
         if request.query_params.get('pageoff', None) or request.query_params.get('page', None) == '0':
-            if queryset.count() < 800:
+            if not count_exceeds(queryset, 800):
                 return None
             raise ParseError('单次请求数据量大,请分页获取')
         return super().paginate_queryset(queryset, request, view=view)
 
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return Response(OrderedDict([
+            ('count', self.page.paginator.count),
+            ('approximate', self.page.paginator.approximate),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
+
 class PageOrNot:
     def paginate_queryset(self, queryset):
         if (self.paginator is None):
             return None
-        elif self.request.query_params.get('pageoff', None) and queryset.count()<500:
-            return None
-        elif self.request.query_params.get('pageoff', None) and queryset.count()>=500:
+        elif self.request.query_params.get('pageoff', None):
+            if not count_exceeds(queryset, 500):
+                return None
             raise ParseError('单次请求数据量大,请求中止')
         return self.paginator.paginate_queryset(queryset, self.request, view=self)
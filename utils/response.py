@@ -1,10 +1,23 @@
 from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
 from rest_framework.views import exception_handler
 from rest_framework.response import Response
 import rest_framework.status as status
 import logging
 logger = logging.getLogger('log')
 
+try:
+    import orjson
+except ImportError:  # 未安装orjson时使用DRF自带的json编码
+    orjson = None
+
+# datetime等交给DRF的编码器处理, 保持与原输出格式一致
+# 与DRF编码的差异: NaN/Infinity编码为null, DRF(STRICT_JSON)则抛出ValueError
+ORJSON_OPTIONS = (orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME) if orjson else 0
+_drf_encoder = JSONEncoder()
+LINE_SEPARATOR = '\u2028'.encode()
+PARAGRAPH_SEPARATOR = '\u2029'.encode()
+
 class BaseResponse(object):
     """
     封装的返回信息类
@@ -45,19 +58,28 @@ class FitJSONRenderer(JSONRenderer):
         :param renderer_context:
         :return: {"code":200,"data":"X","msg":"X"}
         """
-        response_body = BaseResponse()
-        response = renderer_context.get("response")
-        response_body.code = response.status_code
-        if response_body.code >= 400:  # 响应异常
-            response_body.data = data  # data里是详细异常信息
-            prefix = ""
-            if isinstance(data, dict):
-                prefix = list(data.keys())[0]
-                data = data[prefix]
-            if isinstance(data, list):
-                data = data[0]
-            response_body.msg = prefix + ":" + str(data) # 取一部分放入msg,方便前端alert
-        else:
-            response_body.data = data
-        renderer_context.get("response").status_code = 200  # 统一成200响应,用code区分
-        return super(FitJSONRenderer, self).render(response_body.dict, accepted_media_type, renderer_context)
+        response = renderer_context.get("response") if renderer_context else None
+        code = response.status_code if response is not None else 200
+        msg = None
+        if code >= 400:  # 响应异常, data里是详细异常信息
+            detail, prefix = data, ""
+            if isinstance(detail, dict) and detail:
+                prefix = next(iter(detail))
+                detail = detail[prefix]
+            if isinstance(detail, list) and detail:
+                detail = detail[0]
+            msg = prefix + ":" + str(detail) # 取一部分放入msg,方便前端alert
+        if response is not None:
+            response.status_code = 200  # 统一成200响应,用code区分
+        body = {'code': code, 'data': data, 'msg': msg}
+        if orjson is None or self.ensure_ascii or not self.compact or \
+                self.get_indent(accepted_media_type, renderer_context or {}):
+            return super(FitJSONRenderer, self).render(body, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(body, default=_drf_encoder.default, option=ORJSON_OPTIONS)
+        except orjson.JSONEncodeError:  # 如超出64位的整数, 交由标准库处理
+            return super(FitJSONRenderer, self).render(body, accepted_media_type, renderer_context)
+        # 与DRF一致转义U+2028/U+2029, 保证输出是合法的JavaScript
+        if LINE_SEPARATOR in ret or PARAGRAPH_SEPARATOR in ret:
+            ret = ret.replace(LINE_SEPARATOR, b'\\u2028').replace(PARAGRAPH_SEPARATOR, b'\\u2029')
+        return ret